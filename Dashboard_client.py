@@ -1,21 +1,37 @@
 # VERSION 10: with CAN
+import argparse
 import can
 import grpc
 import threading
 import host_pb2
-import host_pb2_grpc
 import logging
 import random
+from can_protocol import (MOTOR_COMMAND_ID, MC_STOP, MC_START, MC_THROTTLE, MC_DIRECTION, DELTA_ENCODING,
+                          TELEMETRY_COMPRESSION_METADATA, TELEMETRY_ENCODING_METADATA, DeltaDecoder,
+                          make_frame, format_aggregate, format_node_status, format_telemetry, describe_message)
+from client_runtime import COMPRESSION_ALGORITHMS, SERVER_ADDRESS, HostClient, add_address_argument
+from host_logging import SAMPLED, add_logging_arguments, sample, setup_logging_from_args
 
-class DashboardClient:
-    def __init__(self, client_id="dashboard"):
-        self.client_id = client_id
-        self.channel = grpc.insecure_channel('localhost:50051')
-        self.stub = host_pb2_grpc.HostControlStub(self.channel)
-        self._running = False
-        self._stop_event = threading.Event()
-        self.message_queue = []
-        self.queue_lock = threading.Lock()
+logger = logging.getLogger("dashboard")
+telemetry_log = logging.getLogger("dashboard.telemetry")
+
+class DashboardClient(HostClient):
+    log_prefix = "[Dashboard]"
+
+    def __init__(self, client_id="dashboard", topics=(), address=SERVER_ADDRESS, delta=False, compression=None):
+        super().__init__(client_id, address, compression)
+        self.topics = list(topics)  # Telemetry subscriptions, e.g. 'board:BMS'; none means all telemetry
+        self.delta = delta          # ask for delta-encoded telemetry (for links where bandwidth is scarce)
+        self.decoder = DeltaDecoder()
+
+    def stream_metadata(self):
+        """CommandStream metadata asking the server for this client's telemetry encoding"""
+        metadata = []
+        if self.delta:
+            metadata.append((TELEMETRY_ENCODING_METADATA, DELTA_ENCODING))
+        if self.compression:
+            metadata.append((TELEMETRY_COMPRESSION_METADATA, self.compression))
+        return metadata
         
     def command_stream(self):
         """Generate motor commands based on user input"""
@@ -23,26 +39,54 @@ class DashboardClient:
         yield host_pb2.HostMessage(
             sender=self.client_id,
             recipient="motor_control",
-            command="Dashboard connected" # this doesn't send to motor controller properly, but it isn't necessary
+            command="Dashboard connected", # this doesn't send to motor controller properly, but it isn't necessary
+            topics=self.topics
         )
         
-        while not self._stop_event.is_set():
-            # Check if there are messages to send
-            with self.queue_lock:
-                if self.message_queue:
-                    command = self.message_queue.pop(0)
-                    message = host_pb2.HostMessage(
-                        sender=self.client_id,
-                        recipient="motor_control",
-                        command=command  # Command format is already prepared
-                    )
-                    print(f"[Dashboard] Sending CAN message: {command}") # command holds the motor control data
-                    yield message
+        # Send each command as soon as the input loop queues it
+        for data in self.outbound_items():
+            message = host_pb2.HostMessage(
+                sender=self.client_id,
+                recipient="motor_control",
+                kind=host_pb2.MOTOR_COMMAND,
+                frame=make_frame(MOTOR_COMMAND_ID, data)
+            )
+            logger.info(f"[Dashboard] Sending CAN message: {describe_message(message)}")
+            yield message
     
     def process_responses(self, response_iterator):
         """Process responses from the server (telemetry updates)"""
         for response in response_iterator:
-            print(f"[Dashboard] Received from {response.sender}: {response.command}") # command holds the telemetry data
+            frames = self.decoder.decode(response)
+            if frames:
+                for frame in frames:
+                    if sample(telemetry_log):
+                        telemetry_log.info(f"[Dashboard] Received from {response.sender}: {format_telemetry(frame)}",
+                                           extra=SAMPLED)
+            elif response.kind == host_pb2.NODE_STATUS:
+                status = response.node_status
+                log = logger.info if status.alive else logger.warning
+                log(f"[Dashboard] Liveness from {response.sender}: {format_node_status(status)}")
+            elif response.kind == host_pb2.TELEMETRY_AGGREGATE:
+                for aggregate in response.aggregates:
+                    if sample(telemetry_log):
+                        telemetry_log.info(f"[Dashboard] Received from {response.sender}: {format_aggregate(aggregate)}",
+                                           extra=SAMPLED)
+            else:
+                logger.info(f"[Dashboard] Received from {response.sender}: {response.command}")
+    
+    def show_snapshot(self):
+        """Show the latest value of every subscribed board without waiting for it to send again"""
+        try:
+            snapshot = self.stub.GetSnapshot(host_pb2.HostMessage(sender=self.client_id, topics=self.topics),
+                                             timeout=5)
+        except grpc.RpcError as e:
+            logger.error(f"[Dashboard] Could not get the telemetry snapshot: {e.details()}")
+            return
+        if not snapshot.frames:
+            logger.info("[Dashboard] No telemetry received by the server yet")
+        for frame in snapshot.frames:
+            logger.info(f"[Dashboard] Current value: {format_telemetry(frame)}")
     
     def input_loop(self):
         """Handle user input from terminal"""
@@ -62,14 +106,14 @@ class DashboardClient:
                     self.stop()
                     break
     
-                # Motor Control Commands (using correct CAN ID 0x123 = 291 from can.c)
+                # Motor Control Commands (sent as CAN frames to ID 0x123 = 291 from can.c)
                 elif user_input.lower().startswith('start:'):
                     parts = user_input.split(':')
                     if len(parts) == 2:
                         try:
                             throttle = int(parts[1])
                             if 1 <= throttle <= 100:  # Changed to 1-100 range
-                                command = f"motor:291:34,{throttle}"  # MC_START (0x22 = 34) + throttle value
+                                command = bytes([MC_START, throttle])
                                 print(f"[Dashboard] Starting motor with {throttle}% throttle")
                             else:
                                 print("[Dashboard] Throttle must be 1-100")
@@ -82,7 +126,7 @@ class DashboardClient:
                         continue
                     
                 elif user_input.lower() == 'stop':
-                    command = f"motor:291:17"  # MC_STOP (0x11 = 17)
+                    command = bytes([MC_STOP])
                     print("[Dashboard] Stopping motor")
 
                 elif user_input.lower().startswith('throttle:'):
@@ -91,7 +135,7 @@ class DashboardClient:
                         try:
                             throttle = int(parts[1])
                             if 1 <= throttle <= 100:  # Changed to 1-100 range
-                                command = f"motor:291:51,{throttle}"  # MC_THROTTLE (0x33 = 51) + throttle value
+                                command = bytes([MC_THROTTLE, throttle])
                                 print(f"[Dashboard] Setting throttle to {throttle}%")
                             else:
                                 print("[Dashboard] Throttle must be 1-100")
@@ -104,11 +148,11 @@ class DashboardClient:
                         continue
 
                 elif user_input.lower() in ['forward', 'fwd', 'f']:
-                    command = f"motor:291:68,1"  # MC_DIRECTION (0x44 = 68), 1 = forward
+                    command = bytes([MC_DIRECTION, 1])  # 1 = forward
                     print("[Dashboard] Setting direction to FORWARD")
 
                 elif user_input.lower() in ['reverse', 'rev', 'r']:
-                    command = f"motor:291:68,0"  # MC_DIRECTION (0x44 = 68), 0 = reverse
+                    command = bytes([MC_DIRECTION, 0])  # 0 = reverse
                     print("[Dashboard] Setting direction to REVERSE")
 
                 else:
@@ -116,41 +160,48 @@ class DashboardClient:
                     continue
         
                 # Add the command to the message queue
-                with self.queue_lock:
-                    self.message_queue.append(command)
+                self.send(command)
             
             except EOFError:
                 break
     
     def start(self):
         """Start the dashboard client"""
-        self._running = True
-        self._stop_event.clear()
         print(f"[Dashboard] Client starting with ID: {self.client_id}")
+        self.show_snapshot()
         
         # Start input thread
         input_thread = threading.Thread(target=self.input_loop)
         input_thread.daemon = True
         input_thread.start()
         
-        try:
-            # Start bidirectional streaming
-            responses = self.stub.CommandStream(self.command_stream())
-            self.process_responses(responses)
-        except grpc.RpcError as e:
-            print(f"[Dashboard] RPC error: {e}")
-        finally:
-            self._running = False
-            self.channel.close()
-    
-    def stop(self):
-        """Stop the dashboard client"""
-        self._stop_event.set()
-        print("[Dashboard] Client stopping...")
+        # Start bidirectional streaming
+        self.run_stream(self.stub.CommandStream, self.command_stream(), self.stream_metadata())
 
 if __name__ == "__main__":
-    client = DashboardClient()
-    try:
-        client.start()
-    except KeyboardInterrupt:
-        client.stop()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Waterloop dashboard client")
+    parser.add_argument("--id", default="dashboard", help="unique client ID (one per dashboard)")
+    parser.add_argument("--topic", action="append", default=[],
+                        help="telemetry to subscribe to: 'board:BMS', 'id:0x1E', 'id:0x600-0x6FF', optionally "
+                             "rate limited: 'board:IMU@10', 'all@2:agg' (repeatable, default all)")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="print the current value of every subscribed board and exit")
+    parser.add_argument("--delta", action="store_true",
+                        help="receive only the signals that changed since the last update, with a full "
+                             "keyframe every second (for a remote dashboard on a slow link)")
+    parser.add_argument("--compression", choices=sorted(COMPRESSION_ALGORITHMS),
+                        help="compress the stream in both directions")
+    add_address_argument(parser)
+    add_logging_arguments(parser)
+    # Full-rate telemetry would flood the terminal; sample it unless asked otherwise
+    parser.set_defaults(log_rate=20)
+    args = parser.parse_args()
+    setup_logging_from_args(args)
+    client = DashboardClient(args.id, args.topic, args.address, args.delta, args.compression)
+    if args.snapshot:
+        client.show_snapshot()
+    else:
+        try:
+            client.start()
+        except KeyboardInterrupt:
+            client.stop()
\ No newline at end of file
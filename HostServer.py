@@ -1,37 +1,502 @@
+import argparse
+import asyncio
 import grpc
 from concurrent import futures
 import host_pb2
 import host_pb2_grpc
+from can_protocol import (ALL_TELEMETRY, DELTA_ENCODING, MC_STOP, MOTOR_COMMAND_ID, TELEMETRY_COMPRESSION_METADATA,
+                          TELEMETRY_ENCODING_METADATA, TELEMETRY_LAYOUTS, DeltaEncoder, describe_message,
+                          parse_topic, topic_ids)
 import threading
-import queue
+import collections
+import logging
+import os
+import signal
+import socket
 import time
 
+from client_runtime import COMPRESSION_ALGORITHMS, UNIX_SOCKET_PATH
+from host_logging import add_logging_arguments, setup_logging_from_args
+from flight_recorder import FlightRecorder
+from ingest_pool import IngestWorker
+from shm_ring import SHM_RING_NAME, RingIngest
+from host_metrics import LatencyHistogram, StreamCounts, metrics_text, start_metrics_server
+
+# Log categories (see host_logging). Per-message lines are DEBUG and never written under the router lock.
+router_log = logging.getLogger("host.router")
+stream_log = logging.getLogger("host.stream")
+
+
+# Traffic classes: each client queue keeps one lane per class
+EMERGENCY_TRAFFIC = "emergency"   # MC_STOP
+ALERT_TRAFFIC = "alert"           # CAN node liveness changes
+CONTROL_TRAFFIC = "control"       # every other motor command
+STATUS_TRAFFIC = "status"
+TELEMETRY_TRAFFIC = "telemetry"
+
+# Strict dequeue order: a lane is only read once every lane before it is empty
+LANE_PRIORITY = (EMERGENCY_TRAFFIC, ALERT_TRAFFIC, CONTROL_TRAFFIC, STATUS_TRAFFIC, TELEMETRY_TRAFFIC)
+# Classes routed to their recipient without waiting for the router lock
+PRIORITY_TRAFFIC = (EMERGENCY_TRAFFIC, ALERT_TRAFFIC, CONTROL_TRAFFIC)
+
+# Overflow policies for a full lane
+DROP_OLDEST = "drop_oldest"     # discard the oldest queued message
+LATEST_VALUE = "latest_value"   # a newer frame replaces the queued one with the same CAN ID; drop oldest when full
+NEVER_DROP = "never_drop"       # never discard (motor commands are human-rate, so the lane stays small)
+
+# Traffic class -> (overflow policy, max queued messages)
+DEFAULT_LANE_POLICIES = {
+    EMERGENCY_TRAFFIC: (NEVER_DROP, None),
+    ALERT_TRAFFIC: (NEVER_DROP, None),
+    CONTROL_TRAFFIC: (NEVER_DROP, None),
+    STATUS_TRAFFIC: (DROP_OLDEST, 64),
+    TELEMETRY_TRAFFIC: (LATEST_VALUE, 256),
+}
+
+
+def traffic_class(message):
+    """Which lane of a client queue a message goes into"""
+    if message.kind in (host_pb2.TELEMETRY, host_pb2.TELEMETRY_BATCH, host_pb2.TELEMETRY_AGGREGATE):
+        return TELEMETRY_TRAFFIC
+    if message.kind == host_pb2.MOTOR_COMMAND:
+        frame = message.frame
+        if frame.arbitration_id == MOTOR_COMMAND_ID and frame.data[:1] == bytes([MC_STOP]):
+            return EMERGENCY_TRAFFIC
+        return CONTROL_TRAFFIC
+    if message.kind == host_pb2.NODE_STATUS:
+        return ALERT_TRAFFIC
+    return STATUS_TRAFFIC
+
+
+class _Window:
+    """Frames of one CAN ID held back by a TelemetryConflator since its last update"""
+    __slots__ = ("interval", "aggregate", "latest", "count", "stats", "start", "next_send")
+
+    def __init__(self, interval, aggregate):
+        self.interval = interval
+        self.aggregate = aggregate
+        self.latest = None
+        self.count = 0
+        self.stats = {}          # signal -> [min, max, sum, samples], aggregate windows only
+        self.start = None
+        self.next_send = 0.0     # the first frame always goes out straight away
+
+
+class TelemetryConflator:
+    """Per-subscriber rate limit of telemetry, one window per CAN ID.
+
+    A frame goes out at once if its CAN ID has not sent for a full interval; otherwise it
+    replaces the held frame and the newest value goes out when the interval ends (so a
+    burst costs at most two updates and the final value is never lost). Aggregate rules
+    send a TelemetryAggregate instead: the newest frame plus the frame count and
+    min/max/mean of every signal over the window, so peaks between updates stay visible.
+
+    Not thread safe: ClientQueue calls it with its lock held."""
+
+    def __init__(self, rules):
+        # CAN ID (None for every other ID) -> (seconds between updates, aggregate), or None for no limit
+        self.rules = rules
+        self.default_rule = rules.get(None)
+        self.windows = {}
+        self.conflated = 0   # frames held back and merged into a later update
+
+    def add(self, message, now):
+        """Messages to queue now for an incoming telemetry message (possibly none)"""
+        frames = message.frames if message.kind == host_pb2.TELEMETRY_BATCH else (message.frame,)
+        passed, released = [], {}   # released: CAN ID -> window, each at most once per batch
+        for frame in frames:
+            can_id = frame.arbitration_id
+            window = self.windows.get(can_id)
+            if window is None:
+                rule = self.rules.get(can_id, self.default_rule)
+                if rule is None:
+                    passed.append(frame)
+                    continue
+                window = self.windows[can_id] = _Window(*rule)
+            if window.count == 0:
+                window.start = frame.timestamp
+            window.latest = frame
+            window.count += 1
+            if window.aggregate:
+                self._accumulate(window, frame)
+            if now >= window.next_send and can_id not in released:
+                released[can_id] = window
+            else:
+                self.conflated += 1
+        if not released and len(passed) == len(frames):
+            return [message]
+        released = list(released.values())
+        return self._messages(passed + self._take(released, now), released, message.sender)
+
+    def release(self, now):
+        """(messages whose interval has ended, seconds until the next one does or None)"""
+        due, next_due = [], None
+        for window in self.windows.values():
+            if not window.count:
+                continue
+            if now >= window.next_send:
+                due.append(window)
+            elif next_due is None or window.next_send < next_due:
+                next_due = window.next_send
+        wait = None if next_due is None else next_due - now
+        if not due:
+            return [], wait
+        return self._messages(self._take(due, now), due, "server"), wait
+
+    @staticmethod
+    def _accumulate(window, frame):
+        layout = TELEMETRY_LAYOUTS.get(frame.arbitration_id)
+        signals = layout.decode(bytes(frame.data)) if layout else None
+        for name, value in (signals or {}).items():
+            stats = window.stats.get(name)
+            if stats is None:
+                window.stats[name] = [value, value, value, 1]
+            else:
+                if value < stats[0]:
+                    stats[0] = value
+                if value > stats[1]:
+                    stats[1] = value
+                stats[2] += value
+                stats[3] += 1
+
+    @staticmethod
+    def _take(windows, now):
+        """Newest frames of the latest-value windows; every window restarts its interval"""
+        frames = []
+        for window in windows:
+            if not window.aggregate:
+                frames.append(window.latest)
+            window.next_send = now + window.interval
+        return frames
+
+    def _messages(self, frames, windows, sender):
+        messages = []
+        if len(frames) == 1:
+            messages.append(host_pb2.HostMessage(sender=sender, kind=host_pb2.TELEMETRY, frame=frames[0]))
+        elif frames:
+            messages.append(host_pb2.HostMessage(sender=sender, kind=host_pb2.TELEMETRY_BATCH, frames=frames))
+        aggregates = []
+        for window in windows:
+            if window.aggregate:
+                aggregates.append(host_pb2.TelemetryAggregate(
+                    latest=window.latest,
+                    count=window.count,
+                    window_start=window.start,
+                    signals=[host_pb2.SignalStats(name=name, min=low, max=high, mean=total / samples)
+                             for name, (low, high, total, samples) in window.stats.items()],
+                ))
+                window.stats = {}
+            window.latest = None
+            window.count = 0
+        if aggregates:
+            messages.append(host_pb2.HostMessage(sender=sender, kind=host_pb2.TELEMETRY_AGGREGATE,
+                                                 aggregates=aggregates))
+        return messages
+
+
+class ClientQueue:
+    """Per-client mailbox that wakes its reader as soon as a message arrives.
+    Messages are kept in one bounded lane per traffic class. Lanes are read in LANE_PRIORITY
+    order, each in arrival order. An MC_STOP overtakes everything queued before it, so it
+    also discards the motor commands still queued: none of them may reach the motor after it."""
+
+    def __init__(self, lane_policies=None):
+        self.lane_policies = lane_policies or DEFAULT_LANE_POLICIES
+        # Lane: key -> (sequence number, message, enqueue time, serialized size). Keys are
+        # CAN IDs for LATEST_VALUE telemetry, otherwise the sequence number itself
+        self.lanes = {name: collections.OrderedDict() for name in LANE_PRIORITY if name in self.lane_policies}
+        self.dropped = dict.fromkeys(self.lane_policies, 0)
+        self.sequence = 0
+        self.size = 0
+        # Metrics (read with stats())
+        self.delivered = 0
+        self.delivered_bytes = 0
+        self.latency = LatencyHistogram()
+        self.conflator = None   # TelemetryConflator when the client asked for rate-limited telemetry
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.closed = False
+
+    def put(self, message, size=None):
+        """Queue a message and wake the waiting stream, if any.
+        size is the message's ByteSize(), if the caller already knows it."""
+        if size is None:
+            size = message.ByteSize()
+        with self.lock:
+            if self.closed:
+                return False
+            if self.conflator is not None and traffic_class(message) == TELEMETRY_TRAFFIC:
+                # Always wake the reader: a held frame may move its next release earlier
+                for message in self.conflator.add(message, time.monotonic()):
+                    self._push(message, None)
+            else:
+                self._push(message, size)
+            self._notify()
+            return True
+
+    def set_rate_limits(self, rules):
+        """Rate-limit telemetry per CAN ID (see TelemetryConflator); no rules removes the limits"""
+        with self.lock:
+            self.conflator = TelemetryConflator(rules) if any(rules.values()) else None
+
+    def _push(self, message, size):
+        """Apply the lane's overflow policy and queue the message. Called with self.lock held."""
+        if size is None:
+            size = message.ByteSize()
+        name = traffic_class(message)
+        lane = self.lanes[name]
+        policy, capacity = self.lane_policies[name]
+        self.sequence += 1
+        now = time.monotonic()
+        
+        key = ("seq", self.sequence)
+        if policy == LATEST_VALUE and message.kind == host_pb2.TELEMETRY:
+            key = ("can", message.frame.arbitration_id)
+            if key in lane:
+                # Keep the queued frame's place in line (and enqueue time, for the latency
+                # metric) but deliver the newest value
+                sequence, _, enqueued_at, _ = lane[key]
+                lane[key] = (sequence, message, enqueued_at, size)
+                self.dropped[name] += 1
+                return
+        
+        if name == EMERGENCY_TRAFFIC and self.lanes.get(CONTROL_TRAFFIC):
+            # A START or THROTTLE sent before the STOP must not go out after it
+            control = self.lanes[CONTROL_TRAFFIC]
+            self.dropped[CONTROL_TRAFFIC] += len(control)
+            self.size -= len(control)
+            control.clear()
+        
+        if policy != NEVER_DROP and capacity is not None and len(lane) >= capacity:
+            lane.popitem(last=False)
+            self.dropped[name] += 1
+            self.size -= 1
+        lane[key] = (self.sequence, message, now, size)
+        self.size += 1
+
+    def _release(self):
+        """Queue rate-limited telemetry whose interval has ended. Returns the seconds until
+        more is due, or None. Called with self.lock held."""
+        if self.conflator is None:
+            return None
+        messages, wait = self.conflator.release(time.monotonic())
+        for message in messages:
+            self._push(message, None)
+        return wait
+
+    def _pop(self):
+        """Oldest message across all lanes, or None if the mailbox is empty. Called with self.lock held."""
+        if not self.size:
+            return None
+        for lane in self.lanes.values():
+            if lane:
+                break
+        self.size -= 1
+        _, message, enqueued_at, size = lane.popitem(last=False)[1]
+        self.delivered += 1
+        self.delivered_bytes += size
+        self.latency.observe(time.monotonic() - enqueued_at)
+        return message
+
+    def _notify(self):
+        self.ready.notify()
+
+    def get(self, timeout=None):
+        """Block until a message arrives, the queue is closed or the timeout expires.
+        timeout=None waits indefinitely, timeout=0 never blocks."""
+        with self.lock:
+            deadline = None if not timeout else time.monotonic() + timeout
+            while True:
+                release_in = self._release()
+                if self.size or self.closed or timeout == 0:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                if release_in is not None and (remaining is None or release_in < remaining):
+                    remaining = release_in
+                self.ready.wait(remaining)
+            return self._pop()
+
+    def stats(self):
+        """Delivery counters, per-lane depth and drops, and the latency histogram snapshot"""
+        with self.lock:
+            return {
+                "delivered": self.delivered,
+                "delivered_bytes": self.delivered_bytes,
+                "depth": {name: len(lane) for name, lane in self.lanes.items()},
+                "dropped": dict(self.dropped),
+                "conflated": self.conflator.conflated if self.conflator is not None else 0,
+                "latency": self.latency.snapshot(),
+            }
+
+    def close(self):
+        """Release any stream blocked in get(); further puts are refused"""
+        with self.lock:
+            self.closed = True
+            self._notify_all()
+
+    def _notify_all(self):
+        self.ready.notify_all()
+
+
+class AsyncClientQueue(ClientQueue):
+    """ClientQueue whose reader is a coroutine on the grpc.aio event loop.
+    put() may still be called from any thread."""
+
+    def __init__(self, lane_policies=None):
+        super().__init__(lane_policies)
+        self.loop = asyncio.get_running_loop()
+        self.ready = asyncio.Event()
+
+    def _notify(self):
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self.ready.set()
+        else:
+            self.loop.call_soon_threadsafe(self.ready.set)
+
+    _notify_all = _notify
+
+    async def get(self, timeout=None):
+        """Await the next message; same timeout semantics as ClientQueue.get"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                release_in = self._release()
+                message = self._pop()
+                if message is not None or self.closed or timeout == 0:
+                    return message
+                self.ready.clear()
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            wait = remaining
+            if release_in is not None and (wait is None or release_in < wait):
+                wait = release_in
+            try:
+                await asyncio.wait_for(self.ready.wait(), wait)
+            except asyncio.TimeoutError:
+                if wait == remaining:
+                    return None
+
+
 class MessageRouter:
     """Ensures that messages can be sent from one client to another"""
 
-    def __init__(self):
+    def __init__(self, queue_factory=ClientQueue, lane_policies=None, recorder=None):
         # Dictionary to store message queues for each client
         # Key: client_id (string), Value: queue of messages
         self.client_queues = {}
+        self.queue_factory = queue_factory
+        self.lane_policies = lane_policies     # None uses DEFAULT_LANE_POLICIES
+        # Telemetry subscriptions. Key: client_id, Value: set of CAN IDs, or None for all telemetry
+        self.subscriptions = {}
+        # Prebuilt from subscriptions so routing a frame is one dict lookup:
+        # CAN ID -> queues subscribed to it (including 'all' subscribers), and the 'all' queues
+        # for every other ID
+        self.topic_index = {}
+        self.wildcard_queues = ()
+        # (sender, recipient, kind) -> [messages, bytes, undelivered messages], for host_metrics
+        self.route_counts = {}
+        self.recorder = recorder   # flight_recorder.FlightRecorder, or None
+        # Latest-value table: CAN ID -> newest CanFrame routed, served by GetSnapshot
+        self.latest_frames = {}
         self.lock = threading.Lock()
     
 
-    def register_client(self, client_id, client_type):
-        """Connects any client to the server using a unique client id"""
+    def register_client(self, client_id, client_type, topics=()):
+        """Connects any client to the server using a unique client id.
+        Dashboards subscribe to all telemetry unless they ask for specific topics."""
         with self.lock:
-            if client_id not in self.client_queues:
-                self.client_queues[client_id] = queue.Queue()
-                print(f"[Server] Client registered: {client_id} (type: {client_type})")
-                return True
-            return False
+            if client_id in self.client_queues:
+                return False
+            self.client_queues[client_id] = self.queue_factory(self.lane_policies)
+            subscribed = None
+            if topics or client_type == "dashboard":
+                subscribed = self._subscribe(client_id, topics or [ALL_TELEMETRY])
+        router_log.info(f"[Server] Client registered: {client_id} (type: {client_type})")
+        if subscribed is not None:
+            self._log_subscription(client_id, *subscribed)
+        return True
     
 
     def unregister_client(self, client_id):
         """Removes any client from the server. Useful for the final host application."""
         with self.lock:
-            if client_id in self.client_queues:
-                del self.client_queues[client_id]
-                print(f"[Server] Client unregistered: {client_id}")
+            if client_id not in self.client_queues:
+                return
+            self.client_queues.pop(client_id).close()
+            if client_id in self.subscriptions:
+                del self.subscriptions[client_id]
+                self._rebuild_topic_index()
+        router_log.info(f"[Server] Client unregistered: {client_id}")
+    
+
+    def subscribe(self, client_id, topics):
+        """Replace a client's telemetry subscriptions (see can_protocol.parse_topic for the syntax)"""
+        with self.lock:
+            if client_id not in self.client_queues:
+                return
+            subscribed = self._subscribe(client_id, topics)
+        self._log_subscription(client_id, *subscribed)
+    
+
+    def _subscribe(self, client_id, topics):
+        """Called with self.lock held. Returns (topics, errors) for _log_subscription."""
+        can_ids = set()
+        errors = []
+        # CAN ID (None for 'all') -> (seconds between updates, aggregate), None where unlimited;
+        # a topic naming an ID explicitly overrides the rate of 'all'
+        rate_limits = {}
+        for topic in topics:
+            try:
+                ids, rate, aggregate = parse_topic(topic)
+            except ValueError as e:
+                errors.append(e)
+                continue
+            rule = (1.0 / rate, aggregate) if rate else None
+            if ids is None:
+                can_ids = None
+                rate_limits[None] = rule
+                continue
+            if can_ids is not None:
+                can_ids |= ids
+            rate_limits.update(dict.fromkeys(ids, rule))
+        self.subscriptions[client_id] = can_ids
+        self.client_queues[client_id].set_rate_limits(rate_limits)
+        self._rebuild_topic_index()
+        return topics, errors
+    
+
+    def _log_subscription(self, client_id, topics, errors):
+        """Logged after the lock is released"""
+        for e in errors:
+            router_log.warning(f"[Server] Ignoring subscription from {client_id}: {e}")
+        router_log.info(f"[Server] {client_id} subscribed to: {', '.join(topics)}")
+    
+
+    def _rebuild_topic_index(self):
+        """Called with self.lock held, whenever subscriptions change"""
+        wildcard = tuple(self.client_queues[client_id]
+                         for client_id, can_ids in self.subscriptions.items() if can_ids is None)
+        index = {}
+        for client_id, can_ids in self.subscriptions.items():
+            for can_id in can_ids or ():
+                index.setdefault(can_id, list(wildcard)).append(self.client_queues[client_id])
+        self.topic_index = {can_id: tuple(queues) for can_id, queues in index.items()}
+        self.wildcard_queues = wildcard
+    
+
+    def close_client(self, client_id):
+        """Wakes a stream blocked in get_message so it can exit (e.g. the RPC was cancelled)"""
+        with self.lock:
+            client_queue = self.client_queues.get(client_id)
+        if client_queue:
+            client_queue.close()
     
 
     def route_message(self, message):
@@ -39,42 +504,196 @@ class MessageRouter:
         sender = message.sender
         recipient = message.recipient
         
-        print(f"[Server] Routing message: {sender} -> {recipient}: {message.command}")
+        if router_log.isEnabledFor(logging.DEBUG):
+            router_log.debug(f"[Server] Routing message: {sender} -> {recipient}: {describe_message(message)}")
+        
+        size = message.ByteSize()
+        if self.recorder is not None:
+            self.recorder.record(message)
+        
+        # Reserved path for motor commands and alerts: queue them straight away instead of
+        # waiting for the router lock behind a telemetry fan-out
+        if traffic_class(message) in PRIORITY_TRAFFIC:
+            if recipient == "broadcast":
+                delivered = True
+                for client_id, client_queue in list(self.client_queues.items()):
+                    if client_id != sender:
+                        client_queue.put(message, size)
+            else:
+                client_queue = self.client_queues.get(recipient)
+                delivered = client_queue is not None and client_queue.put(message, size)
+            with self.lock:
+                self._count(sender, recipient, message.kind, size, delivered)
+            return delivered
         
         # essential to multithreaded applications,protects access to subscribers (telemetry, motor control, dashboard)
         with self.lock:     
+            # Telemetry goes to whoever subscribed to its CAN IDs
+            if message.kind in (host_pb2.TELEMETRY, host_pb2.TELEMETRY_BATCH):
+                delivered = self._publish(message, size)
             # Queue the message for the recipient
-            if recipient in self.client_queues:
-                self.client_queues[recipient].put(message)
-                return True
+            elif recipient in self.client_queues:
+                self.client_queues[recipient].put(message, size)
+                delivered = True
             elif recipient == "broadcast":
                 # Queue for all clients except sender
                 for client_id, q in self.client_queues.items():
                     if client_id != sender:
-                        q.put(message)
-                return True
-            return False
+                        q.put(message, size)
+                delivered = True
+            else:
+                delivered = False
+            
+            self._count(sender, recipient, message.kind, size, delivered)
+            return delivered
     
 
-    def get_message(self, client_id, timeout=0.1):
-        """Get next message for a client, or None if no message is available"""
-        if client_id in self.client_queues:
-            try:
-                return self.client_queues[client_id].get(block=False)
-            except queue.Empty:
-                return None
+    def _count(self, sender, recipient, kind, size, delivered):
+        """Update the route's metrics. Called with self.lock held."""
+        counts = self.route_counts.get((sender, recipient, kind))
+        if counts is None:
+            counts = self.route_counts[(sender, recipient, kind)] = [0, 0, 0]
+        counts[0] += 1
+        counts[1] += size
+        if not delivered:
+            counts[2] += 1
+    
+
+    def _publish(self, message, size):
+        """Queue telemetry for its subscribers. Called with self.lock held."""
+        topic_index, wildcard = self.topic_index, self.wildcard_queues
+        if message.kind == host_pb2.TELEMETRY:
+            self.latest_frames[message.frame.arbitration_id] = message.frame
+            subscribers = topic_index.get(message.frame.arbitration_id, wildcard)
+            for client_queue in subscribers:
+                client_queue.put(message, size)
+            return bool(subscribers)
+        
+        # A batch is forwarded whole to subscribers of all its frames, otherwise split
+        frames = message.frames
+        latest_frames = self.latest_frames
+        selected = {}
+        for frame in frames:
+            latest_frames[frame.arbitration_id] = frame
+            for client_queue in topic_index.get(frame.arbitration_id, wildcard):
+                selected.setdefault(client_queue, []).append(frame)
+        for client_queue, queue_frames in selected.items():
+            if len(queue_frames) == len(frames):
+                client_queue.put(message, size)
+            else:
+                client_queue.put(host_pb2.HostMessage(
+                    sender=message.sender,
+                    recipient=message.recipient,
+                    kind=host_pb2.TELEMETRY_BATCH,
+                    frames=queue_frames,
+                ))
+        return bool(selected)
+    
+
+    def snapshot(self, topics=()):
+        """Latest frame of every CAN ID matching the topics (all if none), as one
+        TELEMETRY_BATCH message ordered by CAN ID. Raises ValueError for a bad topic."""
+        can_ids = set()
+        for topic in topics or [ALL_TELEMETRY]:
+            ids = topic_ids(topic)
+            if ids is None:
+                can_ids = None
+                break
+            can_ids |= ids
+        with self.lock:
+            latest = dict(self.latest_frames)
+        return host_pb2.HostMessage(
+            sender="server",
+            command="snapshot",
+            kind=host_pb2.TELEMETRY_BATCH,
+            frames=[latest[can_id] for can_id in sorted(latest) if can_ids is None or can_id in can_ids],
+        )
+    
+
+    def drop_counts(self):
+        """Messages dropped so far for each connected client, by traffic class"""
+        with self.lock:
+            client_queues = list(self.client_queues.items())
+        return {client_id: dict(client_queue.dropped) for client_id, client_queue in client_queues}
+    
+
+    def metrics(self):
+        """Prometheus text exposition of the router's counters (see host_metrics)"""
+        return metrics_text(self)
+    
+
+    def get_message(self, client_id, timeout=None):
+        """Get next message for a client. Blocks until one arrives (or up to timeout seconds);
+        returns None on timeout or once the client has been closed/unregistered."""
+        client_queue = self.client_queues.get(client_id)
+        if client_queue:
+            return client_queue.get(timeout)
+        return None
+    
+
+    async def next_message(self, client_id, timeout=None):
+        """Coroutine version of get_message for routers built with AsyncClientQueue"""
+        client_queue = self.client_queues.get(client_id)
+        if client_queue:
+            return await client_queue.get(timeout)
         return None
 
 
+def stream_encoding(context):
+    """DeltaEncoder for a stream whose client asked for delta-encoded telemetry (else None).
+    Also turns on compression of the stream's responses if the client asked for it."""
+    metadata = dict(context.invocation_metadata())
+    compression = metadata.get(TELEMETRY_COMPRESSION_METADATA)
+    if compression:
+        if compression in COMPRESSION_ALGORITHMS:
+            context.set_compression(COMPRESSION_ALGORITHMS[compression])
+        else:
+            stream_log.warning(f"[Server] Unknown compression {compression!r} requested, sending uncompressed")
+    encoding = metadata.get(TELEMETRY_ENCODING_METADATA)
+    if encoding == DELTA_ENCODING:
+        return DeltaEncoder()
+    if encoding:
+        stream_log.warning(f"[Server] Unknown telemetry encoding {encoding!r} requested, sending frames")
+    return None
+
+
 class HostControlServicer(host_pb2_grpc.HostControlServicer):
     """gRPC Control Servicer"""
-    def __init__(self):
-        self.router = MessageRouter()
+    def __init__(self, lane_policies=None, recorder=None, max_streams=None):
+        self.router = MessageRouter(lane_policies=lane_policies, recorder=recorder)
+        self.streams = StreamCounts()
         self.active_streams = set()
+        # Every open stream holds a worker of the thread pool. Telemetry and dashboard streams
+        # beyond max_streams are refused so the rest of the pool stays free for motor control.
+        self.max_streams = max_streams
         self.lock = threading.Lock()
 
+    def _admit(self, rpc, context):
+        """Count a new telemetry/dashboard stream, or abort it if only reserved workers are left"""
+        with self.lock:
+            counts = self.streams.snapshot()
+            admitted = (self.max_streams is None
+                        or counts.get("TelemetryStream", 0) + counts.get("CommandStream", 0) < self.max_streams)
+            if admitted:
+                self.streams.opened(rpc)
+        if not admitted:
+            stream_log.warning(f"[Server] Refused {rpc}: the remaining workers are reserved for motor control")
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "server is at its stream limit")
+
+    def metrics(self):
+        """Prometheus text for the router and the open streams (served by --metrics-port)"""
+        return metrics_text(self.router, self.streams.snapshot())
+
+    def GetSnapshot(self, request, context):
+        """Current value of every telemetry CAN ID, e.g. for a dashboard that just connected"""
+        try:
+            return self.router.snapshot(request.topics)
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
     def TelemetryStream(self, request_iterator, context):
         """Stream for telemetry clients to send updates that get forwarded to dashboard"""
+        self._admit("TelemetryStream", context)
         # Wait for first message to identify the client
         try:
             first_message = next(request_iterator)
@@ -84,77 +703,78 @@ class HostControlServicer(host_pb2_grpc.HostControlServicer):
             # Process first message
             self.router.route_message(first_message)
             
-            # Create a thread to continuously check for messages to send back to this client
-            def send_messages():
-                while context.is_active():
-                    message = self.router.get_message(client_id)
-                    if message:
-                        yield message           # S.J: gRPC part
-                    time.sleep(0.01)  # Small delay to avoid busy-waiting (s.j.: is this really needed?)
-            
-            # Create and start the message sending thread
-            message_thread = threading.Thread(target=lambda: None)
-            message_thread.daemon = True
-            
             # Process remaining incoming messages
             for message in request_iterator:
-                print(f"[Server] Received telemetry: {message.command}")
+                if stream_log.isEnabledFor(logging.DEBUG):
+                    stream_log.debug(f"[Server] Received telemetry: {describe_message(message)}")
                 # Route the message (typically to dashboard)
                 self.router.route_message(message)
                 
-                # Check for any messages to send back
-                response = self.router.get_message(client_id)
+                # Check for any messages to send back (without blocking the telemetry reader)
+                response = self.router.get_message(client_id, timeout=0)
                 if response:
                     yield response
             
         except Exception as e:
-            print(f"[Server] Error in TelemetryStream: {e}")
+            stream_log.error(f"[Server] Error in TelemetryStream: {e}")
         finally:
+            self.streams.closed("TelemetryStream")
             self.router.unregister_client(client_id)
 
     def CommandStream(self, request_iterator, context):
         """Stream for dashboard to send commands to motor control"""
+        self._admit("CommandStream", context)
         try:
             first_message = next(request_iterator)
             client_id = first_message.sender
-            self.router.register_client(client_id, "dashboard")
+            self.router.register_client(client_id, "dashboard", first_message.topics)
+            encoder = stream_encoding(context)
             
             # Process first message (route to motor control)
             self.router.route_message(first_message)
             
-            # Create a queue of messages to send back to dashboard
-            response_queue = queue.Queue()
-            
             # Handle incoming messages from dashboard
             def process_incoming():
                 try:
                     # First message already processed
                     for message in request_iterator:
-                        print(f"[Server] Received command from Dashboard: {message.command}")
+                        if stream_log.isEnabledFor(logging.DEBUG):
+                            stream_log.debug(f"[Server] Received command from Dashboard: {describe_message(message)}")
                         self.router.route_message(message)
                 except Exception as e:
-                    print(f"[Server] Error processing dashboard commands: {e}")
+                    stream_log.error(f"[Server] Error processing dashboard commands: {e}")
             
             # Start thread to handle incoming messages
             incoming_thread = threading.Thread(target=process_incoming)
             incoming_thread.daemon = True
             incoming_thread.start()
             
-            # Send messages to dashboard client
+            # Wake the sender below when the RPC ends so it doesn't block forever
+            if not context.add_callback(lambda: self.router.close_client(client_id)):
+                return  # RPC already terminated
+            
+            # Send messages to dashboard client as soon as they are routed
             while context.is_active():
                 message = self.router.get_message(client_id)
-                if message:
-                    print(f"[Server] Sending to dashboard: {message.command}")
-                    yield message
-                time.sleep(0.01)  # Small delay to avoid busy-waiting
+                if message is None:
+                    break
+                if encoder is not None:
+                    message = encoder.encode(message)
+                    if message is None:
+                        continue   # nothing changed since the last update
+                if stream_log.isEnabledFor(logging.DEBUG):
+                    stream_log.debug(f"[Server] Sending to dashboard: {describe_message(message)}")
+                yield message
                 
         except Exception as e:
-            print(f"[Server] Error in CommandStream: {e}")
+            stream_log.error(f"[Server] Error in CommandStream: {e}")
         finally:
+            self.streams.closed("CommandStream")
             self.router.unregister_client(client_id)
 
     def MotorControlStream(self, request_iterator, context):
         """Stream for motor control client to receive commands and send status updates"""
+        self.streams.opened("MotorControlStream")
         try:
             first_message = next(request_iterator, None)
             if first_message:
@@ -173,37 +793,303 @@ class HostControlServicer(host_pb2_grpc.HostControlServicer):
             def process_incoming():
                 try:
                     for message in request_iterator:
-                        print(f"[Server] Received from Motor Control: {message.command}")
+                        if stream_log.isEnabledFor(logging.DEBUG):
+                            stream_log.debug(f"[Server] Received from Motor Control: {describe_message(message)}")
                         self.router.route_message(message)
                 except Exception as e:
-                    print(f"[Server] Error processing motor control messages: {e}")
+                    stream_log.error(f"[Server] Error processing motor control messages: {e}")
             
             # Start thread to handle incoming messages
             incoming_thread = threading.Thread(target=process_incoming)
             incoming_thread.daemon = True
             incoming_thread.start()
             
-            # Send commands to motor control client
+            # Wake the sender below when the RPC ends so it doesn't block forever
+            if not context.add_callback(lambda: self.router.close_client(client_id)):
+                return  # RPC already terminated
+            
+            # Send commands to motor control client as soon as they are routed
             while context.is_active():
                 message = self.router.get_message(client_id)
-                if message:
-                    print(f"[Server] Sending to motor control: {message.command}")
-                    yield message
-                time.sleep(0.01)  # Small delay to avoid busy-waiting
+                if message is None:
+                    break
+                if stream_log.isEnabledFor(logging.DEBUG):
+                    stream_log.debug(f"[Server] Sending to motor control: {describe_message(message)}")
+                yield message
                 
         except Exception as e:
-            print(f"[Server] Error in MotorControlStream: {e}")
+            stream_log.error(f"[Server] Error in MotorControlStream: {e}")
         finally:
+            self.streams.closed("MotorControlStream")
             self.router.unregister_client(client_id)
 
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    host_pb2_grpc.add_HostControlServicer_to_server(HostControlServicer(), server)
-    server.add_insecure_port('[::]:50051')
+async def _first_message(request_iterator):
+    """First request of a grpc.aio stream, or None if the client closed it straight away"""
+    async for message in request_iterator:
+        return message
+    return None
+
+
+class AsyncHostControlServicer(host_pb2_grpc.HostControlServicer):
+    """grpc.aio Control Servicer. Every stream is a coroutine on one event loop, so the
+    number of concurrent streams is not capped by a thread pool."""
+    def __init__(self, lane_policies=None, recorder=None):
+        self.router = MessageRouter(queue_factory=AsyncClientQueue, lane_policies=lane_policies,
+                                    recorder=recorder)
+        self.streams = StreamCounts()
+
+    def metrics(self):
+        """Prometheus text for the router and the open streams (served by --metrics-port)"""
+        return metrics_text(self.router, self.streams.snapshot())
+
+    async def _process_incoming(self, request_iterator, source):
+        """Route everything the client sends after its first message"""
+        try:
+            async for message in request_iterator:
+                if stream_log.isEnabledFor(logging.DEBUG):
+                    stream_log.debug(f"[Server] Received from {source}: {describe_message(message)}")
+                self.router.route_message(message)
+        except Exception as e:
+            stream_log.error(f"[Server] Error processing {source} messages: {e}")
+
+    async def GetSnapshot(self, request, context):
+        """Current value of every telemetry CAN ID, e.g. for a dashboard that just connected"""
+        try:
+            return self.router.snapshot(request.topics)
+        except ValueError as e:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    async def TelemetryStream(self, request_iterator, context):
+        """Stream for telemetry clients to send updates that get forwarded to dashboard"""
+        client_id = None
+        self.streams.opened("TelemetryStream")
+        try:
+            first_message = await _first_message(request_iterator)
+            if first_message is None:
+                return
+            client_id = first_message.sender
+            self.router.register_client(client_id, "telemetry")
+            self.router.route_message(first_message)
+            
+            async for message in request_iterator:
+                if stream_log.isEnabledFor(logging.DEBUG):
+                    stream_log.debug(f"[Server] Received telemetry: {describe_message(message)}")
+                self.router.route_message(message)
+                
+                # Check for any messages to send back (without waiting on them)
+                response = await self.router.next_message(client_id, timeout=0)
+                if response:
+                    yield response
+            
+        except Exception as e:
+            stream_log.error(f"[Server] Error in TelemetryStream: {e}")
+        finally:
+            self.streams.closed("TelemetryStream")
+            if client_id is not None:
+                self.router.unregister_client(client_id)
+
+    async def CommandStream(self, request_iterator, context):
+        """Stream for dashboard to send commands to motor control"""
+        async for message in self._relay_stream(request_iterator, "CommandStream", "dashboard", "Dashboard",
+                                                encoder=stream_encoding(context)):
+            yield message
+
+    async def MotorControlStream(self, request_iterator, context):
+        """Stream for motor control client to receive commands and send status updates"""
+        async for message in self._relay_stream(request_iterator, "MotorControlStream", "motor_control",
+                                                "Motor Control", default_id=f"motor_control_{id(context)}"):
+            yield message
+
+    async def _relay_stream(self, request_iterator, rpc, client_type, source, default_id=None, encoder=None):
+        """Shared body of CommandStream and MotorControlStream: route the client's
+        messages in a background task and yield whatever is routed to it (through
+        `encoder`, a DeltaEncoder, if given)"""
+        client_id = None
+        incoming = None
+        self.streams.opened(rpc)
+        try:
+            first_message = await _first_message(request_iterator)
+            if first_message:
+                client_id = first_message.sender
+            elif default_id is not None:
+                client_id = default_id
+            else:
+                return
+            
+            self.router.register_client(client_id, client_type, first_message.topics if first_message else ())
+            if first_message:
+                self.router.route_message(first_message)
+            
+            incoming = asyncio.create_task(self._process_incoming(request_iterator, source))
+            
+            # The task is cancelled when the RPC ends, which also ends this wait
+            while True:
+                message = await self.router.next_message(client_id)
+                if message is None:
+                    break
+                if encoder is not None:
+                    message = encoder.encode(message)
+                    if message is None:
+                        continue   # nothing changed since the last update
+                if stream_log.isEnabledFor(logging.DEBUG):
+                    stream_log.debug(f"[Server] Sending to {client_type.replace('_', ' ')}: {describe_message(message)}")
+                yield message
+                
+        except Exception as e:
+            stream_log.error(f"[Server] Error in {source} stream: {e}")
+        finally:
+            self.streams.closed(rpc)
+            if incoming is not None:
+                incoming.cancel()
+            if client_id is not None:
+                self.router.unregister_client(client_id)
+
+
+def _serve_metrics(servicer, metrics_port):
+    if metrics_port:
+        start_metrics_server(servicer.metrics, metrics_port)
+        stream_log.info(f"[Server] Metrics at http://localhost:{metrics_port}/metrics")
+
+
+def _start_recorder(record_dir):
+    """Record this run into a new run-<date>-<time> directory under record_dir"""
+    if not record_dir:
+        return None
+    recorder = FlightRecorder(os.path.join(record_dir, time.strftime("run-%Y%m%d-%H%M%S")))
+    stream_log.info(f"[Server] Recording routed messages to {recorder.directory}")
+    return recorder
+
+
+def _stop_recorder(recorder):
+    if recorder is not None:
+        recorder.close()
+        stream_log.info(f"[Server] Recorded {recorder.recorded} messages to {recorder.directory}")
+
+
+def _start_ingest(router, channels, interface, simulate_rate, shm_ring=None):
+    """One ingest worker process per CAN channel, plus the shared memory ring reader if
+    shm_ring is a ring name, routing their telemetry into `router`"""
+    workers = [IngestWorker(router, interface, channel, simulate_rate=simulate_rate) for channel in channels]
+    if shm_ring:
+        try:
+            workers.append(RingIngest(router, shm_ring))
+        except FileExistsError as e:
+            stream_log.error(f"[Server] Not reading a shared memory ring: {e}")
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def _stop_ingest(workers):
+    for worker in workers:
+        worker.close()
+
+
+def _socket_in_use(path):
+    """Whether a server accepts connections on the Unix domain socket at path"""
+    with socket.socket(socket.AF_UNIX) as probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            return False   # no socket file, or a stale one nobody listens on
+    return True
+
+
+def _add_ports(server, port, unix_socket):
+    """Listen on TCP and, if unix_socket is a path, on that Unix domain socket for clients
+    on the same machine. Returns a description of the listeners for the startup message."""
+    server.add_insecure_port(f'[::]:{port}')
+    if not unix_socket:
+        return f"port {port}"
+    if _socket_in_use(unix_socket):
+        # Binding would unlink the live server's socket and take its local clients
+        stream_log.error(f"[Server] Another server is listening on unix:{unix_socket}, not listening there "
+                         f"(use --unix-socket PATH or --unix-socket '')")
+        return f"port {port}"
+    # gRPC replaces a stale socket file left by a previous run
+    server.add_insecure_port(f'unix:{unix_socket}')
+    return f"port {port} and unix:{unix_socket}"
+
+
+async def serve_async(metrics_port=None, port=50051, record_dir=None, unix_socket=UNIX_SOCKET_PATH,
+                      ingest_channels=(), ingest_interface="socketcan", ingest_simulate=0, shm_ring=None):
+    server = grpc.aio.server()
+    recorder = _start_recorder(record_dir)
+    servicer = AsyncHostControlServicer(recorder=recorder)
+    host_pb2_grpc.add_HostControlServicer_to_server(servicer, server)
+    listening = _add_ports(server, port, unix_socket)
+    await server.start()
+    stream_log.info(f"[Server] Server running on {listening} (asyncio)")
+    _serve_metrics(servicer, metrics_port)
+    ingest = _start_ingest(servicer.router, ingest_channels, ingest_interface, ingest_simulate, shm_ring)
+    # Shut down cleanly on Ctrl+C/SIGTERM: cancelling the loop would skip closing the recording
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, lambda: asyncio.ensure_future(server.stop(None)))
+    try:
+        await server.wait_for_termination()
+    finally:
+        _stop_ingest(ingest)
+        _stop_recorder(recorder)
+
+
+def serve(use_asyncio=False, metrics_port=None, port=50051, max_workers=10, record_dir=None,
+          reserved_workers=1, unix_socket=UNIX_SOCKET_PATH, ingest_channels=(), ingest_interface="socketcan",
+          ingest_simulate=0, shm_ring=None):
+    if use_asyncio:
+        asyncio.run(serve_async(metrics_port, port, record_dir, unix_socket, ingest_channels, ingest_interface,
+                                ingest_simulate, shm_ring))
+        return
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    recorder = _start_recorder(record_dir)
+    servicer = HostControlServicer(recorder=recorder, max_streams=max(1, max_workers - reserved_workers))
+    host_pb2_grpc.add_HostControlServicer_to_server(servicer, server)
+    listening = _add_ports(server, port, unix_socket)
     server.start()
-    print("Server running on port 50051")
-    server.wait_for_termination()
+    stream_log.info(f"[Server] Server running on {listening}")
+    _serve_metrics(servicer, metrics_port)
+    ingest = _start_ingest(servicer.router, ingest_channels, ingest_interface, ingest_simulate, shm_ring)
+    try:
+        server.wait_for_termination()
+    finally:
+        _stop_ingest(ingest)
+        _stop_recorder(recorder)
 
 if __name__ == '__main__':
-    serve()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Waterloop host gRPC server")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="serve with the grpc.aio servicer instead of the thread pool")
+    parser.add_argument("--port", type=int, default=50051, help="gRPC port")
+    parser.add_argument("--unix-socket", default=UNIX_SOCKET_PATH, metavar="PATH",
+                        help="also listen on this Unix domain socket for clients on the same machine ('' to disable)")
+    parser.add_argument("--max-workers", type=int, default=10,
+                        help="thread pool size, i.e. the most concurrent streams (ignored with --asyncio)")
+    parser.add_argument("--reserved-workers", type=int, default=1,
+                        help="thread pool workers kept for MotorControlStream (ignored with --asyncio)")
+    parser.add_argument("--metrics-port", type=int, default=9105,
+                        help="serve Prometheus metrics on localhost at this port (0 to disable)")
+    parser.add_argument("--record", metavar="DIR",
+                        help="record every routed message to a new run directory under DIR (see flight_recorder.py)")
+    parser.add_argument("--ingest", action="append", default=[], metavar="CHANNEL",
+                        help="read telemetry from this CAN channel in a worker process and route it here, "
+                             "instead of through Telemetry_client.py (repeatable)")
+    parser.add_argument("--ingest-interface", default="socketcan",
+                        help="python-can interface for --ingest, e.g. 'virtual' for testing without a bus")
+    parser.add_argument("--ingest-simulate", type=float, default=0, metavar="RATE",
+                        help="with --ingest-interface virtual, generate RATE telemetry frames/s in each worker")
+    parser.add_argument("--shm-ring", nargs="?", const=SHM_RING_NAME, metavar="NAME",
+                        help=f"create a shared memory ring (default name {SHM_RING_NAME}) for a telemetry client "
+                             f"on this machine started with --shm-ring, and route the frames written to it")
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging_from_args(args)
+    # Stop on SIGTERM (e.g. systemd) the same way as Ctrl+C, so the recording is closed cleanly
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        serve(use_asyncio=args.asyncio, metrics_port=args.metrics_port, port=args.port,
+              max_workers=args.max_workers, record_dir=args.record, reserved_workers=args.reserved_workers,
+              unix_socket=args.unix_socket, ingest_channels=args.ingest, ingest_interface=args.ingest_interface,
+              ingest_simulate=args.ingest_simulate, shm_ring=args.shm_ring)
+    except KeyboardInterrupt:
+        pass
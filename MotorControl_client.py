@@ -1,27 +1,44 @@
+import argparse
 import can
-import grpc
-import threading
 import host_pb2
-import host_pb2_grpc
 import logging
 import struct
+from can_protocol import (MAX_CAN_ID, MOTOR_COMMAND_ID, MC_STOP, MC_START, MC_THROTTLE, MC_DIRECTION,
+                          MOTOR_COMMAND_NAMES, parse_legacy_command)
+from can_tx import CanTransmitter
+from client_runtime import SERVER_ADDRESS, HostClient, add_address_argument
+from host_logging import add_logging_arguments, setup_logging_from_args
 
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+logger = logging.getLogger("motor")
 
-######## COMMENT OUT FOR TESTING WITHOUT CAN BUS ########
-# CAN_INTERFACE = 'can0' # Check if can0 is the correct configuration - check with ifconfig or ip a
-# BUS = can.interface.Bus(CAN_INTERFACE, interface= 'socketcan')
-#########################################################
+CAN_INTERFACE = 'can0' # Check if can0 is the correct configuration - check with ifconfig or ip a
 
 
-class MotorControlClient:
-    def __init__(self, client_id="motor_control"):
-        self.client_id = client_id
-        self.channel = grpc.insecure_channel('localhost:50051')
-        self.stub = host_pb2_grpc.HostControlStub(self.channel)
-        self._running = False
-        self._stop_event = threading.Event()
+def describe_motor_command(data):
+    """What a motor command frame does, e.g. 'Setting throttle to 50%'"""
+    if len(data) >= 1 and data[0] == MC_STOP:
+        return "Stopping motor"
+    if len(data) >= 2:
+        if data[0] == MC_START:
+            return f"Starting motor with {data[1]}% throttle"
+        if data[0] == MC_THROTTLE:
+            return f"Setting throttle to {data[1]}%"
+        if data[0] == MC_DIRECTION:
+            return f"Setting motor direction to {'FORWARD' if data[1] == 1 else 'REVERSE'}"
+    return None
+
+
+class MotorControlClient(HostClient):
+    log_prefix = "[Motor]"
+
+    def __init__(self, client_id="motor_control", address=SERVER_ADDRESS, bus=None, keepalive_period=0.1):
+        super().__init__(client_id, address)
+        # With a python-can bus, commands are written by a CanTransmitter thread so the gRPC
+        # loop never waits on the bus; without one they are only logged (testing without CAN)
+        self.tx = CanTransmitter(bus, can_ids=[MOTOR_COMMAND_ID]) if bus is not None else None
+        # While the motor runs, the current throttle is repeated at this period as a keep-alive
+        # (0 sends every command once only)
+        self.keepalive_period = keepalive_period
     
     def empty_stream(self):
         """Generate an initial message to establish the stream"""
@@ -32,135 +49,96 @@ class MotorControlClient:
             command="Motor Control connected"
         )
         
-        # Keep the client connection alive
-        while not self._stop_event.is_set():
-            # We don't send additional messages in this implementation
-            # But we need to keep the generator alive
-            if self._stop_event.wait(10):  # Check stop flag every 10 seconds
-                break
+        # Keep the client connection alive without waking up; anything queued with
+        # send() (e.g. status updates) is forwarded to the server
+        yield from self.outbound_items()
     
     def process_commands(self, response_iterator):
         """Process command messages from the server (from dashboard)"""
-        print("[Motor] Waiting for commands...")
+        logger.info("[Motor] Waiting for commands...")
         for response in response_iterator:
-            if response.sender == "dashboard" and response.command.startswith("motor:"):
-                try:
-                    # Parse the CAN message details from the command
-                    # Expected format: motor:can_id:byte1,byte2,byte3,...
-                    command_parts = response.command.split(":")
-                    if len(command_parts) >= 3:
-                        can_id = int(command_parts[1])
-                        data_bytes = [int(b) for b in command_parts[2].split(",")]
-                        
-                        # Validate CAN ID range
-                        if not (0 <= can_id <= 2047):
-                            print(f"[Motor] Invalid CAN ID: {can_id} (must be 0-2047)")
-                            continue
-                        
-                        # Validate data length (CAN frames can have 0-8 bytes)
-                        if len(data_bytes) > 8:
-                            print(f"[Motor] Data too long: {len(data_bytes)} bytes (max 8)")
-                            continue
-                        
-                        # Validate byte values (0-255)
-                        if any(b < 0 or b > 255 for b in data_bytes):
-                            print(f"[Motor] Invalid byte values: {data_bytes} (must be 0-255)")
-                            continue
-                        
-                        # Parse motor command type for logging
-                        command_type = "UNKNOWN"
-                        if len(data_bytes) > 0:
-                            cmd_byte = data_bytes[0]
-                            command_map = {
-                                17: "MC_STOP",      # 0x11
-                                34: "MC_START",     # 0x22  
-                                51: "MC_THROTTLE",  # 0x33
-                                68: "MC_DIRECTION"  # 0x44
-                            }
-                            command_type = command_map.get(cmd_byte, f"UNKNOWN_CMD_{cmd_byte}")
-                        
-                        # Convert to bytes format for CAN message
-                        data = bytes(data_bytes)
-                        
-                        print(f"[Motor] Received {command_type} command - CAN ID: 0x{can_id:03X}, Data: {data.hex().upper()}")
-                        
-                        # Log specific command details
-                        if len(data_bytes) > 0:
-                            if data_bytes[0] == 34 and len(data_bytes) >= 2:  # MC_START (0x22)
-                                print(f"[Motor] Starting motor with {data_bytes[1]}% throttle")
-                            elif data_bytes[0] == 17:  # MC_STOP (0x11)
-                                print(f"[Motor] Stopping motor")
-                            elif data_bytes[0] == 51 and len(data_bytes) >= 2:  # MC_THROTTLE (0x33)
-                                print(f"[Motor] Setting throttle to {data_bytes[1]}%")
-                            elif data_bytes[0] == 68 and len(data_bytes) >= 2:  # MC_DIRECTION (0x44)
-                                direction = "FORWARD" if data_bytes[1] == 1 else "REVERSE"
-                                print(f"[Motor] Setting motor direction to {direction}")
-                        
-                        ######## COMMENT OUT FOR TESTING WITHOUT THE CAN BUS ########
-                        # Execute the motor command by sending through CAN bus
-                        # self.execute_motor_command(can_id, data)  
-                        #############################################################
-                        
-                        # For testing without CAN bus, simulate the action
-                        print(f"[Motor] Would send CAN message: ID=0x{can_id:03X}, Data={data.hex().upper()}")
-                    
-                    else:
-                        print(f"[Motor] Invalid command format: {response.command}")
-                except ValueError as e:
-                    print(f"[Motor] Error parsing command values: {e}")
-                except Exception as e:
-                    print(f"[Motor] Error processing command: {e}")
+            try:
+                if response.kind == host_pb2.MOTOR_COMMAND and response.HasField("frame"):
+                    can_id = response.frame.arbitration_id
+                    data = bytes(response.frame.data)
+                elif response.sender == "dashboard" and response.command.startswith("motor:"):
+                    # Backward compatibility with the old text format: motor:can_id:byte1,byte2,...
+                    can_id, data = parse_legacy_command(response.command)
+                else:
+                    continue
+                
+                # Validate CAN ID range
+                if not (0 <= can_id <= MAX_CAN_ID):
+                    logger.error(f"[Motor] Invalid CAN ID: {can_id} (must be 0-{MAX_CAN_ID})")
+                    continue
+                
+                # Validate data length (CAN frames can have 0-8 bytes)
+                if len(data) > 8:
+                    logger.error(f"[Motor] Data too long: {len(data)} bytes (max 8)")
+                    continue
+                
+                # Hand the frame to the TX stage first; logging comes after
+                self.execute_motor_command(can_id, data)
+                
+                if logger.isEnabledFor(logging.INFO):
+                    command_type = "UNKNOWN"
+                    if len(data) > 0:
+                        command_type = MOTOR_COMMAND_NAMES.get(data[0], f"UNKNOWN_CMD_{data[0]}")
+                    details = describe_motor_command(data)
+                    logger.info(f"[Motor] Received {command_type} command - CAN ID: 0x{can_id:03X}, "
+                                f"Data: {data.hex().upper()}" + (f" ({details})" if details else "")
+                                + ("" if self.tx else " - no CAN bus, not sent"))
+            
+            except ValueError as e:
+                logger.error(f"[Motor] Error parsing command values: {e}")
+            except Exception as e:
+                logger.error(f"[Motor] Error processing command: {e}")
+    
+    # HostClient.run_stream hands the response stream to process_responses
+    process_responses = process_commands
+    
+    def execute_motor_command(self, can_id, data):
+        """Queue a command for the CAN bus (never blocks). After MC_START/MC_THROTTLE the
+        throttle keep-alive repeats the new value. MC_STOP drops the motor commands still
+        queued, cancels the keep-alive and goes out first (see CanTransmitter.enqueue)."""
+        if self.tx is None:
+            return
+        self.tx.enqueue(can_id, data)
+        if (can_id == MOTOR_COMMAND_ID and self.keepalive_period and len(data) >= 2
+                and data[0] in (MC_START, MC_THROTTLE)):
+            self.tx.set_periodic("throttle", can_id, bytes([MC_THROTTLE, data[1]]), self.keepalive_period)
     
     def start(self):
         """Start the motor control client"""
-        self._running = True
-        self._stop_event.clear()
         print(f"[Motor] Client starting with ID: {self.client_id}")
+        if self.tx is not None:
+            self.tx.start()
         
         try:
             # Start bidirectional streaming but only care about responses
-            responses = self.stub.MotorControlStream(self.empty_stream())
-            self.process_commands(responses)
-        except grpc.RpcError as e:
-            print(f"[Motor] RPC error: {e}")
+            self.run_stream(self.stub.MotorControlStream, self.empty_stream())
         finally:
-            self._running = False
-            self.channel.close()
-    
-    def stop(self):
-        """Stop the motor control client"""
-        self._stop_event.set()
-        print("[Motor] Client stopping...")
+            if self.tx is not None:
+                self.tx.close()
+                stats = self.tx.stats()
+                logger.info(f"[Motor] CAN TX: {stats['sent']} sent, {stats['tx_errors']} errors, "
+                            f"{stats['periodic_errors']} periodic task errors")
 
-    ######## COMMENT OUT FOR TESTING WITHOUT THE CAN BUS ########
-    # def execute_motor_command(self, node_id, data):
-    #     try:
-    #         # Create CAN message with proper formatting
-    #         msg = can.Message(
-    #             arbitration_id=node_id,
-    #             data=data,
-    #             is_extended_id=False,
-    #             dlc=len(data)  # Data Length Code
-    #         )
-            
-    #         # Send the CAN message
-    #         BUS.send(msg)
-    #         logger.info(f"Sent CAN message: ID=0x{node_id:03X}, Data={data.hex().upper()}, DLC={len(data)}")
-            
-    #         # Log command type for debugging (UPDATED with correct command codes, IDLE removed)
-    #         if len(data) > 0:
-    #             cmd_type = {17: "STOP", 34: "START", 51: "THROTTLE", 68: "DIRECTION"}.get(data[0], "UNKNOWN")
-    #             logger.info(f"Motor command executed: {cmd_type}")
-                
-    #     except can.CanError as e:
-    #         logger.error(f"Failed to send CAN message: {e}")
-    #         # GPIO.output(RED, GPIO.HIGH)  # Error indication
-    #     except Exception as e:
-    #         logger.error(f"Unexpected error sending CAN message: {e}")
-    #############################################################
 
 if __name__ == "__main__":
-    client = MotorControlClient()
+    parser = argparse.ArgumentParser(description="Waterloop motor control client")
+    parser.add_argument("--can", action="store_true",
+                        help=f"send the commands on the CAN bus ({CAN_INTERFACE}) instead of only logging them")
+    parser.add_argument("--can-interface", default="socketcan",
+                        help="python-can interface, e.g. 'virtual' for testing without a bus")
+    parser.add_argument("--keepalive-period", type=float, default=0.1,
+                        help="seconds between repeats of the current throttle while the motor runs (0 disables)")
+    add_address_argument(parser)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging_from_args(args)
+    bus = can.interface.Bus(CAN_INTERFACE, interface=args.can_interface) if args.can else None
+    client = MotorControlClient(address=args.address, bus=bus, keepalive_period=args.keepalive_period)
     try:
         client.start()
     except KeyboardInterrupt:
@@ -1,36 +1,66 @@
+import argparse
 import logging
 import random
 import threading
 
 import can
-import grpc
 import host_pb2
-import host_pb2_grpc
+from can_protocol import MAX_CAN_ID, FrameBatcher, make_frame, parse_can_id, format_telemetry, describe_message
+from can_ingest import CanIngest
+from client_runtime import SERVER_ADDRESS, HostClient, add_address_argument
+from host_logging import add_logging_arguments, setup_logging_from_args
+from liveness import LivenessMonitor
+from shm_ring import SHM_RING_NAME, ShmRing, ShmRingWriter
 
 
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+logger = logging.getLogger("telemetry")
 
-######## COMMENT OUT FOR TESTING WITHOUT CAN BUS ########
-# CAN_INTERFACE = 'can0' # Check if can0 is the correct configuration - check with ifconfig or ip a
-# BUS = can.interface.Bus(CAN_INTERFACE, interface= 'socketcan')
-#########################################################
+CAN_INTERFACE = 'can0' # Check if can0 is the correct configuration - check with ifconfig or ip a
 
 
-class TelemetryClient:
+class TelemetryClient(HostClient):
     """
     TelemetryClient manages the connection to a gRPC host server, 
     handles user input for telemetry data, and streams CAN messages 
     to a dashboard client, supporting both random and custom CAN message formats.
     """
-    def __init__(self, client_id="telemetry"):
-        self.client_id = client_id
-        self.channel = grpc.insecure_channel('localhost:50051')
-        self.stub = host_pb2_grpc.HostControlStub(self.channel)
-        self._running = False
-        self._stop_event = threading.Event()
-        self.message_queue = []
-        self.queue_lock = threading.Lock()
+    log_prefix = "[Telemetry]"
+
+    def __init__(self, client_id="telemetry", batch_size=64, batch_delay=0.005, bus=None, address=SERVER_ADDRESS,
+                 liveness_timeout=None, probe_interval=1.0, shm_ring=None, max_backlog=4096):
+        super().__init__(client_id, address)
+        # Frames queued for the stream but not yet batched. When gRPC can't keep up, frames
+        # beyond max_backlog are dropped (and counted as CanIngest overflows) instead of
+        # piling up in memory.
+        self.max_backlog = max_backlog
+        self.backlog = 0
+        self.backlog_lock = threading.Lock()
+        # With a python-can bus, frames are read continuously by a background CanIngest
+        # pipeline, and a LivenessMonitor on the same Notifier reports nodes that go quiet;
+        # without one, telemetry only comes from the terminal
+        self.liveness = None
+        if bus is not None and liveness_timeout:
+            self.liveness = LivenessMonitor(bus, self.report_liveness, timeout=liveness_timeout,
+                                            probe_interval=probe_interval)
+        # With shm_ring (a ring name), bus frames go to the server through that shared memory
+        # ring instead of the gRPC stream (the server must run with --shm-ring). If the server
+        # closes the ring, they go over gRPC until a restarted server creates a new one.
+        self.ring_writer = None
+        if bus is not None and shm_ring:
+            try:
+                self.ring_writer = ShmRingWriter(ShmRing.attach(shm_ring), fallback=self.enqueue_raw)
+            except FileNotFoundError:
+                logger.error(f"[Telemetry] Shared memory ring {shm_ring} not found (is the server running with "
+                             f"--shm-ring?), streaming over gRPC instead")
+        self.ingest = None
+        if bus is not None:
+            listeners = [self.liveness] if self.liveness else []
+            if self.ring_writer is not None:
+                self.ingest = CanIngest(bus, self.ring_writer.write, listeners=listeners, raw=True)
+            else:
+                self.ingest = CanIngest(bus, self.enqueue_frame, listeners=listeners)
+        self.batch_size = batch_size      # Max frames per TELEMETRY_BATCH message
+        self.batch_delay = batch_delay    # Max seconds a frame waits for its batch to fill
     
     def telemetry_stream(self):
         """Stream telemetry data based on user input"""
@@ -41,24 +71,57 @@ class TelemetryClient:
             command = "Telemetry connected"
         )
         
-        while not self._stop_event.is_set():
-            # Check if there are messages to send
-            with self.queue_lock:
-                if self.message_queue:
-                    command = self.message_queue.pop(0)
-                    message = host_pb2.HostMessage(
-                        sender=self.client_id,
-                        recipient="dashboard",
-                        # command=f"telemetry:{command}"
-                        command = command
-                    )
-                    print(f"[Telemetry] Sending CAN message: {command}")
-                    yield message
+        # Coalesce frames so a burst from the bus costs one gRPC message per batch
+        batcher = FrameBatcher(self.client_id, "dashboard", self.batch_size, self.batch_delay)
+        while True:
+            # Sleep until a frame is queued or the pending batch is due
+            item = self.next_outbound(timeout=batcher.time_left())
+            if isinstance(item, host_pb2.HostMessage):
+                # Liveness changes go out at once, ahead of the pending batch
+                yield item
+            elif item is not None:
+                with self.backlog_lock:
+                    self.backlog -= 1
+                batcher.add(item)
+            if self._stop_event.is_set():
+                break
+            if batcher.time_left() == 0:
+                message = batcher.flush()
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"[Telemetry] Sending CAN message: {describe_message(message)}")
+                yield message
+        
+        # Don't lose frames that were already read when stopping
+        while batcher.pending:
+            yield batcher.flush()
+    
+    def enqueue_frame(self, frame):
+        """Queue a CanFrame for the telemetry stream (called by the input loop and CanIngest).
+        Returns False, dropping the frame, if max_backlog frames are already waiting."""
+        with self.backlog_lock:
+            if self.backlog >= self.max_backlog:
+                return False
+            self.backlog += 1
+        self.send(frame)
+        return True
+    
+    def enqueue_raw(self, arbitration_id, data, timestamp):
+        """enqueue_frame() with CanIngest's raw sink signature (the shared memory ring's fallback)"""
+        return self.enqueue_frame(make_frame(arbitration_id, data, timestamp))
+    
+    def report_liveness(self, status):
+        """Broadcast a node going down or coming back (called by the LivenessMonitor)"""
+        self.send(host_pb2.HostMessage(
+            sender=self.client_id,
+            recipient="broadcast",
+            kind=host_pb2.NODE_STATUS,
+            node_status=status,
+        ))
     
     def process_responses(self, response_iterator):
         """Process any responses from the server"""
         for response in response_iterator:
-            print(f"[Telemetry] Received from {response.sender}: {response.command}")
+            logger.info(f"[Telemetry] Received from {response.sender}: {response.command}")
     
     def input_loop(self):
         """Handle user input from terminal"""
@@ -76,29 +139,23 @@ class TelemetryClient:
                 if user_input.lower() == 'exit':
                     self.stop()
                     break
-                
-                # INITIALIZE TELEMETRY DATA RETRIEVAL/PROCESSING
-                ######## COMMENT OUT FOR TESTING WITHOUT THE CAN BUS ########
-                # Execute the motor command by sending through CAN bus
-                # msg = BUS.recv()
-                # command = self.parse_telemetry_data(msg.arbitration_id, msg.data)
-                # print("[Telemetry] Received CAN message from bus:",command) # ??
-                #############################################################
 
-                # Random CAN message generation (change to receive can packets, parse, identify type of data based on id)
+                # Random CAN message generation
                 if user_input.lower() == 'random':
-                    can_id = random.randint(0, 2047)  # Standard CAN ID range
-                    data_bytes = [random.randint(0, 255) for _ in range(random.randint(1, 8))]  # Random 1-8 bytes
-                    data_str = ",".join(str(b) for b in data_bytes)
-                    command = f"telemetry:{can_id}:{data_str}"  # this is the format it will be received in
+                    can_id = random.randint(0, MAX_CAN_ID)  # Standard CAN ID range
+                    data = bytes(random.randint(0, 255) for _ in range(random.randint(1, 8)))  # Random 1-8 bytes
+                    frame = make_frame(can_id, data)
                     
                 # Handle custom CAN message format
                 elif user_input.lower().startswith('can:'):
                     parts = user_input.split(':')
                     if len(parts) >= 3:
-                        command = f"telemetry:{parts[1]}:{parts[2]}"
-                        command = self.parse_telemetry_data(parts[1], parts[2])
-                        print("[Telemetry] Received CAN message from bus:",command) # ??
+                        try:
+                            frame = make_frame(parse_can_id(parts[1]), bytes(int(b) for b in parts[2].split(',')))
+                        except ValueError:
+                            print("[Telemetry] Invalid CAN ID or data bytes")
+                            continue
+                        print("[Telemetry] Received CAN message from bus:", format_telemetry(frame))
                     else:
                         print("[Telemetry] Invalid format. Use can:ID:DATA")
                         continue
@@ -106,17 +163,15 @@ class TelemetryClient:
                     print("[Telemetry] Invalid command")
                     continue
 
-                # Add the Telemetry data (user or random) to the message queue
-                with self.queue_lock:
-                    self.message_queue.append(command)
+                # Add the Telemetry frame (user or random) to the message queue
+                if not self.enqueue_frame(frame):
+                    print("[Telemetry] Stream backlog full, frame dropped")
 
             except EOFError:
                 break
     
     def start(self):
         """Start the telemetry client"""
-        self._running = True
-        self._stop_event.clear()
         print(f"[Telemetry] Client starting with ID: {self.client_id}")
         
         # Start input thread
@@ -124,97 +179,43 @@ class TelemetryClient:
         input_thread.daemon = True
         input_thread.start()
         
+        # Start reading the CAN bus in the background
+        if self.ingest is not None:
+            self.ingest.start()
+        if self.liveness is not None:
+            self.liveness.start()
+        
         try:
             # Start bidirectional streaming
-            responses = self.stub.TelemetryStream(self.telemetry_stream())
-            self.process_responses(responses)
-        except grpc.RpcError as e:
-            print(f"[Telemetry] RPC error: {e}")
+            self.run_stream(self.stub.TelemetryStream, self.telemetry_stream())
         finally:
-            self._running = False
-            self.channel.close()
-    
-    def stop(self):
-        """Stop the telemetry client"""
-        self._stop_event.set()
-        print("[Telemetry] Client stopping...")
-    
-    ######## COMMENT OUT FOR TESTING WITHOUT THE CAN BUS ########
-    def parse_telemetry_data(self, arbitration_id, data): # data comes pre-received from the input loop
-        # converting between hex, string, decimal
-        # hex_string = hex(0x67A)   # '0x67a'
-        # decimal_string = str(0x67A)  # '1658'
-        try:
-            # REMEMBER WHEN TESTING WITH CAN, USE data.hex()
-            # logger.info("Received CAN message with ID=%s, Data=%s", arbitration_id, data.hex())
-            logger.info("Received CAN message with ID=%s, Data=%s", arbitration_id, data) 
-            
-            # Handle data conversion for string input (testing mode)
-            data_bytes = data.split(',') if isinstance(data, str) else data
-            
-            # FOR BYTES OBJECT (REAL CAN DATA) - UNCOMMENT WHEN USING ACTUAL CAN BUS:
-            # data_bytes = list(data) if isinstance(data, bytes) else data.split(',') if isinstance(data, str) else data
-            
-            # UNFINALIZED BOARD IDS
-            BMS_ID = 0x1e       # BMS STM32 Board CAN ID
-            SENSORS_ID = 0x14   # S&T STM32 Board CAN ID
-            IMU_ID = 0xA       # IMU Board CAN ID (not finalized yet)
-
-            # parse the arbitration_id
-            # if arbitration_id == BMS_ID: 
-            if arbitration_id == "0x1e": # BMS STM32 Board CAN ID, should not be a string when testing with CAN
-                # FOR BYTES OBJECT: if arbitration_id == 0x1e:
-                logger.info("Telemetry Data type: BMS")
-                if len(data_bytes) <= 8:
-                    MUX1_TEMP = int(data_bytes[0])
-                    MUX2_TEMP = int(data_bytes[1])
-                    MUX3_TEMP = int(data_bytes[2])
-                    MUX4_TEMP = int(data_bytes[3])
-                    MUX5_TEMP = int(data_bytes[4])
-                    MUX6_TEMP = int(data_bytes[5])
-                    ERROR_ID = int(data_bytes[6])
-                    return f"Telemetry: BMS: MUX1_TEMP={MUX1_TEMP}, MUX2_TEMP={MUX2_TEMP}, MUX3_TEMP={MUX3_TEMP}, MUX4_TEMP={MUX4_TEMP}, MUX5_TEMP={MUX5_TEMP}, MUX6_TEMP={MUX6_TEMP}, ERROR_ID={ERROR_ID}"
-                else:
-                    return f"Telemetry: BMS: {arbitration_id}:{data} (insufficient data)"
-            
-            # elif arbitration_id == SENSORS_ID: # S&T STM32 Board CAN ID, should be string for testing
-            elif arbitration_id == "0xFF": # S&T STM32 Board CAN ID, should be string for testing
-                logger.info("Telemetry Data type: SENSORS")
-                if len(data_bytes) == 8:
-                    # Combine bytes into 2-byte integer values for LIMs
-                    LIM_ONE = (int(data_bytes[0]) << 8) | int(data_bytes[1])
-                    LIM_TWO = (int(data_bytes[2]) << 8) | int(data_bytes[3])
-                    LIM_THREE = (int(data_bytes[4]) << 8) | int(data_bytes[5])
-                    PRESSURE = int(data_bytes[6])
-                    ERROR_ID = int(data_bytes[7])
-                    return f"Telemetry: SENSORS: LIM_ONE={LIM_ONE}, LIM_TWO={LIM_TWO}, LIM_THREE={LIM_THREE}, PRESSURE={PRESSURE}, ERROR_ID={ERROR_ID}"
-                else:
-                    return f"Telemetry: SENSORS: {arbitration_id}:{data} (insufficient data)"
-
-            # elif arbitration_id ==  IMU_ID: # don't have the ID of the IMU yet, string for testing, hex/binary for CAN bus
-            else:
-                logger.info("Telemetry Data type: IMU")
-                if len(data_bytes) == 8:
-                    # Combine bytes into 2-byte integer values for accelerometer
-                    X_ACCEL = (int(data_bytes[0]) << 8) | int(data_bytes[1])
-                    Y_ACCEL = (int(data_bytes[2]) << 8) | int(data_bytes[3])
-                    X_GYRO = int(data_bytes[4])
-                    Y_GYRO = int(data_bytes[5])
-                    Z_GYRO = int(data_bytes[6])
-                    ERROR_ID = int(data_bytes[7])
-                    return f"Telemetry: IMU: X_ACCEL={X_ACCEL}, Y_ACCEL={Y_ACCEL}, X_GYRO={X_GYRO}, Y_GYRO={Y_GYRO}, Z_GYRO={Z_GYRO}, ERROR_ID={ERROR_ID}"
-                else:
-                    return f"Telemetry: IMU: {arbitration_id}:{data} (insufficient data)"
-
-
-        except can.CanError as e:
-            logger.error(f"Failed to receive CAN message: {e}")
-        # GPIO.output(RED, GPIO.HIGH)
-    #############################################################
+            if self.ingest is not None:
+                self.ingest.close()
+            if self.ring_writer is not None:
+                self.ring_writer.close()
 
 
 if __name__ == "__main__":
-    client = TelemetryClient()
+    parser = argparse.ArgumentParser(description="Waterloop telemetry client")
+    parser.add_argument("--can", action="store_true",
+                        help=f"stream telemetry from the CAN bus ({CAN_INTERFACE}) instead of only terminal input")
+    parser.add_argument("--can-interface", default="socketcan",
+                        help="python-can interface, e.g. 'virtual' for testing without a bus")
+    parser.add_argument("--liveness-timeout", type=float, default=0.5,
+                        help="with --can, report a board that stays silent this many seconds beyond its usual "
+                             "frame interval and doesn't answer a probe (0 disables the liveness monitor)")
+    parser.add_argument("--probe-interval", type=float, default=1.0,
+                        help="seconds between probes of a board that is down")
+    parser.add_argument("--shm-ring", nargs="?", const=SHM_RING_NAME, metavar="NAME",
+                        help=f"with --can, hand frames to a server on this machine through its shared memory ring "
+                             f"(default name {SHM_RING_NAME}) instead of the gRPC stream")
+    add_address_argument(parser)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging_from_args(args)
+    bus = can.interface.Bus(CAN_INTERFACE, interface=args.can_interface) if args.can else None
+    client = TelemetryClient(bus=bus, address=args.address, liveness_timeout=args.liveness_timeout,
+                             probe_interval=args.probe_interval, shm_ring=args.shm_ring)
     try:
         client.start()
     except KeyboardInterrupt:
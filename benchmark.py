@@ -0,0 +1,590 @@
+"""Micro-benchmarks for the host application.
+
+Run with `python benchmark.py <name>`; each benchmark prints a short report.
+"""
+import argparse
+import contextlib
+import logging
+import os
+import queue
+import random
+import statistics
+import tempfile
+import threading
+import time
+import timeit
+from concurrent import futures
+
+import grpc
+import host_pb2
+import host_pb2_grpc
+from can_protocol import (BMS_ID, IMU_ID, MC_THROTTLE, MOTOR_COMMAND_ID, SENSORS_ID, TELEMETRY_LAYOUTS, FrameBatcher,
+                          decode_telemetry, make_frame, telemetry_frames)
+from HostServer import DEFAULT_LANE_POLICIES, NEVER_DROP, TELEMETRY_TRAFFIC, HostControlServicer, MessageRouter
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(label, samples_us):
+    print(f"[Benchmark] {label}: n={len(samples_us)} "
+          f"mean={statistics.mean(samples_us):.1f}us "
+          f"p50={percentile(samples_us, 50):.1f}us "
+          f"p99={percentile(samples_us, 99):.1f}us "
+          f"max={max(samples_us):.1f}us")
+
+
+class PollingRouter:
+    """The original delivery loop: non-blocking get followed by a 10 ms sleep"""
+
+    def __init__(self):
+        self.client_queues = {}
+
+    def register_client(self, client_id, client_type):
+        self.client_queues[client_id] = queue.Queue()
+
+    def route_message(self, message):
+        self.client_queues[message.recipient].put(message)
+
+    def deliver(self, client_id, stop_event):
+        while not stop_event.is_set():
+            try:
+                yield self.client_queues[client_id].get(block=False)
+            except queue.Empty:
+                pass
+            time.sleep(0.01)
+
+
+def blocking_deliver(router, client_id, stop_event):
+    while not stop_event.is_set():
+        message = router.get_message(client_id)
+        if message is None:
+            break
+        yield message
+
+
+def measure_delivery(router, deliver, count, interval):
+    """Route `count` messages to a consumer thread and collect queue-to-wire latencies"""
+    router.register_client("motor_control", "motor_control")
+    stop_event = threading.Event()
+    latencies = []
+    sent_at = {}
+
+    def consume():
+        for message in deliver("motor_control", stop_event):
+            latencies.append((time.perf_counter() - sent_at[message.command]) * 1e6)
+            if len(latencies) == count:
+                break
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+    for i in range(count):
+        time.sleep(interval)
+        command = str(i)
+        sent_at[command] = time.perf_counter()
+        router.route_message(host_pb2.HostMessage(sender="dashboard", recipient="motor_control", command=command))
+    consumer.join(timeout=5)
+    stop_event.set()
+    return latencies
+
+
+def measure_idle_cpu(router, deliver, duration):
+    """CPU seconds burnt by one idle stream waiting for messages"""
+    router.register_client("dashboard", "dashboard")
+    stop_event = threading.Event()
+    consumer = threading.Thread(target=lambda: list(deliver("dashboard", stop_event)), daemon=True)
+    consumer.start()
+    start = time.process_time()
+    time.sleep(duration)
+    used = time.process_time() - start
+    stop_event.set()
+    if isinstance(router, MessageRouter):
+        router.close_client("dashboard")
+    consumer.join(timeout=1)
+    return used
+
+
+def bench_router_latency(args):
+    """Compare the sleep-polling delivery loop with the event-driven MessageRouter"""
+    polling = PollingRouter()
+    summarize("polling (10 ms sleep) latency", measure_delivery(polling, polling.deliver, args.count, args.interval))
+    router = MessageRouter()
+    summarize("event-driven latency", measure_delivery(
+        router, lambda cid, ev: blocking_deliver(router, cid, ev), args.count, args.interval))
+
+    polling = PollingRouter()
+    print(f"[Benchmark] polling idle CPU over {args.idle}s: "
+          f"{measure_idle_cpu(polling, polling.deliver, args.idle) * 1000:.1f} ms")
+    router = MessageRouter()
+    print(f"[Benchmark] event-driven idle CPU over {args.idle}s: "
+          f"{measure_idle_cpu(router, lambda cid, ev: blocking_deliver(router, cid, ev), args.idle) * 1000:.1f} ms")
+
+
+def start_server(servicer=None, max_workers=16):
+    """In-process HostServer on a free localhost port; returns (server, address)"""
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    host_pb2_grpc.add_HostControlServicer_to_server(servicer or HostControlServicer(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    return server, f"localhost:{port}"
+
+
+def drain(responses):
+    """Consume a response stream until it ends or is cancelled"""
+    with contextlib.suppress(grpc.RpcError):
+        for _ in responses:
+            pass
+
+
+@contextlib.contextmanager
+def quiet():
+    """Discard console output and server log lines (e.g. stream errors at shutdown)"""
+    logging.disable(logging.CRITICAL)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def measure_telemetry_throughput(address, frame_count, batch_size):
+    """Push frame_count frames through TelemetryStream to one dashboard.
+    Returns (frames/s, server process CPU seconds per 1000 frames)."""
+    channel = grpc.insecure_channel(address)
+    stub = host_pb2_grpc.HostControlStub(channel)
+    received = [0]
+    done = threading.Event()
+    connected = threading.Event()
+
+    def dashboard_requests():
+        yield host_pb2.HostMessage(sender="dashboard", recipient="none", command="Dashboard connected")
+        done.wait()
+
+    def dashboard():
+        responses = stub.CommandStream(dashboard_requests())
+        connected.set()
+        with contextlib.suppress(grpc.RpcError):
+            for response in responses:
+                received[0] += len(telemetry_frames(response))
+                if received[0] >= frame_count:
+                    done.set()
+
+    def telemetry_requests():
+        yield host_pb2.HostMessage(sender="telemetry", recipient="dashboard", command="Telemetry connected")
+        frame = make_frame(0x0A, bytes(8))
+        if batch_size == 1:
+            message = host_pb2.HostMessage(sender="telemetry", recipient="dashboard",
+                                           kind=host_pb2.TELEMETRY, frame=frame)
+            for _ in range(frame_count):
+                yield message
+        else:
+            batcher = FrameBatcher("telemetry", "dashboard", max_frames=batch_size)
+            for _ in range(frame_count):
+                batcher.add(frame)
+                if batcher.time_left() == 0:
+                    yield batcher.flush()
+            while batcher.pending:
+                yield batcher.flush()
+        done.wait()
+
+    threading.Thread(target=dashboard, daemon=True).start()
+    connected.wait()
+    time.sleep(0.2)
+    start, cpu_start = time.perf_counter(), time.process_time()
+    responses = stub.TelemetryStream(telemetry_requests())
+    threading.Thread(target=drain, args=(responses,), daemon=True).start()
+    done.wait(timeout=60)
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+    channel.close()
+    return received[0] / elapsed, cpu / received[0] * 1000
+
+
+def bench_telemetry_throughput(args):
+    """Frames/s through HostServer sent one per message vs coalesced into TELEMETRY_BATCH messages"""
+    # Every frame must arrive, so telemetry is not conflated to the latest value per CAN ID
+    lane_policies = dict(DEFAULT_LANE_POLICIES, **{TELEMETRY_TRAFFIC: (NEVER_DROP, None)})
+    for batch_size in (1, args.batch):
+        server, address = start_server(HostControlServicer(lane_policies))
+        with quiet():
+            rate, cpu = measure_telemetry_throughput(address, args.count, batch_size)
+            server.stop(None).wait()
+        label = "one frame per message" if batch_size == 1 else f"batches of {batch_size}"
+        print(f"[Benchmark] {label}: {rate:,.0f} frames/s, {cpu * 1000:.1f} ms CPU per 1000 frames")
+
+
+def measure_command_latency(address, count):
+    """Send count motor commands dashboard -> motor_control one at a time (the next once the
+    previous arrived). Returns (one-way latencies in microseconds, CPU microseconds per command)."""
+    channel = grpc.insecure_channel(address)
+    stub = host_pb2_grpc.HostControlStub(channel)
+    outbound = queue.SimpleQueue()
+    arrived = queue.SimpleQueue()
+    done = threading.Event()
+
+    def motor_requests():
+        yield host_pb2.HostMessage(sender="motor_control", recipient="server", command="Motor Control connected")
+        done.wait()
+
+    def motor():
+        with contextlib.suppress(grpc.RpcError):
+            for response in stub.MotorControlStream(motor_requests()):
+                if response.kind == host_pb2.MOTOR_COMMAND:
+                    arrived.put(time.perf_counter() - response.frame.timestamp)
+
+    def dashboard_requests():
+        yield host_pb2.HostMessage(sender="dashboard", recipient="server", command="Dashboard connected")
+        while True:
+            message = outbound.get()
+            if message is None:
+                break
+            yield message
+        done.wait()
+
+    threading.Thread(target=motor, daemon=True).start()
+    threading.Thread(target=drain, args=(stub.CommandStream(dashboard_requests()),), daemon=True).start()
+    time.sleep(0.2)
+    latencies = []
+    cpu_start = time.process_time()
+    for _ in range(count):
+        outbound.put(host_pb2.HostMessage(sender="dashboard", recipient="motor_control", kind=host_pb2.MOTOR_COMMAND,
+                                          frame=make_frame(MOTOR_COMMAND_ID, bytes([MC_THROTTLE, 50]),
+                                                           time.perf_counter())))
+        latencies.append(arrived.get(timeout=10) * 1e6)
+    cpu = time.process_time() - cpu_start
+    outbound.put(None)
+    done.set()
+    channel.close()
+    return latencies, cpu / count * 1e6
+
+
+def bench_transport(args):
+    """TCP localhost vs Unix domain socket: command latency, telemetry throughput and CPU"""
+    lane_policies = dict(DEFAULT_LANE_POLICIES, **{TELEMETRY_TRAFFIC: (NEVER_DROP, None)})
+    with tempfile.TemporaryDirectory() as directory:
+        for transport in ("tcp", "unix"):
+            server = grpc.server(futures.ThreadPoolExecutor(max_workers=16))
+            host_pb2_grpc.add_HostControlServicer_to_server(HostControlServicer(lane_policies), server)
+            port = server.add_insecure_port("localhost:0")
+            server.add_insecure_port(f"unix:{directory}/host.sock")
+            server.start()
+            address = f"localhost:{port}" if transport == "tcp" else f"unix:{directory}/host.sock"
+            with quiet():
+                latencies, command_cpu = measure_command_latency(address, args.count)
+                rate, cpu = measure_telemetry_throughput(address, args.count * 20, 1)
+                server.stop(None).wait()
+            summarize(f"{transport} command latency", latencies)
+            print(f"[Benchmark] {transport}: {command_cpu:.0f} us CPU per command, "
+                  f"{rate:,.0f} telemetry frames/s unbatched at {cpu * 1000:.1f} ms CPU per 1000 frames")
+
+
+def legacy_parse_telemetry_data(arbitration_id, data):
+    """The original TelemetryClient.parse_telemetry_data (minus its logging): string IDs,
+    int() on every byte, hand-written shifts and an f-string per frame"""
+    data_bytes = data.split(',') if isinstance(data, str) else data
+    BMS_ID = 0x1e
+    SENSORS_ID = 0x14
+    IMU_ID = 0xA
+    if arbitration_id == "0x1e":
+        if len(data_bytes) <= 8:
+            MUX1_TEMP = int(data_bytes[0])
+            MUX2_TEMP = int(data_bytes[1])
+            MUX3_TEMP = int(data_bytes[2])
+            MUX4_TEMP = int(data_bytes[3])
+            MUX5_TEMP = int(data_bytes[4])
+            MUX6_TEMP = int(data_bytes[5])
+            ERROR_ID = int(data_bytes[6])
+            return f"Telemetry: BMS: MUX1_TEMP={MUX1_TEMP}, MUX2_TEMP={MUX2_TEMP}, MUX3_TEMP={MUX3_TEMP}, MUX4_TEMP={MUX4_TEMP}, MUX5_TEMP={MUX5_TEMP}, MUX6_TEMP={MUX6_TEMP}, ERROR_ID={ERROR_ID}"
+    elif arbitration_id == "0xFF":
+        if len(data_bytes) == 8:
+            LIM_ONE = (int(data_bytes[0]) << 8) | int(data_bytes[1])
+            LIM_TWO = (int(data_bytes[2]) << 8) | int(data_bytes[3])
+            LIM_THREE = (int(data_bytes[4]) << 8) | int(data_bytes[5])
+            PRESSURE = int(data_bytes[6])
+            ERROR_ID = int(data_bytes[7])
+            return f"Telemetry: SENSORS: LIM_ONE={LIM_ONE}, LIM_TWO={LIM_TWO}, LIM_THREE={LIM_THREE}, PRESSURE={PRESSURE}, ERROR_ID={ERROR_ID}"
+    else:
+        if len(data_bytes) == 8:
+            X_ACCEL = (int(data_bytes[0]) << 8) | int(data_bytes[1])
+            Y_ACCEL = (int(data_bytes[2]) << 8) | int(data_bytes[3])
+            X_GYRO = int(data_bytes[4])
+            Y_GYRO = int(data_bytes[5])
+            Z_GYRO = int(data_bytes[6])
+            ERROR_ID = int(data_bytes[7])
+            return f"Telemetry: IMU: X_ACCEL={X_ACCEL}, Y_ACCEL={Y_ACCEL}, X_GYRO={X_GYRO}, Y_GYRO={Y_GYRO}, Z_GYRO={Z_GYRO}, ERROR_ID={ERROR_ID}"
+
+
+def bench_decode(args):
+    """Per-frame decode cost: original parse_telemetry_data vs the TELEMETRY_LAYOUTS registry"""
+    payload = bytes([1, 2, 3, 4, 5, 6, 7, 8])
+    legacy_frames = [("0x1e", "1,2,3,4,5,6,7,8"), ("0xFF", "1,2,3,4,5,6,7,8"), ("0xA", "1,2,3,4,5,6,7,8")]
+    frames = [(BMS_ID, payload), (SENSORS_ID, payload), (IMU_ID, payload)]
+    for label, decode, inputs in (("parse_telemetry_data (before)", legacy_parse_telemetry_data, legacy_frames),
+                                  ("decode_telemetry (after)", decode_telemetry, frames)):
+        seconds = min(timeit.repeat(lambda: [decode(i, d) for i, d in inputs], number=args.count, repeat=5))
+        print(f"[Benchmark] {label}: {seconds / (args.count * len(inputs)) * 1e9:.0f} ns/frame")
+
+
+def bench_ingest(args):
+    """CanIngest on python-can's virtual bus: frames/s and ring overflows at full send rate"""
+    import can
+    from can_ingest import CanIngest
+
+    payload = bytes(range(8))
+    for capacity in (args.ring, 64):
+        sender = can.Bus("benchmark", interface="virtual")
+        receiver = can.Bus("benchmark", interface="virtual")
+        forwarded = []
+        ingest = CanIngest(receiver, forwarded.append, capacity=capacity, stats_interval=None)
+        ingest.start()
+        start = time.perf_counter()
+        for i in range(args.count):
+            sender.send(can.Message(arbitration_id=0x0A, data=payload, is_extended_id=False))
+        while ingest.received + ingest.overflows < args.count and time.perf_counter() - start < 10:
+            time.sleep(0.001)
+        time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        ingest.close()
+        sender.shutdown()
+        receiver.shutdown()
+        stats = ingest.stats()
+        print(f"[Benchmark] ring of {capacity}: {stats['received'] / elapsed:,.0f} frames/s ingested, "
+              f"{len(forwarded)} forwarded, {stats['overflows']} overflowed")
+
+
+def bench_stop_latency(args):
+    """MC_STOP latency dashboard -> motor_control while telemetry streams saturate the server"""
+    from loadtest import LoadTest, in_process_server
+
+    for streams in (0, 2, 4, 8):
+        max_workers = 2 * (streams + 3) + 4
+        with quiet(), in_process_server(max_workers) as (address, servicer):
+            # Unpaced telemetry: each stream sends as fast as the server takes it
+            load = LoadTest(address, streams, 2, rate=1e6, command_rate=200, batch_size=args.batch,
+                            batch_delay=0.005, router=servicer.router, stop_rate=20)
+            results = load.run(args.duration)
+        telemetry = results["telemetry_to_dashboard"]
+        line = f"[Benchmark] {streams} telemetry streams ({telemetry['throughput_per_s']:,.0f} frames/s delivered):"
+        for label, path in (("STOP", results["stop_to_motor_control"]),
+                            ("throttle", results["dashboard_to_motor_control"])):
+            latency = path.get("latency_ms", {})
+            line += (f" {label} p50={latency.get('p50')}ms p99={latency.get('p99')}ms max={latency.get('max')}ms"
+                     f" ({path['received']}/{path['sent']});")
+        print(line.rstrip(";"))
+
+
+def bench_ingest_layout(args):
+    """Command latency while rising CAN telemetry is ingested in a thread of the server vs
+    in a worker process (ingest_pool.py)"""
+    from ingest_pool import IngestWorker
+
+    for use_process in (False, True):
+        for rate in (0, 5000, 20000, 50000):
+            servicer = HostControlServicer()
+            server, address = start_server(servicer)
+            with quiet():
+                worker = IngestWorker(servicer.router, "virtual", f"benchmark-{use_process}-{rate}",
+                                      use_process=use_process, simulate_rate=rate, batch_size=args.batch)
+                worker.start()
+                time.sleep(1.0)   # worker start-up (a spawned process imports python-can)
+                frames_before, start = worker.frames, time.perf_counter()
+                latencies, _ = measure_command_latency(address, args.count)
+                ingested = (worker.frames - frames_before) / (time.perf_counter() - start)
+                worker.close()
+                server.stop(None).wait()
+            summarize(f"{'process' if use_process else 'thread'} ingest, {rate:,} frames/s offered "
+                      f"({ingested:,.0f} routed), command latency", latencies)
+
+
+def produce_frames(path, target, count, rate, batch):
+    """Producer process for bench_shm_ring: writes `count` frames at `rate` frames/s (0 = as
+    fast as possible) into the ring named `target`, or streams them in batches over gRPC to
+    the server at `target`, like Telemetry_client.py would. Prints its CPU seconds."""
+    count, rate, batch = int(count), float(rate), int(batch)
+    frames = [(can_id, bytes(range(8))) for can_id in (BMS_ID, SENSORS_ID, IMU_ID)]
+    cpu_start = time.process_time()
+
+    def paced():
+        start, sent = time.perf_counter(), 0
+        while sent < count:
+            due = count if not rate else min(count, int((time.perf_counter() - start) * rate) + 1)
+            for i in range(sent, due):
+                yield frames[i % len(frames)]
+            sent = due
+            if rate:
+                time.sleep(max(0.0, start + sent / rate - time.perf_counter()))
+
+    if path == "shm":
+        from shm_ring import ShmRing, ShmRingWriter
+        ring = ShmRing.attach(target)
+        write = ShmRingWriter(ring).write
+        for can_id, data in paced():
+            write(can_id, data, time.time())
+        ring.close()
+    else:
+        def requests():
+            yield host_pb2.HostMessage(sender="telemetry", recipient="dashboard", command="Telemetry connected")
+            batcher = FrameBatcher("telemetry", "dashboard", max_frames=batch)
+            for can_id, data in paced():
+                batcher.add(make_frame(can_id, data))
+                if batcher.time_left() == 0:
+                    yield batcher.flush()
+            while batcher.pending:
+                yield batcher.flush()
+
+        channel = grpc.insecure_channel(target)
+        drain(host_pb2_grpc.HostControlStub(channel).TelemetryStream(requests()))
+        channel.close()
+    print(time.process_time() - cpu_start)
+
+
+def bench_shm_ring(args):
+    """CAN frames from a producer process into the router: shared memory ring vs gRPC loopback"""
+    import subprocess
+    import sys
+    from shm_ring import RingIngest
+
+    count = args.count * 200
+    for rate in (0, 20000):
+        for path in ("grpc", "shm"):
+            servicer = HostControlServicer()
+            router = servicer.router
+            routed = [0, None, None]   # frames, first and last arrival
+            route_message = router.route_message
+
+            def counting_route(message):
+                now = time.perf_counter()
+                routed[0] += len(telemetry_frames(message))
+                routed[1] = routed[1] or now
+                routed[2] = now
+                return route_message(message)
+            router.route_message = counting_route
+
+            server, address = start_server(servicer)
+            ring = None
+            if path == "shm":
+                ring = RingIngest(router, name=f"waterloop_benchmark_{os.getpid()}")
+                ring.start()
+            cpu_start = time.process_time()
+            with quiet():
+                producer = subprocess.run(
+                    [sys.executable, "-c", "import sys, benchmark; benchmark.produce_frames(*sys.argv[1:])",
+                     path, ring.ring.shm.name if ring else address, str(count), str(rate), str(args.batch)],
+                    cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, timeout=120)
+                deadline = time.perf_counter() + 5
+                while routed[0] < count and time.perf_counter() < deadline:
+                    time.sleep(0.01)
+                server_cpu = time.process_time() - cpu_start
+                lost = 0
+                if ring is not None:
+                    ring.close()
+                    lost = ring.reader.lost
+                server.stop(None).wait()
+            producer_cpu = float(producer.stdout.split()[-1])
+            elapsed = (routed[2] - routed[1]) if routed[0] > 1 else float("nan")
+            print(f"[Benchmark] {path}, {'unpaced' if not rate else f'{rate:,} frames/s offered'}: "
+                  f"{routed[0] / elapsed:,.0f} frames/s routed ({routed[0]}/{count}, {lost} overwritten), "
+                  f"CPU per 1000 frames: producer {producer_cpu / count * 1e6:.1f} ms, "
+                  f"server {server_cpu / max(1, routed[0]) * 1e6:.1f} ms")
+
+
+def record_synthetic_run(directory, seconds, batch_delay=0.005):
+    """Write a run of plausible telemetry for bench_delta_encoding: BMS temperatures that
+    drift (10 Hz), noisy limit sensors and slow pressure (50 Hz), IMU readings (100 Hz) and
+    error IDs of 0, in TELEMETRY_BATCH messages every batch_delay seconds"""
+    from flight_recorder import FlightRecorder
+
+    rng = random.Random(25)
+    temperatures = [rng.randint(24, 30) for _ in range(6)]
+    pressure = 100
+
+    def bms():
+        for i in range(6):
+            if rng.random() < 0.05:
+                temperatures[i] += rng.choice((-1, 1))
+        return TELEMETRY_LAYOUTS[BMS_ID].struct.pack(*temperatures, 0)
+
+    def sensors():
+        nonlocal pressure
+        if rng.random() < 0.02:
+            pressure += rng.choice((-1, 1))
+        return TELEMETRY_LAYOUTS[SENSORS_ID].struct.pack(*(2048 + rng.randint(-3, 3) for _ in range(3)), pressure, 0)
+
+    def imu():
+        return TELEMETRY_LAYOUTS[IMU_ID].struct.pack(2048 + rng.randint(-6, 6), 2048 + rng.randint(-6, 6),
+                                                     *(128 + rng.randint(-1, 1) for _ in range(3)), 0)
+
+    boards = [(BMS_ID, 0.1, bms), (SENSORS_ID, 0.02, sensors), (IMU_ID, 0.01, imu)]
+    next_send = {can_id: 0.0 for can_id, _, _ in boards}
+    recorder = FlightRecorder(directory)
+    start, wall_start = time.monotonic(), time.time()
+    elapsed = 0.0
+    while elapsed < seconds:
+        frames = []
+        for can_id, period, payload in boards:
+            while next_send[can_id] < elapsed + batch_delay:
+                frames.append(make_frame(can_id, payload(), wall_start + next_send[can_id]))
+                next_send[can_id] += period
+        elapsed += batch_delay
+        if frames:
+            recorder.record(host_pb2.HostMessage(sender="telemetry", recipient="dashboard",
+                                                 kind=host_pb2.TELEMETRY_BATCH, frames=frames), start + elapsed)
+    recorder.close()
+
+
+def bench_delta_encoding(args):
+    """Bytes/s a remote dashboard receives during a replayed run, per dashboard stream
+    encoding, for a dashboard subscribed to all telemetry and for one rate limited to 10/s"""
+    from flight_recorder import FlightLog
+    from replay import ENCODINGS, Replay, stream_types
+
+    with tempfile.TemporaryDirectory() as directory:
+        record_synthetic_run(directory, args.duration)
+        log = FlightLog(directory)
+        for topics in ((), ("all@10",)):
+            server, address = start_server()
+            with quiet():
+                replay = Replay(log, address, motor_sink=False, encodings=ENCODINGS, encoding_topics=topics)
+                replay.connect(stream_types(log))
+                time.sleep(0.5)
+                results = replay.run()
+                server.stop(None).wait()
+            print(f"[Benchmark] Dashboards subscribed to {topics[0] if topics else 'all'}: "
+                  f"{results['telemetry_frames']['sent']} frames replayed over {results['replay_seconds']}s")
+            for name, encoding in results["encodings"].items():
+                print(f"[Benchmark] {name:>10}: {encoding['bytes_per_s'] / 1000:6.2f} kB/s to the dashboard "
+                      f"({encoding['saving_pct']:5.1f}% saved), {encoding['messages']} messages, "
+                      f"{encoding['frames']} frames, final values {'match' if encoding['values_match'] else 'DIFFER'}")
+
+
+BENCHMARKS = {
+    "delta-encoding": bench_delta_encoding,
+    "ingest": bench_ingest,
+    "ingest-layout": bench_ingest_layout,
+    "stop-latency": bench_stop_latency,
+    "decode": bench_decode,
+    "router-latency": bench_router_latency,
+    "shm-ring": bench_shm_ring,
+    "telemetry-throughput": bench_telemetry_throughput,
+    "transport": bench_transport,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--count", type=int, default=500, help="messages to send")
+    parser.add_argument("--interval", type=float, default=0.015, help="seconds between messages")
+    parser.add_argument("--idle", type=float, default=2.0, help="seconds to measure idle CPU for")
+    parser.add_argument("--batch", type=int, default=64, help="frames per TELEMETRY_BATCH message")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of load per stop-latency step")
+    parser.add_argument("--ring", type=int, default=4096, help="CanIngest ring buffer capacity")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
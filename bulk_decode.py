@@ -0,0 +1,152 @@
+"""Offline, vectorized decoding of recorded CAN captures for post-run analysis.
+
+A capture (candump log, Vector ASC, or anything python-can's LogReader opens) is loaded
+into NumPy arrays once, then every board in can_protocol.TELEMETRY_LAYOUTS is decoded
+column-wise from the same signal definitions the live telemetry client uses.
+
+Usage:
+    python bulk_decode.py run.log [--out run.npz]
+
+Requires NumPy (pip install numpy).
+"""
+import argparse
+import collections
+import time
+
+import numpy as np
+
+from can_protocol import TELEMETRY_LAYOUTS
+
+# A whole capture as parallel arrays; data rows are zero-padded to 8 bytes
+CanCapture = collections.namedtuple("CanCapture", ["timestamps", "arbitration_ids", "dlc", "data"])
+
+# struct code -> NumPy type, for the codes used in telemetry layouts
+_NUMPY_TYPES = {
+    "b": "i1", "B": "u1", "?": "u1",
+    "h": "i2", "H": "u2",
+    "i": "i4", "I": "u4", "l": "i4", "L": "u4",
+    "q": "i8", "Q": "u8",
+    "e": "f2", "f": "f4", "d": "f8",
+}
+_NUMPY_BYTE_ORDER = {">": ">", "!": ">", "<": "<", "=": "=", "@": "="}
+
+
+def _capture_from_lists(timestamps, arbitration_ids, payloads):
+    data = np.frombuffer(b"".join(payload.ljust(8, b"\0") for payload in payloads), dtype=np.uint8)
+    return CanCapture(
+        timestamps=np.array(timestamps, dtype=np.float64),
+        arbitration_ids=np.array(arbitration_ids, dtype=np.uint32),
+        dlc=np.fromiter((len(payload) for payload in payloads), dtype=np.uint8, count=len(payloads)),
+        data=data.reshape(-1, 8),
+    )
+
+
+def load_candump(path):
+    """Load a `candump -l` / `candump -L` log: '(1436509052.249713) can0 01E#0102030405060708'"""
+    timestamps, arbitration_ids, payloads = [], [], []
+    with open(path) as log:
+        for line in log:
+            fields = line.split()
+            if len(fields) < 3 or not fields[0].startswith("("):
+                continue
+            can_id, _, payload = fields[2].partition("#")
+            if payload.startswith("R"):
+                continue  # remote frames carry no data
+            timestamps.append(float(fields[0][1:-1]))
+            arbitration_ids.append(int(can_id, 16))
+            payloads.append(bytes.fromhex(payload[:16]))
+    return _capture_from_lists(timestamps, arbitration_ids, payloads)
+
+
+def load_asc(path):
+    """Load the data frames of a Vector ASC log: ' 0.008900 1  1E  Rx   d 8 01 02 03 04 05 06 07 08'"""
+    timestamps, arbitration_ids, payloads = [], [], []
+    with open(path) as log:
+        for line in log:
+            fields = line.split()
+            if len(fields) < 6 or fields[4].lower() != "d":
+                continue
+            try:
+                timestamp = float(fields[0])
+                can_id = int(fields[2].rstrip("xX"), 16)
+                dlc = int(fields[5], 16)
+            except ValueError:
+                continue  # header or event line
+            timestamps.append(timestamp)
+            arbitration_ids.append(can_id)
+            payloads.append(bytes.fromhex("".join(fields[6:6 + min(dlc, 8)])))
+    return _capture_from_lists(timestamps, arbitration_ids, payloads)
+
+
+def load_with_python_can(path):
+    """Fallback for any other format python-can can read (BLF, CSV, TRC, ...)"""
+    import can
+
+    timestamps, arbitration_ids, payloads = [], [], []
+    for msg in can.LogReader(path):
+        if msg.is_error_frame or msg.is_remote_frame:
+            continue
+        timestamps.append(msg.timestamp)
+        arbitration_ids.append(msg.arbitration_id)
+        payloads.append(bytes(msg.data[:8]))
+    return _capture_from_lists(timestamps, arbitration_ids, payloads)
+
+
+def load_capture(path):
+    """Pick a loader from the file extension"""
+    if path.endswith(".log"):
+        return load_candump(path)
+    if path.endswith(".asc"):
+        return load_asc(path)
+    return load_with_python_can(path)
+
+
+def decode_capture(capture, layouts=TELEMETRY_LAYOUTS):
+    """Decode every telemetry board in a capture.
+    Returns {board: {"timestamp": array, signal: array, ...}}, one row per frame of that board.
+    Frames too short for their board's layout are skipped, like the live decoder does."""
+    decoded = {}
+    for layout in layouts.values():
+        rows = np.flatnonzero((capture.arbitration_ids == layout.arbitration_id)
+                              & (capture.dlc >= layout.struct.size))
+        payloads = capture.data[rows]
+        columns = {"timestamp": capture.timestamps[rows]}
+        byte_order = _NUMPY_BYTE_ORDER[layout.byte_order]
+        for signal, offset, code in layout.fields:
+            dtype = np.dtype(byte_order + _NUMPY_TYPES[code])
+            # Reinterpret the signal's byte columns as one big/little-endian value per row
+            column = np.ascontiguousarray(payloads[:, offset:offset + dtype.itemsize])
+            columns[signal] = column.view(dtype).ravel()
+        decoded[layout.board] = columns
+    return decoded
+
+
+def save_columns(decoded, path):
+    """Write decoded columns to an .npz file, keyed '<board>.<signal>'"""
+    np.savez(path, **{f"{board}.{signal}": values
+                      for board, columns in decoded.items() for signal, values in columns.items()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode a recorded CAN capture into per-signal columns")
+    parser.add_argument("capture", help="candump .log, Vector .asc, or another python-can log format")
+    parser.add_argument("--out", help="write the decoded columns to this .npz file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    capture = load_capture(args.capture)
+    loaded = time.perf_counter()
+    decoded = decode_capture(capture)
+    done = time.perf_counter()
+
+    print(f"[Decode] Loaded {len(capture.timestamps)} frames in {loaded - start:.2f}s, "
+          f"decoded in {(done - loaded) * 1000:.1f}ms")
+    for board, columns in decoded.items():
+        print(f"[Decode] {board}: {len(columns['timestamp'])} frames, signals: {', '.join(list(columns)[1:])}")
+    if args.out:
+        save_columns(decoded, args.out)
+        print(f"[Decode] Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Background CAN ingestion for the telemetry client.
+
+A python-can Notifier thread pushes every received frame into a bounded ring buffer;
+a separate decode thread drains the ring, converts frames to CanFrames and hands them
+to a sink (e.g. TelemetryClient.enqueue_frame), or with raw=True calls
+sink(arbitration_id, data, timestamp) without building a CanFrame (e.g. shm_ring). Nothing here waits on stdin, and a full
+ring drops its oldest frame instead of blocking the bus reader. A sink whose own queue is
+full returns False; the frame is dropped and counted as an overflow like one lost in the ring.
+"""
+import collections
+import logging
+import threading
+import time
+
+import can
+
+from can_protocol import make_frame
+
+logger = logging.getLogger(__name__)
+
+
+class CanIngest(can.Listener):
+    """Notifier -> ring buffer -> decode thread -> sink"""
+
+    def __init__(self, bus, sink, capacity=4096, stats_interval=5.0, listeners=(), raw=False):
+        self.bus = bus
+        self.sink = sink
+        self.raw = raw
+        self.listeners = list(listeners)       # other can.Listeners fed by the same Notifier
+        self.capacity = capacity
+        self.stats_interval = stats_interval   # Seconds between stats log lines (None to disable)
+        self.ring = collections.deque(maxlen=capacity)
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.notifier = None
+        self.decode_thread = None
+        self._stopped = False
+        # Counters (read with stats())
+        self.received = 0       # frames taken off the bus
+        self.overflows = 0      # frames lost because the ring or the sink was full
+        self.forwarded = 0      # frames taken by the sink
+        self.bus_errors = 0     # error frames and reader exceptions
+        self._last_stats = (time.monotonic(), 0)
+
+    def start(self):
+        self._stopped = False
+        self.decode_thread = threading.Thread(target=self._decode_loop, daemon=True)
+        self.decode_thread.start()
+        self.notifier = can.Notifier(self.bus, [self] + self.listeners)
+
+    def close(self):
+        """Stop reading the bus and stop the decode thread"""
+        if self.notifier is not None:
+            self.notifier.stop()   # also calls self.stop()
+            self.notifier = None
+        else:
+            self.stop()
+
+    def stop(self):
+        """can.Listener hook, called when the Notifier stops"""
+        with self.lock:
+            self._stopped = True
+            self.ready.notify()
+        if self.decode_thread is not None:
+            self.decode_thread.join(timeout=1)
+
+    def on_message_received(self, msg):
+        """Runs on the Notifier thread: only queue the frame"""
+        if msg.is_error_frame:
+            self.bus_errors += 1
+            return
+        if msg.is_remote_frame:
+            return
+        with self.lock:
+            if len(self.ring) == self.capacity:
+                self.overflows += 1   # deque(maxlen) discards the oldest frame
+            self.ring.append(msg)
+            self.received += 1
+            if len(self.ring) == 1:
+                self.ready.notify()
+
+    def on_error(self, exc):
+        self.bus_errors += 1
+        logger.error(f"CAN reader error: {exc}")
+
+    def _decode_loop(self):
+        next_stats = time.monotonic() + (self.stats_interval or 0)
+        while True:
+            with self.lock:
+                while not self.ring and not self._stopped:
+                    self.ready.wait(self.stats_interval)
+                    if self.stats_interval and time.monotonic() >= next_stats:
+                        break
+                if self._stopped:
+                    return
+                pending = list(self.ring)
+                self.ring.clear()
+
+            refused = 0
+            if self.raw:
+                for msg in pending:
+                    if self.sink(msg.arbitration_id, msg.data, msg.timestamp) is False:
+                        refused += 1
+            else:
+                for msg in pending:
+                    if self.sink(make_frame(msg.arbitration_id, msg.data, msg.timestamp)) is False:
+                        refused += 1
+            self.forwarded += len(pending) - refused
+            if refused:
+                with self.lock:
+                    self.overflows += refused
+
+            if self.stats_interval and time.monotonic() >= next_stats:
+                next_stats = time.monotonic() + self.stats_interval
+                stats = self.stats()
+                logger.info(f"CAN ingest: {stats['rate']:.0f} frames/s, {stats['received']} received, "
+                            f"{stats['overflows']} overflowed, {stats['bus_errors']} bus errors")
+
+    def stats(self):
+        """Counters plus the ingest rate (frames/s) since the previous call"""
+        now = time.monotonic()
+        last_time, last_received = self._last_stats
+        received = self.received
+        self._last_stats = (now, received)
+        return {
+            "received": received,
+            "overflows": self.overflows,
+            "forwarded": self.forwarded,
+            "bus_errors": self.bus_errors,
+            "backlog": len(self.ring),
+            "rate": (received - last_received) / (now - last_time) if now > last_time else 0.0,
+        }
@@ -0,0 +1,436 @@
+"""CAN identifiers, motor command codes and frame helpers shared by the host clients.
+
+Note: the telemetry board IDs are temporary and subject to change.
+"""
+import re
+import struct
+import time
+
+import host_pb2
+
+# Motor controller command frame (from can.c)
+MOTOR_COMMAND_ID = 0x123    # 291
+MC_STOP = 0x11              # 17
+MC_START = 0x22             # 34
+MC_THROTTLE = 0x33          # 51
+MC_DIRECTION = 0x44         # 68 (data[1]: 1 = forward, 0 = reverse)
+
+MOTOR_COMMAND_NAMES = {
+    MC_STOP: "MC_STOP",
+    MC_START: "MC_START",
+    MC_THROTTLE: "MC_THROTTLE",
+    MC_DIRECTION: "MC_DIRECTION",
+}
+
+# UNFINALIZED BOARD IDS
+BMS_ID = 0x1E       # BMS STM32 Board CAN ID
+SENSORS_ID = 0xFF   # S&T STM32 Board CAN ID
+IMU_ID = 0x0A       # IMU Board CAN ID (not finalized yet)
+
+MAX_CAN_ID = 2047   # Standard (11-bit) identifiers only
+
+
+class BoardLayout:
+    """Precompiled telemetry layout of one board: a struct format for the payload and
+    the names of the signals it unpacks into, in order"""
+
+    def __init__(self, board, arbitration_id, fmt, signals):
+        self.board = board
+        self.arbitration_id = arbitration_id
+        self.struct = struct.Struct(fmt)
+        self.signals = tuple(signals)
+        
+        # Per-signal (name, byte offset, struct code), for decoders that don't go through
+        # struct (e.g. bulk_decode.py). Formats are limited to one value per code (no 'x'/'s').
+        self.byte_order = fmt[0] if fmt[0] in "<>!=@" else "@"
+        codes = "".join(code * int(count or 1)
+                        for count, code in re.findall(r"(\d*)([a-zA-Z?])", fmt.lstrip("<>!=@")))
+        offsets = [struct.calcsize(self.byte_order + codes[:i]) for i in range(len(codes))]
+        self.fields = tuple(zip(self.signals, offsets, codes))
+
+    def decode(self, data):
+        """{signal: value} for a payload, or None if it is too short for the layout"""
+        if len(data) < self.struct.size:
+            return None
+        return dict(zip(self.signals, self.struct.unpack_from(data)))
+
+
+# Telemetry schema: one entry per board. Multi-byte values are big-endian ('>H' = 2-byte unsigned)
+TELEMETRY_LAYOUTS = {layout.arbitration_id: layout for layout in (
+    BoardLayout("BMS", BMS_ID, ">7B",
+                ["MUX1_TEMP", "MUX2_TEMP", "MUX3_TEMP", "MUX4_TEMP", "MUX5_TEMP", "MUX6_TEMP", "ERROR_ID"]),
+    BoardLayout("SENSORS", SENSORS_ID, ">3H2B",
+                ["LIM_ONE", "LIM_TWO", "LIM_THREE", "PRESSURE", "ERROR_ID"]),
+    BoardLayout("IMU", IMU_ID, ">2H4B",
+                ["X_ACCEL", "Y_ACCEL", "X_GYRO", "Y_GYRO", "Z_GYRO", "ERROR_ID"]),
+)}
+
+BOARD_IDS = {}
+for _layout in TELEMETRY_LAYOUTS.values():
+    BOARD_IDS.setdefault(_layout.board, []).append(_layout.arbitration_id)
+del _layout
+
+# Telemetry subscription topics:
+#   'all'              every telemetry frame (what a dashboard gets by default)
+#   'board:BMS'        the frames of one board type (see TELEMETRY_LAYOUTS)
+#   'id:0x1E'          a single CAN ID
+#   'id:0x600-0x6FF'   an inclusive range of CAN IDs
+# Any topic can be rate limited with '@<updates per second>', e.g. 'board:IMU@10' (the
+# latest value of each CAN ID, at most 10 times a second), and ':agg' asks for min/max/mean
+# aggregates of every window instead, e.g. 'board:BMS@2:agg'.
+ALL_TELEMETRY = "all"
+AGGREGATE_SUFFIX = "agg"
+
+
+def make_frame(arbitration_id, data, timestamp=None):
+    """Build a CanFrame; timestamp defaults to now"""
+    return host_pb2.CanFrame(
+        arbitration_id=arbitration_id,
+        data=bytes(data),
+        timestamp=time.time() if timestamp is None else timestamp,
+    )
+
+
+def parse_can_id(text):
+    """CAN ID typed by a user: hex with a 0x prefix, decimal otherwise"""
+    text = text.strip()
+    return int(text, 16) if text.lower().startswith("0x") else int(text)
+
+
+def parse_topic(topic):
+    """(CAN IDs, max updates per second, aggregate) of a subscription topic.
+    IDs are None for 'all'; the rate is None when the topic is not rate limited.
+    Raises ValueError for an unknown or malformed topic."""
+    topic, _, limit = topic.partition("@")
+    if not limit:
+        return topic_ids(topic), None, False
+    rate, _, mode = limit.partition(":")
+    try:
+        rate = float(rate)
+    except ValueError:
+        raise ValueError(f"Invalid rate in topic: {topic}@{limit}") from None
+    if rate <= 0 or mode.lower() not in ("", AGGREGATE_SUFFIX):
+        raise ValueError(f"Invalid rate in topic: {topic}@{limit}")
+    return topic_ids(topic), rate, mode.lower() == AGGREGATE_SUFFIX
+
+
+def topic_ids(topic):
+    """Set of CAN IDs a subscription topic covers, or None for 'all'. A rate limit
+    ('@10') is ignored here, see parse_topic. Raises ValueError for an unknown or malformed topic."""
+    topic = topic.partition("@")[0].strip()
+    if topic.lower() == ALL_TELEMETRY:
+        return None
+    kind, _, value = topic.partition(":")
+    if kind.lower() == "board":
+        if value.upper() not in BOARD_IDS:
+            raise ValueError(f"Unknown board in topic: {topic}")
+        return set(BOARD_IDS[value.upper()])
+    if kind.lower() == "id":
+        low, _, high = value.partition("-")
+        low = parse_can_id(low)
+        high = parse_can_id(high) if high else low
+        if not (0 <= low <= high <= MAX_CAN_ID):
+            raise ValueError(f"Invalid CAN ID range in topic: {topic}")
+        return set(range(low, high + 1))
+    raise ValueError(f"Invalid topic: {topic}")
+
+
+def parse_legacy_command(command):
+    """(arbitration_id, data) from the old text format, e.g. 'motor:291:34,90'.
+    Raises ValueError if the command is malformed."""
+    parts = command.split(":")
+    if len(parts) < 3:
+        raise ValueError(f"Invalid command format: {command}")
+    return int(parts[1]), bytes(int(b) for b in parts[2].split(","))
+
+
+def decode_telemetry(arbitration_id, data):
+    """Decode a telemetry payload into (board name, {signal: value}).
+    Signals are None if the payload is too short for the board's layout;
+    returns (None, None) for a CAN ID with no layout."""
+    layout = TELEMETRY_LAYOUTS.get(arbitration_id)
+    if layout is None:
+        return None, None
+    return layout.board, layout.decode(data)
+
+
+def format_telemetry(frame):
+    """Human readable form of a telemetry CanFrame, e.g. 'BMS: MUX1_TEMP=20, ...'"""
+    data = bytes(frame.data)
+    board, signals = decode_telemetry(frame.arbitration_id, data)
+    if board is None:
+        return f"0x{frame.arbitration_id:03X}: {data.hex().upper()} (unknown CAN ID)"
+    if signals is None:
+        return f"{board}: 0x{frame.arbitration_id:03X}:{data.hex().upper()} (insufficient data)"
+    return f"{board}: " + ", ".join(f"{name}={value}" for name, value in signals.items())
+
+
+def format_aggregate(aggregate):
+    """Human readable form of a TelemetryAggregate, e.g. 'BMS (25 frames): MUX1_TEMP=20 [18..31, mean 22.4], ...'"""
+    frame = aggregate.latest
+    board, signals = decode_telemetry(frame.arbitration_id, bytes(frame.data))
+    if board is None or signals is None or not aggregate.signals:
+        return f"{format_telemetry(frame)} ({aggregate.count} frames)"
+    return f"{board} ({aggregate.count} frames): " + ", ".join(
+        f"{stats.name}={signals[stats.name]} [{stats.min:g}..{stats.max:g}, mean {stats.mean:.1f}]"
+        for stats in aggregate.signals)
+
+
+def format_node_status(status):
+    """Human readable form of a NodeStatus, e.g. 'node 0x200 DOWN (silent for 120 ms, usually every 10.0 ms)'"""
+    if status.alive:
+        return f"node 0x{status.node_id:X} up (back after {status.silent_for * 1000:.0f} ms)"
+    text = f"node 0x{status.node_id:X} DOWN (silent for {status.silent_for * 1000:.0f} ms"
+    if status.mean_interval:
+        text += f", usually every {status.mean_interval * 1000:.1f} ms"
+    return text + ")"
+
+
+def telemetry_frames(message):
+    """The telemetry CanFrames carried by a HostMessage, single or batched"""
+    if message.kind == host_pb2.TELEMETRY_BATCH:
+        return message.frames
+    if message.kind == host_pb2.TELEMETRY and message.HasField("frame"):
+        return [message.frame]
+    return []
+
+
+class FrameBatcher:
+    """Coalesces telemetry frames into TELEMETRY_BATCH messages. A batch is due once it
+    holds max_frames frames or its oldest frame has waited max_delay seconds."""
+
+    def __init__(self, sender, recipient, max_frames=64, max_delay=0.005):
+        self.sender = sender
+        self.recipient = recipient
+        self.max_frames = max_frames
+        self.max_delay = max_delay
+        self.pending = []
+        self.oldest = None
+
+    def add(self, frame):
+        if not self.pending:
+            self.oldest = time.monotonic()
+        self.pending.append(frame)
+
+    def time_left(self):
+        """Seconds until the pending batch is due; None if nothing is pending"""
+        if not self.pending:
+            return None
+        if len(self.pending) >= self.max_frames:
+            return 0
+        return max(0, self.oldest + self.max_delay - time.monotonic())
+
+    def flush(self):
+        """Take up to max_frames pending frames as one HostMessage (None if empty)"""
+        if not self.pending:
+            return None
+        frames = self.pending[:self.max_frames]
+        del self.pending[:self.max_frames]
+        self.oldest = time.monotonic() if self.pending else None
+        return host_pb2.HostMessage(
+            sender=self.sender,
+            recipient=self.recipient,
+            kind=host_pb2.TELEMETRY_BATCH,
+            frames=frames,
+        )
+
+
+# Delta-encoded telemetry for remote dashboards. A dashboard asks for it by opening its
+# CommandStream with metadata (TELEMETRY_ENCODING_METADATA, DELTA_ENCODING), and for
+# compressed responses with (TELEMETRY_COMPRESSION_METADATA, 'gzip' or 'deflate').
+TELEMETRY_ENCODING_METADATA = "telemetry-encoding"
+TELEMETRY_COMPRESSION_METADATA = "telemetry-compression"
+DELTA_ENCODING = "delta"
+
+# TelemetryDelta.records is a run of records, each:
+#   header (u16 LE): arbitration ID (bits 0-10), payload length (bits 11-14), full payload (bit 15)
+#   timestamp: zigzag varint, 10 us ticks since the previous record of the stream (the first
+#              record of a keyframe: since its base_timestamp)
+#   full:  the payload
+#   delta: a byte with bit i set for each changed signal of the payload (signal_spans), then
+#          the bytes of those signals. Unchanged frames have no record at all.
+DELTA_HEADER = struct.Struct("<H")
+DELTA_FULL = 0x8000
+DELTA_TICKS_PER_SECOND = 100000
+MAX_DELTA_LENGTH = 8
+
+_spans = {}
+
+
+def signal_spans(arbitration_id, length):
+    """((start, end), ...) byte ranges of a payload's signals, one per field of the board's
+    layout; bytes outside the layout (or of a CAN ID with no layout) are one span each"""
+    key = (arbitration_id, length)
+    spans = _spans.get(key)
+    if spans is None:
+        spans = []
+        layout = TELEMETRY_LAYOUTS.get(arbitration_id)
+        covered = 0
+        if layout is not None:
+            for _, offset, code in layout.fields:
+                if offset >= length:
+                    break
+                end = min(length, offset + struct.calcsize(layout.byte_order + code))
+                spans.append((offset, end))
+                covered = end
+        spans.extend((i, i + 1) for i in range(covered, length))
+        spans = _spans[key] = tuple(spans)
+    return spans
+
+
+def _zigzag_varint(value):
+    value = (value << 1) ^ (value >> 63)
+    out = bytearray()
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return out
+
+
+class DeltaEncoder:
+    """Turns the telemetry sent to one dashboard into TELEMETRY_DELTA messages: per CAN ID
+    only the signals that changed since the last update it got. Every keyframe_interval
+    seconds the next update is a keyframe with the full payload of every CAN ID seen."""
+
+    def __init__(self, keyframe_interval=1.0):
+        self.keyframe_interval = keyframe_interval
+        self.last = {}              # arbitration ID -> (payload, timestamp) as last sent
+        self.next_keyframe = 0.0    # the first update is a keyframe
+        self.base = None            # base_timestamp of the last keyframe
+        self.ticks = 0              # timestamp of the last record, in ticks since base
+        self.frames = 0
+        self.records = 0
+
+    def encode(self, message):
+        """The message to send instead of `message`: non-telemetry messages, and batches with
+        a frame a record can't hold, unchanged; None if no signal changed"""
+        frames = telemetry_frames(message)
+        if not frames:
+            return message
+        if any(len(frame.data) > MAX_DELTA_LENGTH or not 0 <= frame.arbitration_id <= MAX_CAN_ID
+               for frame in frames):
+            # A payload or ID the record header can't hold (CAN FD, extended IDs): send it as
+            # it is, and those IDs in full next time
+            for frame in frames:
+                self.last.pop(frame.arbitration_id, None)
+            return message
+        now = time.monotonic()
+        keyframe = now >= self.next_keyframe
+        records = bytearray()
+        for frame in frames:
+            arbitration_id, data = frame.arbitration_id, frame.data
+            previous = self.last.get(arbitration_id)
+            self.last[arbitration_id] = (data, frame.timestamp)
+            self.frames += 1
+            if not keyframe and (previous is None or previous[0] != data):
+                self._record(records, arbitration_id, data, frame.timestamp, previous)
+        if keyframe:
+            # The newest payload of every CAN ID, in the order first seen
+            self.next_keyframe = now + self.keyframe_interval
+            self.base, self.ticks = next(iter(self.last.values()))[1], 0
+            for arbitration_id, (data, timestamp) in self.last.items():
+                self._record(records, arbitration_id, data, timestamp, None)
+        elif not records:
+            return None
+        # No recipient: the stream only goes to one dashboard
+        delta = host_pb2.TelemetryDelta(keyframe=keyframe, records=bytes(records))
+        if keyframe:
+            delta.base_timestamp = self.base
+        return host_pb2.HostMessage(sender=message.sender, kind=host_pb2.TELEMETRY_DELTA, delta=delta)
+
+    def _record(self, records, arbitration_id, data, timestamp, previous):
+        at = round((timestamp - self.base) * DELTA_TICKS_PER_SECOND)
+        length = len(data)
+        if previous is None or len(previous[0]) != length:
+            records += DELTA_HEADER.pack(arbitration_id | length << 11 | DELTA_FULL)
+            records += _zigzag_varint(at - self.ticks)
+            records += data
+        else:
+            records += DELTA_HEADER.pack(arbitration_id | length << 11)
+            records += _zigzag_varint(at - self.ticks)
+            old = previous[0]
+            mask, changed = 0, bytearray()
+            for bit, (start, end) in enumerate(signal_spans(arbitration_id, length)):
+                if data[start:end] != old[start:end]:
+                    mask |= 1 << bit
+                    changed += data[start:end]
+            records.append(mask)
+            records += changed
+        self.ticks = at
+        self.records += 1
+
+
+class DeltaDecoder:
+    """Rebuilds CanFrames from the TELEMETRY_DELTA messages of one stream"""
+
+    def __init__(self):
+        self.last = {}      # arbitration ID -> payload
+        self.base = None    # base_timestamp of the last keyframe
+        self.ticks = 0
+        self.missed = 0     # records before the first keyframe, or deltas with no payload to apply them to
+
+    def decode(self, message):
+        """The CanFrames carried by a HostMessage; TELEMETRY_DELTA records are applied to
+        the last payload of their CAN ID"""
+        if message.kind != host_pb2.TELEMETRY_DELTA:
+            return telemetry_frames(message)
+        delta = message.delta
+        if delta.keyframe:
+            self.base, self.ticks = delta.base_timestamp, 0
+        records = delta.records
+        frames = []
+        position, ticks = 0, self.ticks
+        while position < len(records):
+            header, = DELTA_HEADER.unpack_from(records, position)
+            position += DELTA_HEADER.size
+            value, shift = 0, 0
+            while True:
+                byte = records[position]
+                position += 1
+                value |= (byte & 0x7F) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+            ticks += (value >> 1) ^ -(value & 1)
+            arbitration_id, length = header & 0x7FF, header >> 11 & 0xF
+            if header & DELTA_FULL:
+                data = records[position:position + length]
+                position += length
+            else:
+                mask = records[position]
+                position += 1
+                old = self.last.get(arbitration_id)
+                data = bytearray(old) if old is not None and len(old) == length else None
+                for bit, (start, end) in enumerate(signal_spans(arbitration_id, length)):
+                    if mask >> bit & 1:
+                        if data is not None:
+                            data[start:end] = records[position:position + end - start]
+                        position += end - start
+                if data is None:
+                    self.missed += 1
+                    continue
+                data = bytes(data)
+            self.last[arbitration_id] = data
+            if self.base is None:
+                self.missed += 1
+                continue
+            frames.append(host_pb2.CanFrame(arbitration_id=arbitration_id, data=data,
+                                            timestamp=self.base + ticks / DELTA_TICKS_PER_SECOND))
+        self.ticks = ticks
+        return frames
+
+
+def describe_message(message):
+    """Short description of a HostMessage for console output"""
+    if message.kind == host_pb2.TELEMETRY_BATCH:
+        return f"batch of {len(message.frames)} frames"
+    if message.kind == host_pb2.TELEMETRY_AGGREGATE:
+        return f"aggregates of {len(message.aggregates)} CAN IDs"
+    if message.kind == host_pb2.NODE_STATUS:
+        return format_node_status(message.node_status)
+    if message.kind == host_pb2.TELEMETRY_DELTA:
+        return f"{'keyframe' if message.delta.keyframe else 'delta'} of {len(message.delta.records)} bytes"
+    if message.HasField("frame"):
+        return f"ID=0x{message.frame.arbitration_id:03X}, Data={message.frame.data.hex().upper()}"
+    return message.command
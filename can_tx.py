@@ -0,0 +1,177 @@
+"""CAN transmit stage for the motor control client.
+
+CanTransmitter owns the bus: enqueue(), set_periodic() and stop_periodic() only append to
+its queue and return, and a TX thread carries them out in order, so the gRPC receive loop
+never waits on the bus and a keep-alive never goes out ahead of the command queued before
+it. MC_STOP discards the frames and keep-alive updates still queued for its ID, stops the
+periodic tasks on that ID and then goes out ahead of the rest of the queue (other IDs), so
+nothing the operator sent before a STOP reaches the bus after it. One can.Message per arbitration ID is
+allocated up front and refilled for every send. Frames that have to repeat (throttle
+keep-alive) run as python-can cyclic tasks (send_periodic, a kernel BCM task on socketcan)
+whose data is changed in place with modify_data(), so a new throttle value does not restart
+the task.
+
+Every failed send is counted (stats()) and logged; it never raises into the caller.
+"""
+import collections
+import logging
+import threading
+import time
+
+import can
+
+from can_protocol import MC_STOP
+
+logger = logging.getLogger("motor")
+
+
+class CanTransmitter:
+    """Queue -> TX thread -> bus, plus named periodic tasks"""
+
+    def __init__(self, bus, can_ids=()):
+        self.bus = bus
+        self.queue = collections.deque()    # (operation, args, enqueued_at)
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.frames = {can_id: self._new_frame(can_id) for can_id in can_ids}
+        self.periodic = {}                  # name -> (cyclic task, its can.Message); TX thread only
+        self._stopped = False
+        self.thread = None
+        # Counters (read with stats())
+        self.sent = 0
+        self.tx_errors = 0
+        self.periodic_errors = 0
+        self.discarded = 0                  # queued frames/keep-alive updates dropped by an MC_STOP
+        self.last_error = None
+        self.max_queue_delay = 0.0          # seconds, longest wait between enqueue() and bus.send()
+
+    @staticmethod
+    def _new_frame(can_id):
+        return can.Message(arbitration_id=can_id, data=bytearray(8), is_extended_id=False, dlc=0)
+
+    def start(self):
+        self._stopped = False
+        self.thread = threading.Thread(target=self._tx_loop, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """Carry out what is queued, then stop the TX thread and the periodic tasks"""
+        with self.lock:
+            self._stopped = True
+            self.ready.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+        self._stop_all_periodic()
+
+    def _put(self, item, first=False):
+        with self.lock:
+            if first:
+                self.queue.appendleft(item)
+            else:
+                self.queue.append(item)
+            self.ready.notify()
+
+    def enqueue(self, can_id, data):
+        """Queue one frame. MC_STOP replaces what is still queued for its ID and goes first."""
+        data = bytes(data)
+        if data[:1] != bytes([MC_STOP]):
+            self._put((self._send, (can_id, data), time.perf_counter()))
+            return
+        with self.lock:
+            kept = collections.deque(item for item in self.queue if not (
+                (item[0] == self._send and item[1][0] == can_id)
+                or (item[0] == self._set_periodic and item[1][1] == can_id)))
+            self.discarded += len(self.queue) - len(kept)
+            self.queue = kept
+        self._put((self._stop, (can_id, data), time.perf_counter()), first=True)
+
+    def set_periodic(self, name, can_id, data, period):
+        """Queue sending `data` on can_id every `period` seconds, after what is already queued.
+        If task `name` is running (same ID and period), its data is replaced in place."""
+        self._put((self._set_periodic, (name, can_id, bytes(data), period), time.perf_counter()))
+
+    def stop_periodic(self, name):
+        """Queue stopping task `name`, dropping its pending set_periodic()s"""
+        with self.lock:
+            self.queue = collections.deque(item for item in self.queue
+                                           if not (item[0] == self._set_periodic and item[1][0] == name))
+        self._put((self._stop_periodic, (name,), time.perf_counter()))
+
+    def _tx_loop(self):
+        while True:
+            with self.lock:
+                while not self.queue and not self._stopped:
+                    self.ready.wait()
+                if not self.queue:
+                    return
+                operation, args, enqueued_at = self.queue.popleft()
+            delay = time.perf_counter() - enqueued_at
+            if delay > self.max_queue_delay:
+                self.max_queue_delay = delay
+            operation(*args)
+
+    def _send(self, can_id, data):
+        frame = self.frames.get(can_id)
+        if frame is None:
+            frame = self.frames[can_id] = self._new_frame(can_id)
+        frame.data[:] = data    # resizes the same bytearray in place
+        frame.dlc = len(data)
+        try:
+            self.bus.send(frame)
+            self.sent += 1
+        except can.CanError as e:
+            self._error("tx_errors", f"Failed to send CAN message ID=0x{can_id:03X}, Data={data.hex().upper()}", e)
+
+    def _stop(self, can_id, data):
+        """MC_STOP: no periodic frame on its ID may follow it"""
+        for name, (_, frame) in list(self.periodic.items()):
+            if frame.arbitration_id == can_id:
+                self._stop_periodic(name)
+        self._send(can_id, data)
+
+    def _error(self, counter, text, e):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            self.last_error = str(e)
+        logger.error(f"[Motor] {text}: {e}")
+
+    def _set_periodic(self, name, can_id, data, period):
+        running = self.periodic.get(name)
+        try:
+            if running is not None:
+                task, frame = running
+                if frame.arbitration_id == can_id and abs(task.period - period) < 1e-9:
+                    frame.data[:] = data
+                    frame.dlc = len(data)
+                    task.modify_data(frame)
+                    return
+                self._stop_periodic(name)
+            frame = can.Message(arbitration_id=can_id, data=data, is_extended_id=False)
+            self.periodic[name] = (self.bus.send_periodic(frame, period), frame)
+        except (can.CanError, NotImplementedError, ValueError) as e:
+            self._error("periodic_errors", f"Failed to set periodic {name} frame on ID=0x{can_id:03X}", e)
+
+    def _stop_periodic(self, name):
+        running = self.periodic.pop(name, None)
+        if running is not None:
+            try:
+                running[0].stop()
+            except can.CanError as e:
+                self._error("periodic_errors", f"Failed to stop periodic {name} frame", e)
+
+    def _stop_all_periodic(self):
+        for name in list(self.periodic):
+            self._stop_periodic(name)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "sent": self.sent,
+                "tx_errors": self.tx_errors,
+                "periodic_errors": self.periodic_errors,
+                "discarded": self.discarded,
+                "last_error": self.last_error,
+                "queued": len(self.queue),
+                "periodic": sorted(self.periodic),
+                "max_queue_delay_ms": round(self.max_queue_delay * 1000, 3),
+            }
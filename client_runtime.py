@@ -0,0 +1,94 @@
+"""Shared runtime for the host clients (telemetry, dashboard, motor control).
+
+Each client owns a gRPC channel and stub, and an outbound queue that its request stream
+blocks on, so an idle client sleeps instead of spinning.
+"""
+import logging
+import os
+import queue
+import threading
+
+import grpc
+import host_pb2_grpc
+
+# Where the clients connect: a gRPC target, either host:port over TCP or unix:<path> for the
+# server's Unix domain socket (clients on the same Pi skip the TCP stack). Set it with the
+# HOST_SERVER_ADDRESS environment variable or a client's --address option.
+TCP_SERVER_ADDRESS = 'localhost:50051'
+UNIX_SOCKET_PATH = '/tmp/waterloop_host.sock'
+LOCAL_SERVER_ADDRESS = f'unix:{UNIX_SOCKET_PATH}'
+SERVER_ADDRESS = os.environ.get("HOST_SERVER_ADDRESS", TCP_SERVER_ADDRESS)
+
+logger = logging.getLogger("client")
+
+# gRPC message compression a client can ask for, by name (--compression)
+COMPRESSION_ALGORITHMS = {"gzip": grpc.Compression.Gzip, "deflate": grpc.Compression.Deflate}
+
+
+
+def add_address_argument(parser):
+    """Add --address (default HOST_SERVER_ADDRESS, else TCP localhost) to a client's CLI"""
+    parser.add_argument("--address", default=SERVER_ADDRESS,
+                        help=f"server to connect to: host:port or unix:<path>, e.g. {LOCAL_SERVER_ADDRESS} "
+                             f"for the local socket (default: $HOST_SERVER_ADDRESS or {TCP_SERVER_ADDRESS})")
+
+
+# Queued by stop() to wake a request stream blocked on the outbound queue
+_STOP = object()
+
+
+class HostClient:
+    """Base class: channel/stub setup, a blocking O(1) outbound queue and a clean stop"""
+    log_prefix = "[Client]"
+
+    def __init__(self, client_id, address=SERVER_ADDRESS, compression=None):
+        self.client_id = client_id
+        self.compression = compression   # name in COMPRESSION_ALGORITHMS for what this client sends
+        self.channel = grpc.insecure_channel(address, compression=COMPRESSION_ALGORITHMS.get(compression))
+        self.stub = host_pb2_grpc.HostControlStub(self.channel)
+        self._running = False
+        self._stop_event = threading.Event()
+        self.outbound = queue.SimpleQueue()
+
+    def send(self, item):
+        """Queue an item for the request stream; safe to call from any thread"""
+        self.outbound.put(item)
+
+    def next_outbound(self, timeout=None):
+        """Block until an item is queued and return it. Returns None if `timeout`
+        seconds pass first, or once the client is stopped (check self._stop_event)."""
+        try:
+            item = self.outbound.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return None if item is _STOP else item
+
+    def outbound_items(self):
+        """Yield queued items as they arrive until the client is stopped"""
+        while not self._stop_event.is_set():
+            item = self.next_outbound()
+            if item is not None:
+                yield item
+
+    def run_stream(self, rpc, request_iterator, metadata=None):
+        """Open a bidirectional stream and hand its responses to process_responses()
+        until the stream ends; closes the channel afterwards"""
+        self._running = True
+        try:
+            responses = rpc(request_iterator, metadata=metadata)
+            self.process_responses(responses)
+        except grpc.RpcError as e:
+            logger.error(f"{self.log_prefix} RPC error: {e}")
+        finally:
+            self._running = False
+            self.channel.close()
+
+    def process_responses(self, response_iterator):
+        for response in response_iterator:
+            pass
+
+    def stop(self):
+        """Stop the client: ends the request stream and the outbound wait"""
+        self._stop_event.set()
+        self.outbound.put(_STOP)
+        print(f"{self.log_prefix} Client stopping...")
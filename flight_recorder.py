@@ -0,0 +1,271 @@
+"""Append-only flight data recorder for every message the server routes.
+
+A run is a directory of segments. Each segment is a binary file of length-prefixed records:
+
+    segment header: b"WLFR", version (u16), wall clock time (f64), monotonic time (f64)
+    record:         body length (u32), monotonic timestamp (f64), sender length (u8),
+                    recipient length (u8), sender, recipient, serialized HostMessage
+
+All integers are little-endian. Next to every segment-NNNNN.rec is a segment-NNNNN.idx of
+(timestamp f64, file offset u64) entries, one per index_interval seconds of traffic, so a
+reader can seek to a point in time without scanning the run.
+
+MessageRouter.route_message only hands the message to record(), which queues it; a background
+thread serializes, writes through a large buffer, rolls segments and maintains the index. If
+a write fails (disk full, drive removed), the error is logged once and recording stops; the
+run up to that point stays readable.
+
+    python HostServer.py --record recordings
+    python flight_recorder.py recordings/run-20250101-120000 --start 30 --end 40
+"""
+import argparse
+import bisect
+import collections
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+
+import host_pb2
+from can_protocol import describe_message
+
+logger = logging.getLogger("recorder")
+
+MAGIC = b"WLFR"
+VERSION = 1
+SEGMENT_HEADER = struct.Struct("<4sHdd")
+RECORD_LENGTH = struct.Struct("<I")
+RECORD_HEADER = struct.Struct("<dBB")
+INDEX_ENTRY = struct.Struct("<dQ")
+
+_STOP = object()
+
+
+class Record(collections.namedtuple("Record", ["timestamp", "sender", "recipient", "payload"])):
+    """One routed message; timestamp is time.monotonic() on the server when it was routed"""
+
+    def message(self):
+        return host_pb2.HostMessage.FromString(self.payload)
+
+
+def _name_bytes(name):
+    """A client name as UTF-8 of at most 255 bytes, cut on a character boundary"""
+    encoded = name.encode()
+    if len(encoded) <= 255:
+        return encoded
+    return encoded[:255].decode(errors="ignore").encode()
+
+
+def _segment_name(number):
+    return f"segment-{number:05d}"
+
+
+class FlightRecorder:
+    """Background writer of a recorded run. record() is safe to call from any thread."""
+
+    def __init__(self, directory, max_segment_bytes=64 * 1024 * 1024, index_interval=1.0,
+                 buffer_size=1024 * 1024, flush_interval=1.0):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.index_interval = index_interval    # seconds of traffic between index entries
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval    # seconds between flushes to the OS
+        self.queue = queue.SimpleQueue()
+        self.recorded = 0
+        self.bytes_written = 0
+        self.failed = False   # set when a write fails; nothing more is recorded
+        self.segment_number = 0
+        self.segment = None
+        self.index = None
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def record(self, message, timestamp=None):
+        """Queue a routed message; serialization and I/O happen on the writer thread.
+        timestamp (time.monotonic() by default) is for tools that write a run themselves."""
+        if self.failed:
+            return
+        self.queue.put((time.monotonic() if timestamp is None else timestamp, message))
+
+    def close(self):
+        """Write everything queued so far and close the current segment"""
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    def _open_segment(self, timestamp):
+        """Start a new segment whose header time is that of its first record"""
+        self._close_segment()
+        self.segment_number += 1
+        path = os.path.join(self.directory, _segment_name(self.segment_number))
+        self.segment = open(path + ".rec", "wb", buffering=self.buffer_size)
+        self.index = open(path + ".idx", "wb")
+        wall_time = time.time() - (time.monotonic() - timestamp)
+        self.segment.write(SEGMENT_HEADER.pack(MAGIC, VERSION, wall_time, timestamp))
+        self.segment_bytes = SEGMENT_HEADER.size
+        self.next_index_time = None
+
+    def _close_segment(self):
+        if self.segment is not None:
+            segment, index = self.segment, self.index
+            self.segment = self.index = None
+            try:
+                segment.close()
+            finally:
+                index.close()
+
+    def _write(self, timestamp, message):
+        sender = _name_bytes(message.sender)
+        recipient = _name_bytes(message.recipient)
+        payload = message.SerializeToString()
+        body_length = RECORD_HEADER.size + len(sender) + len(recipient) + len(payload)
+        if self.segment is None or self.segment_bytes + RECORD_LENGTH.size + body_length > self.max_segment_bytes:
+            self._open_segment(timestamp)
+        if self.next_index_time is None or timestamp >= self.next_index_time:
+            self.index.write(INDEX_ENTRY.pack(timestamp, self.segment_bytes))
+            self.next_index_time = timestamp + self.index_interval
+        self.segment.write(RECORD_LENGTH.pack(body_length)
+                           + RECORD_HEADER.pack(timestamp, len(sender), len(recipient))
+                           + sender + recipient + payload)
+        self.segment_bytes += RECORD_LENGTH.size + body_length
+        self.bytes_written += RECORD_LENGTH.size + body_length
+        self.recorded += 1
+
+    def _write_loop(self):
+        try:
+            self._write_queued()
+            self._close_segment()
+        except OSError as e:
+            self.failed = True
+            logger.error(f"[Recorder] Recording to {self.directory} stopped after {self.recorded} messages: {e}")
+            # Drop what is still queued and whatever the closed files can't take
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._close_segment()
+            except OSError:
+                pass
+
+    def _write_queued(self):
+        """Write queued messages until close()"""
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                self._write(*item)
+            if time.monotonic() >= next_flush:
+                if self.segment is not None:
+                    self.segment.flush()
+                    self.index.flush()
+                next_flush = time.monotonic() + self.flush_interval
+
+
+class FlightLog:
+    """Reader for a recorded run. Records are streamed from disk one at a time."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = sorted(os.path.join(directory, name[:-len(".rec")])
+                               for name in os.listdir(directory) if name.endswith(".rec"))
+        if not self.segments:
+            raise ValueError(f"No recorded segments in {directory}")
+        with open(self.segments[0] + ".rec", "rb") as segment:
+            _, self.wall_start, self.start_time = self._read_header(segment)
+
+    @staticmethod
+    def _read_header(segment):
+        magic, version, wall_time, monotonic_time = SEGMENT_HEADER.unpack(segment.read(SEGMENT_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a flight recorder segment: {segment.name}")
+        return version, wall_time, monotonic_time
+
+    def _read_index(self, path):
+        with open(path + ".idx", "rb") as index:
+            data = index.read()
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        return list(INDEX_ENTRY.iter_unpack(data[:usable]))
+
+    def records(self, start=None, end=None):
+        """Yield Records with start <= timestamp - start_time < end (seconds into the run).
+        The index is used to skip straight to the first segment and offset that can match."""
+        start_at = None if start is None else self.start_time + start
+        end_at = None if end is None else self.start_time + end
+        segments = self.segments
+        offset = None
+        if start_at is not None:
+            # Last segment whose first indexed record is not after the start time
+            first_times = []
+            for path in segments:
+                entries = self._read_index(path)
+                first_times.append(entries[0][0] if entries else float("inf"))
+            position = max(0, bisect.bisect_right(first_times, start_at) - 1)
+            segments = segments[position:]
+            entries = self._read_index(segments[0])
+            times = [timestamp for timestamp, _ in entries]
+            before = bisect.bisect_right(times, start_at) - 1
+            offset = entries[before][1] if before >= 0 else None
+
+        for path in segments:
+            for record in self._read_segment(path, offset):
+                if end_at is not None and record.timestamp >= end_at:
+                    return
+                if start_at is None or record.timestamp >= start_at:
+                    yield record
+            offset = None
+
+    def _read_segment(self, path, offset=None):
+        with open(path + ".rec", "rb") as segment:
+            self._read_header(segment)
+            if offset is not None:
+                segment.seek(offset)
+            while True:
+                prefix = segment.read(RECORD_LENGTH.size)
+                if len(prefix) < RECORD_LENGTH.size:
+                    return
+                (length,) = RECORD_LENGTH.unpack(prefix)
+                body = segment.read(length)
+                if len(body) < length:
+                    return   # truncated by a crash mid-write
+                timestamp, sender_length, recipient_length = RECORD_HEADER.unpack_from(body)
+                position = RECORD_HEADER.size
+                sender = body[position:position + sender_length].decode(errors="replace")
+                position += sender_length
+                recipient = body[position:position + recipient_length].decode(errors="replace")
+                position += recipient_length
+                yield Record(timestamp, sender, recipient, body[position:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the messages of a recorded run")
+    parser.add_argument("run", help="run directory written by HostServer.py --record")
+    parser.add_argument("--start", type=float, help="seconds into the run to start at")
+    parser.add_argument("--end", type=float, help="seconds into the run to stop at")
+    parser.add_argument("--summary", action="store_true", help="only print message counts per route")
+    args = parser.parse_args()
+
+    log = FlightLog(args.run)
+    print(f"[Recorder] {args.run}: {len(log.segments)} segment(s), "
+          f"started {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(log.wall_start))}")
+    routes = collections.Counter()
+    for record in log.records(args.start, args.end):
+        if args.summary:
+            routes[(record.sender, record.recipient)] += 1
+        else:
+            print(f"[Recorder] {record.timestamp - log.start_time:10.6f} "
+                  f"{record.sender} -> {record.recipient}: {describe_message(record.message())}")
+    for (sender, recipient), count in routes.most_common():
+        print(f"[Recorder] {sender} -> {recipient}: {count} messages")
+
+
+if __name__ == "__main__":
+    main()
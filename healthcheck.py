@@ -1,23 +1,35 @@
-import can
-import struct
-import RPi.GPIO as GPIO # RPi.GPIO is built for RPi only
+"""Boot-time health check of the STM32 boards on the CAN bus.
+
+Every board is pinged at once and replies are matched to their board by arbitration ID
+until all have answered or one overall deadline passes, so the check takes as long as the
+slowest board rather than the sum of all of them. The result gives each board's status and
+round-trip time; the status LEDs go through a small interface so the check also runs
+without a Pi:
+
+    python healthcheck.py                                  # can0 and the GPIO LEDs
+    python healthcheck.py --interface virtual --simulate   # python-can virtual bus, simulated boards
+"""
+import argparse
+import collections
 import logging
+import threading
 import time
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+import can
+
+from host_logging import add_logging_arguments, setup_logging_from_args
+
+logger = logging.getLogger("healthcheck")
 
 # Initialization of CAN BUS Interface
 CAN_INTERFACE = 'can0' # Check if can0 is the correct configuration - check with ifconfig or ip a
-BUS = can.interface.Bus(CAN_INTERFACE, bustype = 'socketcan')
 
 # Board Types for reference
 # # Enum for board types
 # BMS = 0
 # ST = 1
 # MC = 2
- 
+
 # # Define the board types for easier reference
 # BOARD_TYPES = {
 #     BMS: "BMS",
@@ -25,77 +37,231 @@ BUS = can.interface.Bus(CAN_INTERFACE, bustype = 'socketcan')
 #     MC: "MC"
 # }
 
-# Setup code for GPIO
-GPIO.setwarnings(False)
+# GPIO pins (BCM numbering) of the status LEDs
 RED = 17
 GREEN = 27
 BLUE = 22
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(RED, GPIO.OUT)
-GPIO.setup(GREEN, GPIO.OUT)
-GPIO.setup(BLUE, GPIO.OUT)
 
 # Define STM32 board arbitration IDs
 STM32_BMS_ID = 0x67a                # STM32 Board 1 - BMS
 STM32_ST_ID = 0x200                 # STM32 Board 2 - S&T
 STM32_MC_ID = 0x300                 # STM32 Board 3 - Motor Controller
-STM32_IDS=[0x100 , 0x200 , 0x300]   # List for all the stm32 ids
- 
-# Function to send CAN message
-def send_can_message(node_id, data):
-    try:
-        msg = can.Message(arbitration_id=node_id, data=data, is_extended_id=False)
-        BUS.send(msg)
-        logger.info(f"Sent CAN message to ID={node_id}, Data={data}")
-    except can.CanError as e:
-        logger.error(f"Failed to send CAN message: {e}")
-        GPIO.output(RED, GPIO.HIGH)
- 
-def send_telemetry():
+STM32_IDS = [STM32_BMS_ID, STM32_ST_ID, STM32_MC_ID]   # List for all the stm32 ids
+
+STM32_NAMES = {STM32_BMS_ID: "BMS", STM32_ST_ID: "S&T", STM32_MC_ID: "MC"}
+
+# A board answers the health check request on its own ID with the same payload
+HEALTH_REQUEST = bytes([0x01, 0x02, 0x03, 0x04])
+EXPECTED_RESPONSE = HEALTH_REQUEST
+
+# Node status
+OK = "ok"
+BAD_RESPONSE = "bad_response"     # answered, but not with EXPECTED_RESPONSE
+NO_RESPONSE = "no_response"       # no answer before the deadline
+SEND_FAILED = "send_failed"       # the request could not be put on the bus
+
+NodeHealth = collections.namedtuple("NodeHealth", ["node_id", "status", "rtt", "data"])
+NodeHealth.__doc__ = "Result for one board; rtt (seconds) and data are None without a response"
+
+
+class GpioLeds:
+    """Status LEDs on the Pi's GPIO header"""
+
+    def __init__(self, red=RED, green=GREEN, blue=BLUE):
+        import RPi.GPIO as GPIO # RPi.GPIO is built for RPi only
+        self.GPIO = GPIO
+        self.red, self.green = red, green
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+        for pin in (red, green, blue):
+            GPIO.setup(pin, GPIO.OUT)
+
+    def error(self):
+        # Turn on the error indication LED
+        self.GPIO.output(self.red, self.GPIO.HIGH)
+
+    def success(self):
+        # Turn off the error indication LED if it was on, turn on the success indication LED
+        self.GPIO.output(self.red, self.GPIO.LOW)
+        self.GPIO.output(self.green, self.GPIO.HIGH)
+
+    def close(self):
+        self.GPIO.cleanup()  # Clean up GPIO pins
+
+
+class LogLeds:
+    """Stand-in for GpioLeds off the Pi: logs what the LEDs would show"""
+
+    def __init__(self):
+        self.state = None
+
+    def error(self):
+        self.state = "error"
+        logger.info("[Health] LED: red")
+
+    def success(self):
+        self.state = "success"
+        logger.info("[Health] LED: green")
+
+    def close(self):
+        pass
+
+
+class HealthCheck:
+    """Pings every board at once and collects the replies against one deadline"""
+
+    def __init__(self, bus, node_ids=STM32_IDS, request=HEALTH_REQUEST, expected=EXPECTED_RESPONSE, leds=None):
+        self.bus = bus
+        self.node_ids = list(node_ids)
+        self.request = bytes(request)
+        self.expected = bytes(expected)
+        self.leds = leds
+
+    def run(self, timeout=1.0):
+        """{node ID: NodeHealth}, after every board replied or `timeout` seconds passed"""
+        deadline = time.perf_counter() + timeout
+        sent_at = {}
+        results = {}
+        for node_id in self.node_ids:
+            try:
+                self.bus.send(can.Message(arbitration_id=node_id, data=self.request, is_extended_id=False))
+                sent_at[node_id] = time.perf_counter()
+            except can.CanError as e:
+                logger.error(f"[Health] Failed to send health check to ID=0x{node_id:X}: {e}")
+                results[node_id] = NodeHealth(node_id, SEND_FAILED, None, None)
+
+        while len(results) < len(self.node_ids):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                msg = self.bus.recv(timeout=remaining)
+            except can.CanError as e:
+                logger.error(f"[Health] Error while receiving CAN message: {e}")
+                continue
+            if msg is None:
+                break
+            node_id = msg.arbitration_id
+            if node_id not in sent_at or node_id in results:
+                # Other traffic, or a second reply: not an answer to this check
+                logger.debug(f"[Health] Ignoring frame from ID=0x{node_id:X}")
+                continue
+            rtt = time.perf_counter() - sent_at[node_id]
+            data = bytes(msg.data)
+            status = OK if data == self.expected else BAD_RESPONSE
+            results[node_id] = NodeHealth(node_id, status, rtt, data)
+
+        for node_id in self.node_ids:
+            if node_id not in results:
+                results[node_id] = NodeHealth(node_id, NO_RESPONSE, None, None)
+        self._report(results)
+        return {node_id: results[node_id] for node_id in self.node_ids}
+
+    def _report(self, results):
+        for node_id in self.node_ids:
+            health = results[node_id]
+            name = f"STM32 {STM32_NAMES[node_id]} (ID=0x{node_id:X})" if node_id in STM32_NAMES \
+                else f"STM32 (ID=0x{node_id:X})"
+            if health.status == OK:
+                logger.info(f"[Health] {name} initialized successfully, RTT {health.rtt * 1000:.2f} ms")
+            elif health.status == BAD_RESPONSE:
+                logger.error(f"[Health] {name} sent an unexpected response: {list(health.data)}")
+            elif health.status == NO_RESPONSE:
+                logger.error(f"[Health] No response from {name}")
+        if self.leds is not None:
+            if all(health.status == OK for health in results.values()):
+                self.leds.success()
+            else:
+                self.leds.error()
+
+
+class NodeSimulator:
+    """Answers health check requests on a (virtual) bus like the boards would, for testing.
+    Each node replies after its delay in seconds; nodes in `silent` never reply."""
+
+    def __init__(self, bus, delays, request=HEALTH_REQUEST, response=EXPECTED_RESPONSE, silent=()):
+        self.bus = bus
+        self.delays = dict(delays)
+        self.request = bytes(request)
+        self.response = bytes(response)
+        self.silent = set(silent)
+        self.timers = []
+        self.notifier = can.Notifier(bus, [self._on_message])
+
+    def _on_message(self, msg):
+        node_id = msg.arbitration_id
+        if node_id in self.delays and node_id not in self.silent and bytes(msg.data) == self.request:
+            reply = can.Message(arbitration_id=node_id, data=self.response, is_extended_id=False)
+            timer = threading.Timer(self.delays[node_id], self.bus.send, args=(reply,))
+            timer.daemon = True
+            timer.start()
+            self.timers.append(timer)
+
+    def close(self):
+        self.notifier.stop()
+        for timer in self.timers:
+            timer.cancel()
+
+
+def send_telemetry(bus):
+    """Send a test frame from every board once a second, forever. A failed send is logged
+    and the loop carries on."""
     while True:
-        send_can_message(STM32_BMS_ID, [0x01, 0x02, 0x03, 0x04])
-        send_can_message(STM32_ST_ID,  [0x01, 0x02, 0x03, 0x04])
-        send_can_message(STM32_MC_ID,  [0x01, 0x02, 0x03, 0x04])
+        for node_id in STM32_IDS:
+            try:
+                bus.send(can.Message(arbitration_id=node_id, data=[0x01, 0x02, 0x03, 0x04], is_extended_id=False))
+            except can.CanError as e:
+                logger.error(f"[Health] Failed to send test telemetry from ID=0x{node_id:X}: {e}")
         time.sleep(1)
- 
-def health_checkup():
-    for node_id in STM32_IDS:
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that every STM32 board answers on the CAN bus")
+    parser.add_argument("--interface", default="socketcan",
+                        help="python-can interface, e.g. 'virtual' for testing without a bus")
+    parser.add_argument("--channel", default=CAN_INTERFACE, help="CAN channel")
+    parser.add_argument("--timeout", type=float, default=1.0, help="seconds to wait for all boards")
+    parser.add_argument("--simulate", action="store_true",
+                        help="answer for the boards from this process (use with --interface virtual)")
+    parser.add_argument("--silent", action="append", default=[], type=lambda text: int(text, 0),
+                        help="with --simulate, a board ID that never answers (repeatable)")
+    parser.add_argument("--send-telemetry", action="store_true",
+                        help="after the check, send a test frame from every board once a second until Ctrl+C")
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging_from_args(args)
+
+    bus = can.interface.Bus(args.channel, interface=args.interface)
+    simulator = None
+    if args.simulate:
+        # Replies 5-15 ms after the request
+        delays = {node_id: 0.005 * (i + 1) for i, node_id in enumerate(STM32_IDS)}
+        simulator = NodeSimulator(can.interface.Bus(args.channel, interface=args.interface), delays,
+                                  silent=args.silent)
+    try:
+        leds = GpioLeds()
+    except (ImportError, RuntimeError):
+        logger.info("[Health] RPi.GPIO not available, showing LED state in the log")
+        leds = LogLeds()
+
+    start = time.perf_counter()
+    results = HealthCheck(bus, leds=leds).run(args.timeout)
+    healthy = sum(health.status == OK for health in results.values())
+    logger.info(f"[Health] {healthy}/{len(results)} boards healthy in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    if args.send_telemetry:
         try:
-            send_can_message(node_id, [0x01, 0x02, 0x03, 0x04])  # Send the health check request
-            msg = BUS.recv(timeout=1)  # Wait for a message within the timeout period
-            if msg is None:
-                logger.error(f"No response from STM32 with ID=0x{node_id:X}")
-                error_indication_led()
-                return False  # Avoid further processing for this node
-            if msg.arbitration_id != node_id:
- 
-                logger.error(f"Unexpected message received from node ID=0x{msg.arbitration_id:X}.")
-                error_indication_led()
-                return False
-            print(f"Received message from STM32: ID=0x{node_id:X}, Data={msg.data}")
-            expected_packet=[0x01, 0x02, 0x03, 0x04]
-            if msg.data == expected_packet:
-                logger.info(f"STM32 ID=0x{node_id:X} Initialized successfully")
-                success_indication_led()
-            else:
-                print(f"STM32 (ID=0x{node_id:X}) sent an unexpected response: {list(msg.data)}")
-                error_indication_led()
-        except can.CanError as e:
-            logger.error(f"Error while receiving CAN message: {e}")
-            error_indication_led()
-            return False  # Added return for error case
- 
-def error_indication_led():
-    # Turn on the error indication LED
-    GPIO.output(RED, GPIO.HIGH)
- 
-def success_indication_led():
-    # Turn off the error indication LED if it was on
-    GPIO.output(RED, GPIO.LOW)
-    # Turn on the success indication LED
-    GPIO.output(GREEN, GPIO.HIGH)
-    GPIO.cleanup()  # Clean up GPIO pins
- 
+            send_telemetry(bus)
+        except KeyboardInterrupt:
+            pass
+
+    leds.close()
+    if simulator is not None:
+        simulator.close()
+        simulator.bus.shutdown()
+    bus.shutdown()
+    raise SystemExit(0 if healthy == len(results) else 1)
+
+
 if __name__ == "__main__":
-    send_telemetry()
-    health_checkup()
\ No newline at end of file
+    main()
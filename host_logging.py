@@ -0,0 +1,138 @@
+"""Low-overhead logging shared by the server and the clients.
+
+setup_logging() sends every record through a QueueHandler, so the thread that logs only
+formats the record and appends it to a queue; a single background QueueListener thread
+does the actual console I/O. Levels can be set per category (logger name, e.g.
+'host.router') and a per-category rate limit samples chatty DEBUG/INFO traffic. Hot paths
+ask sample() first, so a line the rate limit would drop is never formatted:
+
+    if sample(telemetry_log):
+        telemetry_log.info(f"... {format_telemetry(frame)}", extra=SAMPLED)
+
+Categories used in this repo:
+    host.router          client registration, subscriptions and every routed message (DEBUG)
+    host.stream          per-message stream traffic on the server (DEBUG) and stream errors
+    telemetry, motor     client-side traffic (per-batch sends are DEBUG)
+    dashboard            commands sent and non-telemetry replies
+    dashboard.telemetry  telemetry lines shown by the dashboard (sampled at 20/s by default)
+    client               RPC errors from any client
+    can_ingest           CAN ingest stats and reader errors
+    healthcheck          boot-time board health check
+    liveness             CAN nodes going silent or coming back
+    recorder             flight recorder write errors
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+LOG_FORMAT = "%(message)s"
+
+# `extra` for a record that already passed sample(), so the rate limit doesn't count it twice
+SAMPLED = {"sampled": True}
+
+_rate_limit = None   # the RateLimitFilter installed by setup_logging()
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most max_per_second records per category; WARNING and above always pass.
+    The next record after a suppressed run reports how many were dropped."""
+
+    def __init__(self, max_per_second):
+        super().__init__()
+        self.max_per_second = max_per_second
+        self.buckets = {}   # logger name -> [tokens, last refill time, suppressed count]
+        self.lock = threading.Lock()   # records are filtered on whichever thread logs them
+
+    def take(self, name):
+        """Use up one of the category's tokens; False (and counted as suppressed) if there is none"""
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(name)
+            if bucket is None:
+                bucket = self.buckets[name] = [self.max_per_second, now, 0]
+            bucket[0] = min(self.max_per_second, bucket[0] + (now - bucket[1]) * self.max_per_second)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            return True
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        if not getattr(record, "sampled", False) and not self.take(record.name):
+            return False
+        with self.lock:
+            bucket = self.buckets.get(record.name)
+            suppressed = bucket[2] if bucket else 0
+            if suppressed:
+                bucket[2] = 0
+        if suppressed:
+            record.msg = f"{record.msg} (+{suppressed} similar messages suppressed)"
+        return True
+
+
+def sample(logger, level=logging.INFO):
+    """Whether a line at `level` in this category would be logged, taking a rate limit token
+    if so. Log the line with extra=SAMPLED."""
+    if not logger.isEnabledFor(level):
+        return False
+    return _rate_limit is None or level >= logging.WARNING or _rate_limit.take(logger.name)
+
+
+def setup_logging(level=logging.INFO, category_levels=None, max_per_second=None):
+    """Install the queue-backed handler on the root logger (replacing existing handlers).
+    category_levels: {logger name: level}. max_per_second: per-category rate limit, or None.
+    Returns the QueueListener; it is stopped (and flushed) at exit."""
+    global _rate_limit
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    _rate_limit = RateLimitFilter(max_per_second) if max_per_second else None
+    if _rate_limit is not None:
+        queue_handler.addFilter(_rate_limit)
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, console)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name, category_level in (category_levels or {}).items():
+        logging.getLogger(name).setLevel(category_level)
+    return listener
+
+
+def logging_settings():
+    """setup_logging() arguments that repeat this process's logging setup (for spawned workers)"""
+    root = logging.getLogger()
+    category_levels = {name: logger.level for name, logger in root.manager.loggerDict.items()
+                       if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET}
+    return {"level": root.level, "category_levels": category_levels,
+            "max_per_second": _rate_limit.max_per_second if _rate_limit is not None else None}
+
+
+def add_logging_arguments(parser):
+    """Standard logging options for the command line entry points"""
+    parser.add_argument("--log-level", default="info", help="default log level (debug, info, warning, ...)")
+    parser.add_argument("--log", action="append", default=[], metavar="CATEGORY=LEVEL",
+                        help="level for one category, e.g. host.router=debug (repeatable)")
+    parser.add_argument("--log-rate", type=float, default=None, metavar="N",
+                        help="log at most N debug/info lines per second per category")
+
+
+def setup_logging_from_args(args):
+    category_levels = {}
+    for setting in args.log:
+        name, _, level = setting.partition("=")
+        category_levels[name] = level.upper()
+    return setup_logging(args.log_level.upper(), category_levels, args.log_rate)
@@ -0,0 +1,155 @@
+"""Metrics for the host server, exposed in the Prometheus text format.
+
+MessageRouter counts messages and bytes per route (sender -> recipient, by message kind),
+and every ClientQueue keeps its own delivery counters and a histogram of how long messages
+waited between put() and get(). Recording is a few integer updates under locks the router
+already holds; formatting only happens when the endpoint is scraped.
+
+    python HostServer.py --metrics-port 9105
+    curl localhost:9105/metrics
+"""
+import bisect
+import http.server
+import threading
+
+import host_pb2
+
+# Upper bounds (seconds) of the queue latency histogram buckets
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram; not thread safe, callers record under their own lock"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def snapshot(self):
+        """(cumulative bucket counts, count, sum)"""
+        cumulative, total = [], 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative, self.count, self.sum
+
+
+def _escape(value):
+    """A label value as the text format needs it: backslash, double quote and newline escaped
+    (client names come from the clients)"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _kind_name(kind):
+    try:
+        return host_pb2.MessageKind.Name(kind).lower()
+    except ValueError:
+        return str(kind)
+
+
+def metrics_text(router, open_streams=None):
+    """Render a MessageRouter's metrics (and optionally the servicer's open stream counts)"""
+    with router.lock:
+        routes = {route: list(counts) for route, counts in router.route_counts.items()}
+        client_queues = list(router.client_queues.items())
+
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{name}{labels} {value}" for labels, value in samples)
+
+    route_labels = {route: _labels(sender=route[0], recipient=route[1], kind=_kind_name(route[2]))
+                    for route in routes}
+    metric("host_route_messages_total", "counter", "Messages routed, by route",
+           [(route_labels[route], counts[0]) for route, counts in routes.items()])
+    metric("host_route_bytes_total", "counter", "Serialized bytes routed, by route",
+           [(route_labels[route], counts[1]) for route, counts in routes.items()])
+    metric("host_route_undelivered_total", "counter", "Messages that had no recipient or subscriber",
+           [(route_labels[route], counts[2]) for route, counts in routes.items()])
+
+    clients = [(client_id, client_queue.stats()) for client_id, client_queue in client_queues]
+    metric("host_client_delivered_messages_total", "counter", "Messages handed to the client's stream",
+           [(_labels(client=client_id), stats["delivered"]) for client_id, stats in clients])
+    metric("host_client_delivered_bytes_total", "counter", "Serialized bytes handed to the client's stream",
+           [(_labels(client=client_id), stats["delivered_bytes"]) for client_id, stats in clients])
+    metric("host_client_queue_depth", "gauge", "Messages waiting in the client's queue, by lane",
+           [(_labels(client=client_id, lane=lane), depth)
+            for client_id, stats in clients for lane, depth in stats["depth"].items()])
+    metric("host_client_dropped_total", "counter", "Messages dropped by the lane's overflow policy",
+           [(_labels(client=client_id, lane=lane), dropped)
+            for client_id, stats in clients for lane, dropped in stats["dropped"].items()])
+    metric("host_client_conflated_total", "counter", "Telemetry frames merged into a later update by the client's rate limit",
+           [(_labels(client=client_id), stats["conflated"]) for client_id, stats in clients])
+
+    name = "host_client_queue_latency_seconds"
+    lines.append(f"# HELP {name} Time between a message being queued for a client and its stream taking it")
+    lines.append(f"# TYPE {name} histogram")
+    for client_id, stats in clients:
+        cumulative, count, total = stats["latency"]
+        bounds = [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+        for bound, bucket_count in zip(bounds, cumulative):
+            lines.append(f'{name}_bucket{_labels(client=client_id, le=bound)} {bucket_count}')
+        lines.append(f"{name}_count{_labels(client=client_id)} {count}")
+        lines.append(f"{name}_sum{_labels(client=client_id)} {total:.6f}")
+
+    if open_streams is not None:
+        metric("host_open_streams", "gauge", "Streams currently open, by RPC",
+               [(_labels(rpc=rpc), count) for rpc, count in sorted(open_streams.items())])
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(render, port, host="127.0.0.1"):
+    """Serve render() at http://host:port/metrics from a daemon thread. Returns the HTTP server."""
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass   # keep scrapes out of the server log
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class StreamCounts:
+    """Open streams per RPC, kept by the servicers"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def opened(self, rpc):
+        with self.lock:
+            self.counts[rpc] = self.counts.get(rpc, 0) + 1
+
+    def closed(self, rpc):
+        with self.lock:
+            self.counts[rpc] -= 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
@@ -24,15 +24,27 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nhost.proto\x12\x04host\"A\n\x0bHostMessage\x12\x0e\n\x06sender\x18\x01 \x01(\t\x12\x11\n\trecipient\x18\x02 \x01(\t\x12\x0f\n\x07\x63ommand\x18\x03 \x01(\t2\xc5\x01\n\x0bHostControl\x12;\n\x0fTelemetryStream\x12\x11.host.HostMessage\x1a\x11.host.HostMessage(\x01\x30\x01\x12\x39\n\rCommandStream\x12\x11.host.HostMessage\x1a\x11.host.HostMessage(\x01\x30\x01\x12>\n\x12MotorControlStream\x12\x11.host.HostMessage\x1a\x11.host.HostMessage(\x01\x30\x01\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nhost.proto\x12\x04host\"C\n\x08\x43\x61nFrame\x12\x16\n\x0e\x61rbitration_id\x18\x01 \x01(\r\x12\x0c\n\x04\x64\x61ta\x18\x02 \x01(\x0c\x12\x11\n\ttimestamp\x18\x03 \x01(\x01\"C\n\x0bSignalStats\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0b\n\x03min\x18\x02 \x01(\x01\x12\x0b\n\x03max\x18\x03 \x01(\x01\x12\x0c\n\x04mean\x18\x04 \x01(\x01\"}\n\x12TelemetryAggregate\x12\x1e\n\x06latest\x18\x01 \x01(\x0b\x32\x0e.host.CanFrame\x12\r\n\x05\x63ount\x18\x02 \x01(\r\x12\x14\n\x0cwindow_start\x18\x03 \x01(\x01\x12\"\n\x07signals\x18\x04 \x03(\x0b\x32\x11.host.SignalStats\"K\n\x0eTelemetryDelta\x12\x16\n\x0e\x62\x61se_timestamp\x18\x01 \x01(\x01\x12\x10\n\x08keyframe\x18\x02 \x01(\x08\x12\x0f\n\x07records\x18\x03 \x01(\x0c\"g\n\nNodeStatus\x12\x0f\n\x07node_id\x18\x01 \x01(\r\x12\r\n\x05\x61live\x18\x02 \x01(\x08\x12\x12\n\nsilent_for\x18\x03 \x01(\x01\x12\x15\n\rmean_interval\x18\x04 \x01(\x01\x12\x0e\n\x06jitter\x18\x05 \x01(\x01\"\xab\x02\n\x0bHostMessage\x12\x0e\n\x06sender\x18\x01 \x01(\t\x12\x11\n\trecipient\x18\x02 \x01(\t\x12\x0f\n\x07\x63ommand\x18\x03 \x01(\t\x12\x1f\n\x04kind\x18\x04 \x01(\x0e\x32\x11.host.MessageKind\x12\x1d\n\x05\x66rame\x18\x05 \x01(\x0b\x32\x0e.host.CanFrame\x12\x1e\n\x06\x66rames\x18\x06 \x03(\x0b\x32\x0e.host.CanFrame\x12\x0e\n\x06topics\x18\x07 \x03(\t\x12,\n\naggregates\x18\x08 \x03(\x0b\x32\x18.host.TelemetryAggregate\x12%\n\x0bnode_status\x18\t \x01(\x0b\x32\x10.host.NodeStatus\x12#\n\x05\x64\x65lta\x18\n \x01(\x0b\x32\x14.host.TelemetryDelta*\x8f\x01\n\x0bMessageKind\x12\n\n\x06STATUS\x10\x00\x12\r\n\tTELEMETRY\x10\x01\x12\x11\n\rMOTOR_COMMAND\x10\x02\x12\x13\n\x0fTELEMETRY_BATCH\x10\x03\x12\x17\n\x13TELEMETRY_AGGREGATE\x10\x04\x12\x0f\n\x0bNODE_STATUS\x10\x05\x12\x13\n\x0fTELEMETRY_DELTA\x10\x06\x32\xfa\x01\n\x0bHostControl\x12;\n\x0fTelemetryStream\x12\x11.host.HostMessage\x1a\x11.host.HostMessage(\x01\x30\x01\x12\x39\n\rCommandStream\x12\x11.host.HostMessage\x1a\x11.host.HostMessage(\x01\x30\x01\x12>\n\x12MotorControlStream\x12\x11.host.HostMessage\x1a\x11.host.HostMessage(\x01\x30\x01\x12\x33\n\x0bGetSnapshot\x12\x11.host.HostMessage\x1a\x11.host.HostMessageb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'host_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
-  _globals['_HOSTMESSAGE']._serialized_start=20
-  _globals['_HOSTMESSAGE']._serialized_end=85
-  _globals['_HOSTCONTROL']._serialized_start=88
-  _globals['_HOSTCONTROL']._serialized_end=285
+  _globals['_MESSAGEKIND']._serialized_start=770
+  _globals['_MESSAGEKIND']._serialized_end=913
+  _globals['_CANFRAME']._serialized_start=20
+  _globals['_CANFRAME']._serialized_end=87
+  _globals['_SIGNALSTATS']._serialized_start=89
+  _globals['_SIGNALSTATS']._serialized_end=156
+  _globals['_TELEMETRYAGGREGATE']._serialized_start=158
+  _globals['_TELEMETRYAGGREGATE']._serialized_end=283
+  _globals['_TELEMETRYDELTA']._serialized_start=285
+  _globals['_TELEMETRYDELTA']._serialized_end=360
+  _globals['_NODESTATUS']._serialized_start=362
+  _globals['_NODESTATUS']._serialized_end=465
+  _globals['_HOSTMESSAGE']._serialized_start=468
+  _globals['_HOSTMESSAGE']._serialized_end=767
+  _globals['_HOSTCONTROL']._serialized_start=916
+  _globals['_HOSTCONTROL']._serialized_end=1166
 # @@protoc_insertion_point(module_scope)
@@ -49,6 +49,11 @@ class HostControlStub(object):
                 request_serializer=host__pb2.HostMessage.SerializeToString,
                 response_deserializer=host__pb2.HostMessage.FromString,
                 _registered_method=True)
+        self.GetSnapshot = channel.unary_unary(
+                '/host.HostControl/GetSnapshot',
+                request_serializer=host__pb2.HostMessage.SerializeToString,
+                response_deserializer=host__pb2.HostMessage.FromString,
+                _registered_method=True)
 
 
 class HostControlServicer(object):
@@ -72,6 +77,14 @@ class HostControlServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def GetSnapshot(self, request, context):
+        """Latest frame of every CAN ID the server has routed, as one TELEMETRY_BATCH message.
+        The request's `topics` filter the IDs like a subscription (empty means all).
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_HostControlServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -90,6 +103,11 @@ def add_HostControlServicer_to_server(servicer, server):
                     request_deserializer=host__pb2.HostMessage.FromString,
                     response_serializer=host__pb2.HostMessage.SerializeToString,
             ),
+            'GetSnapshot': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetSnapshot,
+                    request_deserializer=host__pb2.HostMessage.FromString,
+                    response_serializer=host__pb2.HostMessage.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'host.HostControl', rpc_method_handlers)
@@ -181,3 +199,30 @@ class HostControl(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def GetSnapshot(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/host.HostControl/GetSnapshot',
+            host__pb2.HostMessage.SerializeToString,
+            host__pb2.HostMessage.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -0,0 +1,169 @@
+"""CAN ingest and decode in worker processes, feeding the server's router directly.
+
+In the default layout the telemetry client reads the bus and streams batches to the server
+over gRPC. With `HostServer.py --ingest CHANNEL`, the server instead starts one IngestWorker
+per CAN channel: a separate process (its own GIL) runs CanIngest and a FrameBatcher, and
+sends each TELEMETRY_BATCH, serialized, through a pipe. In the server only a reader thread
+per worker remains. It sleeps in the pipe read, parses the batch and routes it, so motor
+commands on the servicer threads compete with one short route_message per batch instead of
+the bus reader, the frame decode and a gRPC stream.
+
+    python HostServer.py --ingest can0
+    python HostServer.py --ingest-interface virtual --ingest sim --ingest-simulate 20000
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import host_pb2
+from can_protocol import TELEMETRY_LAYOUTS, FrameBatcher
+from host_logging import logging_settings, setup_logging
+
+logger = logging.getLogger("can_ingest")
+
+# Workers are spawned rather than forked: forking a process that already runs gRPC threads is unsafe
+_CONTEXT = multiprocessing.get_context("spawn")
+
+# Workers run at a lower priority than the server, so with fewer cores than processes the
+# kernel still runs a woken-up command stream ahead of them
+WORKER_NICE = 10
+
+
+def _simulate(interface, channel, rate, stop):
+    """Send `rate` telemetry frames/s on the channel, cycling through the known boards
+    (for the python-can virtual bus, which only reaches buses in the same process)"""
+    import can
+
+    bus = can.Bus(channel, interface=interface)
+    messages = [can.Message(arbitration_id=can_id, data=bytes(range(8)), is_extended_id=False)
+                for can_id in TELEMETRY_LAYOUTS]
+    start, sent = time.perf_counter(), 0
+    while not stop.is_set():
+        due = int((time.perf_counter() - start) * rate)
+        while sent < due:
+            bus.send(messages[sent % len(messages)])
+            sent += 1
+        stop.wait(0.001)
+    bus.shutdown()
+
+
+def run_ingest(interface, channel, publish, stop, sender="telemetry", recipient="dashboard",
+               batch_size=64, batch_delay=0.005, simulate_rate=0, max_backlog=4096):
+    """Read the channel until `stop` is set and pass every TELEMETRY_BATCH to publish().
+    If publish() falls behind, frames beyond max_backlog waiting to be batched are dropped
+    (and logged as CanIngest overflows) instead of piling up in memory."""
+    import can
+    from can_ingest import CanIngest
+
+    bus = can.Bus(channel, interface=interface)
+    frames = queue.Queue(max_backlog)
+
+    def enqueue(frame):
+        try:
+            frames.put_nowait(frame)
+        except queue.Full:
+            return False
+        return True
+    ingest = CanIngest(bus, enqueue)
+    ingest.start()
+    simulator = None
+    if simulate_rate:
+        simulator = threading.Thread(target=_simulate, args=(interface, channel, simulate_rate, stop), daemon=True)
+        simulator.start()
+    batcher = FrameBatcher(sender, recipient, batch_size, batch_delay)
+    try:
+        while not stop.is_set():
+            time_left = batcher.time_left()
+            try:
+                batcher.add(frames.get(timeout=0.1 if time_left is None else time_left))
+            except queue.Empty:
+                pass
+            if batcher.time_left() == 0:
+                publish(batcher.flush())
+    finally:
+        ingest.close()
+        if simulator is not None:
+            simulator.join(timeout=1)
+        bus.shutdown()
+
+
+def _worker_main(connection, stop, interface, channel, nice, options, log_settings):
+    """Entry point of a worker process"""
+    setup_logging(**log_settings)   # a spawned process starts without the server's logging setup
+    if nice:
+        # Yield the CPU to the server (and its command path) whenever both want it
+        os.nice(nice)
+
+    def publish(message):
+        connection.send_bytes(message.SerializeToString())
+    try:
+        run_ingest(interface, channel, publish, stop, **options)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connection.close()
+
+
+class IngestWorker:
+    """One CAN channel read and batched in a worker process (or, for comparison, a thread of
+    this process), with its batches routed here by a reader thread"""
+
+    def __init__(self, router, interface, channel, use_process=True, nice=WORKER_NICE, **options):
+        self.router = router
+        self.interface = interface
+        self.channel = channel
+        self.use_process = use_process
+        self.nice = nice           # added to the worker process's niceness
+        self.options = options     # run_ingest keyword arguments
+        self.batches = 0
+        self.frames = 0
+        self.process = None
+        self.threads = []
+
+    def start(self):
+        if self.use_process:
+            receiver, connection = _CONTEXT.Pipe(duplex=False)
+            self.stop_event = _CONTEXT.Event()
+            self.process = _CONTEXT.Process(target=_worker_main, daemon=True, name=f"ingest-{self.channel}",
+                                            args=(connection, self.stop_event, self.interface, self.channel,
+                                                  self.nice, self.options, logging_settings()))
+            self.process.start()
+            connection.close()   # the worker holds the write end; EOF here once it exits
+            self.threads.append(threading.Thread(target=self._read_loop, args=(receiver,), daemon=True))
+        else:
+            self.stop_event = threading.Event()
+            self.threads.append(threading.Thread(
+                target=run_ingest, daemon=True,
+                args=(self.interface, self.channel, self._route, self.stop_event), kwargs=self.options))
+        for thread in self.threads:
+            thread.start()
+        logger.info(f"[Server] Ingesting CAN channel {self.channel} ({self.interface}) in "
+                    f"{'process ' + str(self.process.pid) if self.process else 'a thread'}")
+
+    def _route(self, message):
+        self.batches += 1
+        self.frames += len(message.frames)
+        self.router.route_message(message)
+
+    def _read_loop(self, receiver):
+        while True:
+            try:
+                data = receiver.recv_bytes()
+            except (EOFError, OSError):
+                break
+            self._route(host_pb2.HostMessage.FromString(data))
+        receiver.close()
+        if not self.stop_event.is_set():
+            logger.error(f"[Server] Ingest worker for CAN channel {self.channel} exited")
+
+    def close(self):
+        self.stop_event.set()
+        if self.process is not None:
+            self.process.join(timeout=2)
+            if self.process.is_alive():
+                self.process.terminate()
+        for thread in self.threads:
+            thread.join(timeout=2)
@@ -0,0 +1,195 @@
+"""Continuous liveness monitor for the nodes on the CAN bus.
+
+The monitor listens passively (it is a python-can Listener, added next to CanIngest on the
+telemetry client's Notifier) and keeps, per arbitration ID, the last time a frame was seen,
+the mean interval between frames and its jitter. A node is suspect once it has been quiet
+for longer than its usual interval allows (never less than `timeout`). Only then is it
+probed with the health check request (see healthcheck.py), and it is declared down if it
+still says nothing within another `timeout`. Nodes that keep talking are never probed, and
+a node that is down is probed at most once per `probe_interval`, so a short timeout does
+not flood the bus.
+
+Only the configured boards (`node_ids`) are watched by default. With watch_all=True other
+arbitration IDs are tracked passively too, but only once they have a steady frame history
+(LEARN_FRAMES frames at a regular interval), so a one-off frame is never reported down.
+Motor commands (MOTOR_COMMAND_ID) are never watched: they are sent when the operator acts.
+
+Every change (down, or back up) is handed to `on_change` as a NodeStatus; the telemetry
+client sends it to the server as a NODE_STATUS message, which is broadcast to every client
+ahead of queued telemetry.
+"""
+import logging
+import threading
+import time
+
+import can
+
+import host_pb2
+from can_protocol import MOTOR_COMMAND_ID
+from healthcheck import HEALTH_REQUEST, STM32_IDS
+
+logger = logging.getLogger("liveness")
+
+# Weight of a new interval in the running mean and jitter (as in RFC 3550's jitter estimate)
+SMOOTHING = 1 / 16
+# A node is suspect after its mean interval plus this many jitters of silence
+JITTER_MARGIN = 4
+# A passively watched ID counts as periodic after this many frames with a jitter of at most
+# STEADY_JITTER times its mean interval; before that its silence means nothing
+LEARN_FRAMES = 8
+STEADY_JITTER = 0.5
+# IDs that are never watched passively
+UNWATCHED_IDS = frozenset({MOTOR_COMMAND_ID})
+
+
+class _Node:
+    __slots__ = ("node_id", "probe", "last_seen", "frames", "mean_interval", "jitter", "alive", "probed_at",
+                 "probes")
+
+    def __init__(self, node_id, probe):
+        self.node_id = node_id
+        self.probe = probe            # answers the health check request
+        self.last_seen = None         # clock() time of the last frame
+        self.frames = 0
+        self.mean_interval = None
+        self.jitter = 0.0
+        self.alive = None             # None until the node has been seen or declared down
+        self.probed_at = None         # time of the last probe, if none has been answered since
+        self.probes = 0
+
+
+class LivenessMonitor(can.Listener):
+    """Per-node last-seen, interval and jitter from observed traffic, plus probes of silent nodes"""
+
+    def __init__(self, bus, on_change, node_ids=STM32_IDS, timeout=0.5, probe_interval=1.0,
+                 probe_request=HEALTH_REQUEST, watch_all=False, clock=time.monotonic):
+        self.bus = bus
+        self.clock = clock                      # seconds, monotonic (injectable for tests)
+        self.on_change = on_change              # called with a NodeStatus, outside the lock
+        self.timeout = timeout                  # seconds: minimum silence before a probe, and probe deadline
+        self.probe_interval = probe_interval    # seconds between probes of a node that stays down
+        self.probe_request = bytes(probe_request)
+        self.watch_all = watch_all              # also track periodic nodes outside node_ids (passively, never probed)
+        self.nodes = {node_id: _Node(node_id, probe=True) for node_id in node_ids}
+        self.started = clock()                  # nodes never seen are silent since then
+        self.lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.started = self.clock()
+        self._stopped.clear()
+        self.thread = threading.Thread(target=self._check_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """can.Listener hook, also called when the Notifier stops"""
+        self._stopped.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1)
+
+    def on_message_received(self, msg):
+        """Runs on the Notifier thread: only updates the node's counters"""
+        if msg.is_error_frame:
+            return
+        now = self.clock()
+        back = None
+        with self.lock:
+            node = self.nodes.get(msg.arbitration_id)
+            if node is None:
+                if not self.watch_all or msg.arbitration_id in UNWATCHED_IDS:
+                    return
+                node = self.nodes[msg.arbitration_id] = _Node(msg.arbitration_id, probe=False)
+            if node.alive is False:
+                # Reported with how long the node was gone; the first sighting is not a change
+                back = self._status(node, now)
+                back.alive = True
+            node.alive = True
+            if node.last_seen is not None:
+                interval = now - node.last_seen
+                if node.mean_interval is None:
+                    node.mean_interval = interval
+                elif back is None:   # the outage itself is not an interval
+                    node.jitter += (abs(interval - node.mean_interval) - node.jitter) * SMOOTHING
+                    node.mean_interval += (interval - node.mean_interval) * SMOOTHING
+            node.last_seen = now
+            node.frames += 1
+            node.probed_at = None
+        if back is not None:
+            logger.info(f"[Liveness] Node 0x{back.node_id:X} is back after {back.silent_for * 1000:.0f} ms")
+            self.on_change(back)
+
+    def suspect_after(self, node):
+        """Seconds of silence after which a node is probed (or, if it can't be probed, counts as down)"""
+        if node.mean_interval is None:
+            return self.timeout
+        return max(self.timeout, node.mean_interval + JITTER_MARGIN * node.jitter)
+
+    @staticmethod
+    def periodic(node):
+        """Whether a passively watched node has sent steadily enough for its silence to mean something"""
+        return (node.frames >= LEARN_FRAMES and node.mean_interval is not None
+                and node.jitter <= STEADY_JITTER * node.mean_interval)
+
+    def check(self, now=None):
+        """Probe nodes that went quiet and declare down the ones that stayed quiet.
+        Runs every timeout/4 on the monitor thread; returns the NodeStatus changes."""
+        now = self.clock() if now is None else now
+        probes, changes = [], []
+        with self.lock:
+            for node in self.nodes.values():
+                if not node.probe and node.alive is not False and not self.periodic(node):
+                    continue
+                silent_for = now - (node.last_seen if node.last_seen is not None else self.started)
+                if silent_for < self.suspect_after(node):
+                    continue
+                if node.probe:
+                    if node.probed_at is None or (node.alive is False and now - node.probed_at >= self.probe_interval):
+                        node.probed_at = now
+                        node.probes += 1
+                        probes.append(node.node_id)
+                        continue
+                    if now - node.probed_at < self.timeout:
+                        continue   # waiting for the answer
+                elif silent_for < self.suspect_after(node) + self.timeout:
+                    continue
+                if node.alive is not False:
+                    node.alive = False
+                    changes.append(self._status(node, now))
+        for node_id in probes:
+            try:
+                self.bus.send(can.Message(arbitration_id=node_id, data=self.probe_request, is_extended_id=False))
+            except can.CanError as e:
+                logger.error(f"[Liveness] Failed to probe node 0x{node_id:X}: {e}")
+        for status in changes:
+            logger.warning(f"[Liveness] Node 0x{status.node_id:X} is down: silent for {status.silent_for * 1000:.0f} ms")
+            self.on_change(status)
+        return changes
+
+    def _status(self, node, now):
+        return host_pb2.NodeStatus(
+            node_id=node.node_id,
+            alive=bool(node.alive),
+            silent_for=now - (node.last_seen if node.last_seen is not None else self.started),
+            mean_interval=node.mean_interval or 0.0,
+            jitter=node.jitter,
+        )
+
+    def _check_loop(self):
+        period = max(0.005, self.timeout / 4)
+        while not self._stopped.wait(period):
+            self.check()
+
+    def stats(self):
+        """{node ID: {alive, silent_for, frames, mean_interval, jitter, probes}}"""
+        now = self.clock()
+        with self.lock:
+            return {node.node_id: {
+                "alive": node.alive,
+                "silent_for": None if node.last_seen is None else now - node.last_seen,
+                "frames": node.frames,
+                "mean_interval": node.mean_interval,
+                "jitter": node.jitter,
+                "probes": node.probes,
+            } for node in self.nodes.values()}
+
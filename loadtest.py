@@ -0,0 +1,322 @@
+"""Load generator for the host server.
+
+Starts a HostServer (in-process thread pool, in-process grpc.aio, or `python HostServer.py`
+as a subprocess), attaches N telemetry streams, M dashboards and one motor control stream
+through the real host_pb2_grpc stubs, drives them at fixed rates and reports throughput and
+end-to-end latency of telemetry -> dashboard and dashboard -> motor_control as JSON.
+
+    python loadtest.py --telemetry 4 --dashboards 2 --rate 2000 --duration 10 --out run.json
+
+Each frame carries its send time (time.time()) in CanFrame.timestamp, so latency includes
+batching on the telemetry side and every queue on the way.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import grpc
+import host_pb2
+import host_pb2_grpc
+from benchmark import percentile, quiet, start_server
+from can_protocol import MC_STOP, MC_THROTTLE, MOTOR_COMMAND_ID, TELEMETRY_LAYOUTS, FrameBatcher, make_frame, telemetry_frames
+from HostServer import AsyncHostControlServicer, HostControlServicer
+
+TELEMETRY_IDS = tuple(TELEMETRY_LAYOUTS)
+PAYLOAD = bytes(range(8))
+
+
+def latency_summary(latencies, sent, received, duration):
+    """Throughput and latency percentiles (milliseconds) of one path"""
+    summary = {
+        "sent": sent,
+        "received": received,
+        "throughput_per_s": round(received / duration, 1),
+    }
+    if latencies:
+        ms = [latency * 1000 for latency in latencies]
+        summary["latency_ms"] = {
+            "mean": round(statistics.mean(ms), 3),
+            "p50": round(percentile(ms, 50), 3),
+            "p99": round(percentile(ms, 99), 3),
+            "p999": round(percentile(ms, 99.9), 3),
+            "max": round(max(ms), 3),
+        }
+    return summary
+
+
+def paced(rate, stop, time_left=lambda: None):
+    """Yield the number of items due at each tick so that `rate` items/s are produced
+    until stop is set. Sleeps until the next item is due, or earlier if time_left()
+    (e.g. FrameBatcher.time_left) says something else is; missed items are caught up."""
+    start = time.perf_counter()
+    produced = 0
+    while not stop.is_set():
+        due = int((time.perf_counter() - start) * rate) - produced
+        produced += due
+        yield due
+        wait = start + (produced + 1) / rate - time.perf_counter()
+        other = time_left()
+        if other is not None:
+            wait = min(wait, other)
+        if wait > 0:
+            stop.wait(wait)
+
+
+class LoadTest:
+    """N telemetry streams + M dashboards + one motor control stream against one server address"""
+
+    def __init__(self, address, telemetry_streams, dashboards, rate, command_rate, batch_size, batch_delay,
+                 router=None, stop_rate=0):
+        self.address = address
+        self.router = router                # in-process MessageRouter, for its drop counts
+        self.telemetry_streams = telemetry_streams
+        self.dashboards = dashboards
+        self.rate = rate                    # frames/s per telemetry stream
+        self.command_rate = command_rate    # motor commands/s from the first dashboard
+        self.stop_rate = stop_rate          # MC_STOP commands/s from the last dashboard
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.go = threading.Event()         # starts the commands, once every consumer is connected
+        self.stop = threading.Event()       # ends the request streams
+        self.finish = threading.Event()     # closes the channels once in-flight messages have drained
+        self.channels = []
+        self.threads = []
+        self.frames_sent = 0
+        self.commands_sent = 0
+        self.stops_sent = 0
+        self.telemetry_latencies = []       # one list per dashboard
+        self.command_latencies = []
+        self.stop_latencies = []
+        self.lock = threading.Lock()
+
+    def _stub(self):
+        channel = grpc.insecure_channel(self.address)
+        self.channels.append(channel)
+        return host_pb2_grpc.HostControlStub(channel)
+
+    def _run(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _consume(self, responses, on_response):
+        with contextlib.suppress(grpc.RpcError):
+            for response in responses:
+                on_response(response)
+
+    def _telemetry_requests(self, client_id):
+        yield host_pb2.HostMessage(sender=client_id, recipient="dashboard", command="Telemetry connected")
+        batcher = FrameBatcher(client_id, "dashboard", self.batch_size, self.batch_delay)
+        sent = 0
+        for due in paced(self.rate, self.stop, batcher.time_left):
+            for _ in range(due):
+                batcher.add(make_frame(TELEMETRY_IDS[sent % len(TELEMETRY_IDS)], PAYLOAD, time.time()))
+                sent += 1
+                if batcher.time_left() == 0:
+                    yield batcher.flush()
+            if batcher.time_left() == 0:
+                yield batcher.flush()
+        while batcher.pending:
+            yield batcher.flush()
+        with self.lock:
+            self.frames_sent += sent
+        self.finish.wait()
+
+    def _dashboard_requests(self, client_id, send_commands, send_stops):
+        yield host_pb2.HostMessage(sender=client_id, recipient="motor_control", command="Dashboard connected")
+        # A dashboard sends throttle commands or STOPs, so the two share no client-side stream
+        rate, data = None, None
+        if send_commands and self.command_rate:
+            rate, data = self.command_rate, bytes([MC_THROTTLE, 50])
+        elif send_stops and self.stop_rate:
+            rate, data = self.stop_rate, bytes([MC_STOP])
+        if rate:
+            self.go.wait()
+            sent = 0
+            for due in paced(rate, self.stop):
+                for _ in range(due):
+                    yield host_pb2.HostMessage(
+                        sender=client_id,
+                        recipient="motor_control",
+                        kind=host_pb2.MOTOR_COMMAND,
+                        frame=make_frame(MOTOR_COMMAND_ID, data, time.time()),
+                    )
+                    sent += 1
+            with self.lock:
+                if data[0] == MC_STOP:
+                    self.stops_sent += sent
+                else:
+                    self.commands_sent += sent
+        self.finish.wait()
+
+    def _motor_requests(self):
+        yield host_pb2.HostMessage(sender="motor_control", recipient="server", command="Motor Control connected")
+        self.finish.wait()
+
+    def start_consumers(self):
+        """Connect the motor control stream and the dashboards"""
+        self.command_latencies = []
+        self.stop_latencies = []
+
+        def on_command(response):
+            if response.kind == host_pb2.MOTOR_COMMAND:
+                latencies = self.stop_latencies if response.frame.data[:1] == bytes([MC_STOP]) else self.command_latencies
+                latencies.append(time.time() - response.frame.timestamp)
+
+        self._run(self._consume, self._stub().MotorControlStream(self._motor_requests()), on_command)
+
+        for i in range(self.dashboards):
+            latencies = []
+            self.telemetry_latencies.append(latencies)
+
+            def on_telemetry(response, latencies=latencies):
+                now = time.time()
+                latencies.extend(now - frame.timestamp for frame in telemetry_frames(response))
+
+            requests = self._dashboard_requests(f"dashboard_{i}", send_commands=(i == 0),
+                                                send_stops=(i == self.dashboards - 1 and (i > 0 or not self.command_rate)))
+            self._run(self._consume, self._stub().CommandStream(requests), on_telemetry)
+
+    def start_producers(self):
+        for i in range(self.telemetry_streams):
+            stub = self._stub()
+            self._run(self._consume, stub.TelemetryStream(self._telemetry_requests(f"telemetry_{i}")),
+                      lambda response: None)
+
+    def run(self, duration, warmup=0.5, drain=1.0):
+        self.start_consumers()
+        time.sleep(warmup)   # let every dashboard register before telemetry starts
+        start = time.perf_counter()
+        self.go.set()
+        self.start_producers()
+        time.sleep(duration)
+        self.stop.set()
+        elapsed = time.perf_counter() - start
+        time.sleep(drain)
+        drops = self.router.drop_counts() if self.router is not None else None
+        self.finish.set()
+        for channel in self.channels:
+            channel.close()
+        for thread in self.threads:
+            thread.join(timeout=2)
+
+        telemetry_latencies = [latency for latencies in self.telemetry_latencies for latency in latencies]
+        results = {
+            "telemetry_to_dashboard": latency_summary(
+                telemetry_latencies, self.frames_sent * self.dashboards, len(telemetry_latencies), elapsed),
+            "dashboard_to_motor_control": latency_summary(
+                self.command_latencies, self.commands_sent, len(self.command_latencies), elapsed),
+        }
+        if self.stop_rate:
+            results["stop_to_motor_control"] = latency_summary(
+                self.stop_latencies, self.stops_sent, len(self.stop_latencies), elapsed)
+        if drops is not None:
+            results["server_drops"] = drops
+        return results
+
+
+@contextlib.contextmanager
+def in_process_server(max_workers):
+    """Thread-pool HostServer in this process"""
+    servicer = HostControlServicer()
+    server, address = start_server(servicer, max_workers=max_workers)
+    try:
+        yield address, servicer
+    finally:
+        server.stop(None).wait()
+
+
+@contextlib.contextmanager
+def in_process_async_server():
+    """grpc.aio HostServer on an event loop in a background thread"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    async def start():
+        servicer = AsyncHostControlServicer()
+        server = grpc.aio.server()
+        host_pb2_grpc.add_HostControlServicer_to_server(servicer, server)
+        port = server.add_insecure_port("localhost:0")
+        await server.start()
+        return server, servicer, port
+
+    server, servicer, port = asyncio.run_coroutine_threadsafe(start(), loop).result()
+    try:
+        yield f"localhost:{port}", servicer
+    finally:
+        asyncio.run_coroutine_threadsafe(server.stop(None), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+@contextlib.contextmanager
+def subprocess_server(use_asyncio, max_workers):
+    """`python HostServer.py` on a free port"""
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        port = probe.getsockname()[1]
+    command = [sys.executable, "HostServer.py", "--port", str(port), "--metrics-port", "0",
+               "--log-level", "warning", "--max-workers", str(max_workers), "--unix-socket", ""]
+    if use_asyncio:
+        command.append("--asyncio")
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    address = f"localhost:{port}"
+    try:
+        with grpc.insecure_channel(address) as channel:
+            grpc.channel_ready_future(channel).result(timeout=10)
+        yield address, None
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive HostServer with synthetic clients and report JSON results")
+    parser.add_argument("--server", choices=("thread", "asyncio", "subprocess"), default="thread",
+                        help="in-process thread-pool server, in-process grpc.aio server, or HostServer.py")
+    parser.add_argument("--asyncio", action="store_true", help="with --server subprocess, pass --asyncio")
+    parser.add_argument("--telemetry", type=int, default=2, help="telemetry streams (N)")
+    parser.add_argument("--dashboards", type=int, default=2, help="dashboards (M)")
+    parser.add_argument("--rate", type=float, default=1000, help="frames/s per telemetry stream")
+    parser.add_argument("--command-rate", type=float, default=20, help="motor commands/s")
+    parser.add_argument("--stop-rate", type=float, default=0,
+                        help="MC_STOP commands/s from the last dashboard (needs 2 dashboards with --command-rate)")
+    parser.add_argument("--batch", type=int, default=64, help="max frames per TELEMETRY_BATCH message")
+    parser.add_argument("--batch-delay", type=float, default=0.005, help="max seconds a frame waits for its batch")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load")
+    parser.add_argument("--out", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    # Each stream holds a worker of the thread-pool server (two for dashboards and motor control)
+    max_workers = 2 * (args.telemetry + args.dashboards + 1) + 4
+    if args.server == "thread":
+        server = in_process_server(max_workers)
+    elif args.server == "asyncio":
+        server = in_process_async_server()
+    else:
+        server = subprocess_server(args.asyncio, max_workers)
+
+    with quiet(), server as (address, servicer):
+        load = LoadTest(address, args.telemetry, args.dashboards, args.rate, args.command_rate,
+                        args.batch, args.batch_delay, router=servicer.router if servicer else None,
+                        stop_rate=args.stop_rate)
+        cpu_start = time.process_time()
+        results = load.run(args.duration)
+        results["process_cpu_s"] = round(time.process_time() - cpu_start, 3)
+
+    results["config"] = {key: value for key, value in vars(args).items() if key != "out"}
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as out:
+            out.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
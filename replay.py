@@ -0,0 +1,395 @@
+"""Replay a recorded run (see flight_recorder.py) through a running HostServer.
+
+Every recorded sender becomes a real client again: telemetry senders use TelemetryStream,
+motor control uses MotorControlStream and everything else (dashboards) uses CommandStream,
+each on its own channel with the recorded client ID. Messages are sent at their original
+timing, N times faster, or as fast as the server takes them.
+
+Two sink clients check whether the server kept up: a dashboard subscribed to all telemetry
+('replay_sink') and, unless the run already has one, a 'motor_control' stream. The report
+gives how late messages went out against the schedule (lag), how long each took to reach a
+sink, and how many never arrived (drops).
+
+With --compare-encodings, four more dashboards receive all telemetry, each in one of
+ENCODINGS (plain frames, gzip, delta, delta + gzip) and each through its own proxy that
+counts the bytes the server sends it, so the report gives what a remote dashboard would
+cost on the wire and whether the delta dashboards ended with the same values as the plain one.
+
+    python replay.py recordings/run-20250101-120000              # original timing
+    python replay.py recordings/run-20250101-120000 --speed 10   # 10x
+    python replay.py recordings/run-20250101-120000 --fast       # as fast as possible
+    python replay.py recordings/run-20250101-120000 --compare-encodings
+"""
+import argparse
+import collections
+import contextlib
+import json
+import queue
+import socket
+import threading
+import time
+
+import grpc
+import host_pb2
+import host_pb2_grpc
+from can_protocol import (DELTA_ENCODING, TELEMETRY_COMPRESSION_METADATA, TELEMETRY_ENCODING_METADATA,
+                          DeltaDecoder, telemetry_frames)
+from client_runtime import COMPRESSION_ALGORITHMS, SERVER_ADDRESS
+from flight_recorder import FlightLog
+from loadtest import latency_summary
+
+TELEMETRY_KINDS = (host_pb2.TELEMETRY, host_pb2.TELEMETRY_BATCH)
+SINK_ID = "replay_sink"
+MOTOR_ID = "motor_control"
+
+# Dashboard stream encodings compared by --compare-encodings: name -> (delta, compression)
+ENCODINGS = {
+    "plain": (False, None),
+    "gzip": (False, "gzip"),
+    "delta": (True, None),
+    "delta+gzip": (True, "gzip"),
+}
+
+_STOP = object()
+
+
+def stream_types(log, start=None, end=None):
+    """Which stream each recorded sender used: 'telemetry', 'motor_control' or 'dashboard'"""
+    types = {}
+    for record in log.records(start, end):
+        if types.get(record.sender) == "telemetry":
+            continue
+        message = record.message()
+        if message.kind in TELEMETRY_KINDS:
+            types[record.sender] = "telemetry"
+        elif record.sender not in types:
+            types[record.sender] = "motor_control" if record.recipient == "server" else "dashboard"
+    return types
+
+
+class ByteCountingProxy:
+    """TCP proxy on localhost in front of the server, counting the bytes that pass through
+    it in each direction (HTTP/2 framing and all, as on the wire)"""
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.address = f"127.0.0.1:{self.listener.getsockname()[1]}"
+        self.bytes_down = 0     # server -> client
+        self.bytes_up = 0       # client -> server
+        self.lock = threading.Lock()
+        self.sockets = []
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _connect_upstream(self):
+        if self.upstream.startswith("unix:"):
+            upstream = socket.socket(socket.AF_UNIX)
+            upstream.connect(self.upstream[len("unix:"):])
+            return upstream
+        host, _, port = self.upstream.rpartition(":")
+        return socket.create_connection((host, int(port)))
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+                upstream = self._connect_upstream()
+            except OSError:
+                break
+            self.sockets += [client, upstream]
+            threading.Thread(target=self._pipe, args=(upstream, client, "bytes_down"), daemon=True).start()
+            threading.Thread(target=self._pipe, args=(client, upstream, "bytes_up"), daemon=True).start()
+
+    def _pipe(self, source, destination, counter):
+        with contextlib.suppress(OSError):
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                destination.sendall(data)
+                with self.lock:
+                    setattr(self, counter, getattr(self, counter) + len(data))
+        with contextlib.suppress(OSError):
+            destination.shutdown(socket.SHUT_WR)
+
+    def close(self):
+        self.listener.close()
+        for sock in self.sockets:
+            sock.close()
+
+
+class EncodingSink:
+    """A dashboard receiving all telemetry in one of ENCODINGS through a ByteCountingProxy"""
+
+    def __init__(self, name, address, topics=()):
+        self.name = name
+        self.topics = list(topics)
+        self.delta, self.compression = ENCODINGS[name]
+        self.proxy = ByteCountingProxy(address)
+        self.decoder = DeltaDecoder()
+        self.messages = 0
+        self.frames = 0
+        self.values = {}        # arbitration ID -> latest payload
+        self.bytes_at_start = 0
+
+    def metadata(self):
+        metadata = [(TELEMETRY_ENCODING_METADATA, DELTA_ENCODING)] if self.delta else []
+        if self.compression:
+            metadata.append((TELEMETRY_COMPRESSION_METADATA, self.compression))
+        return metadata
+
+    def on_response(self, response):
+        self.messages += 1
+        for frame in self.decoder.decode(response):
+            self.frames += 1
+            self.values[frame.arbitration_id] = frame.data
+
+
+class Replay:
+    """Re-injects a FlightLog through real client streams and measures delivery to the sinks"""
+
+    def __init__(self, log, address=SERVER_ADDRESS, speed=1.0, start=None, end=None, motor_sink=True,
+                 encodings=(), encoding_topics=()):
+        self.log = log
+        self.address = address
+        self.speed = speed            # 1.0 = original timing, 0 = as fast as possible
+        self.start = start
+        self.end = end
+        self.motor_sink = motor_sink
+        self.encoding_sinks = [EncodingSink(name, address, encoding_topics) for name in encodings]
+        self.finish = threading.Event()
+        self.channels = []
+        self.threads = []
+        self.outbound = {}            # sender -> SimpleQueue of (scheduled time, message)
+        self.send_lags = []           # seconds each message went out after its scheduled time
+        self.messages_sent = 0
+        # What the sinks should receive: key -> scheduled send times, oldest first
+        self.pending = collections.defaultdict(collections.deque)
+        self.pending_lock = threading.Lock()
+        self.frames_sent = 0
+        self.commands_sent = 0
+        self.telemetry_latencies = []
+        self.command_latencies = []
+
+    def _stub(self, address=None, compression=None):
+        channel = grpc.insecure_channel(address or self.address, compression=COMPRESSION_ALGORITHMS.get(compression))
+        grpc.channel_ready_future(channel).result(timeout=10)
+        self.channels.append(channel)
+        return host_pb2_grpc.HostControlStub(channel)
+
+    def _run(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _consume(self, responses, on_response=None):
+        with contextlib.suppress(grpc.RpcError):
+            for response in responses:
+                if on_response is not None:
+                    on_response(response)
+
+    def _requests(self, outbound):
+        while True:
+            item = outbound.get()
+            if item is _STOP:
+                break
+            scheduled, message = item
+            self.send_lags.append(time.perf_counter() - scheduled)
+            yield message
+        self.finish.wait()
+
+    def _sink_requests(self, first_message):
+        yield first_message
+        self.finish.wait()
+
+    def _expect(self, key, scheduled):
+        with self.pending_lock:
+            self.pending[key].append(scheduled)
+
+    def _arrived(self, key, now):
+        """Seconds since the oldest matching in-flight message was scheduled, or None"""
+        with self.pending_lock:
+            waiting = self.pending.get(key)
+            if waiting:
+                return now - waiting.popleft()
+        return None
+
+    def _on_sink_telemetry(self, response):
+        now = time.perf_counter()
+        for frame in telemetry_frames(response):
+            latency = self._arrived(("frame", frame.SerializeToString()), now)
+            if latency is not None:
+                self.telemetry_latencies.append(latency)
+
+    def _on_motor_command(self, response):
+        if response.kind != host_pb2.MOTOR_COMMAND:
+            return
+        latency = self._arrived(("command", response.SerializeToString()), time.perf_counter())
+        if latency is not None:
+            self.command_latencies.append(latency)
+
+    def connect(self, types):
+        """Open the sinks, and a channel per recorded sender (streams start with its first message)"""
+        sink = host_pb2.HostMessage(sender=SINK_ID, recipient="server", command="Replay sink connected")
+        self._run(self._consume, self._stub().CommandStream(self._sink_requests(sink)), self._on_sink_telemetry)
+        if self.motor_sink and MOTOR_ID not in types:
+            motor = host_pb2.HostMessage(sender=MOTOR_ID, recipient="server", command="Replay motor sink connected")
+            self._run(self._consume, self._stub().MotorControlStream(self._sink_requests(motor)),
+                      self._on_motor_command)
+            types = dict(types, **{MOTOR_ID: None})
+        for sink in self.encoding_sinks:
+            hello = host_pb2.HostMessage(sender=f"{SINK_ID}_{sink.name}", recipient="server",
+                                         command="Replay encoding sink connected", topics=sink.topics)
+            stub = self._stub(sink.proxy.address, sink.compression)
+            self._run(self._consume, stub.CommandStream(self._sink_requests(hello), metadata=sink.metadata()),
+                      sink.on_response)
+        self.stubs = {sender: self._stub() for sender, stream_type in types.items() if stream_type}
+        self.types = types
+
+    def _open_stream(self, sender):
+        outbound = self.outbound[sender] = queue.SimpleQueue()
+        stub = self.stubs[sender]
+        rpc = {"telemetry": stub.TelemetryStream, "motor_control": stub.MotorControlStream,
+               "dashboard": stub.CommandStream}[self.types[sender]]
+        # A replayed motor_control stream also receives the replayed commands
+        on_response = self._on_motor_command if sender == MOTOR_ID else None
+        self._run(self._consume, rpc(self._requests(outbound)), on_response)
+        return outbound
+
+    def run(self, drain=1.0):
+        """Dispatch every record on schedule, then wait `drain` seconds for deliveries"""
+        for sink in self.encoding_sinks:
+            sink.bytes_at_start = sink.proxy.bytes_down
+        replay_start = time.perf_counter()
+        first_timestamp = None
+        for record in self.log.records(self.start, self.end):
+            if first_timestamp is None:
+                first_timestamp = record.timestamp
+            scheduled = replay_start
+            if self.speed:
+                scheduled += (record.timestamp - first_timestamp) / self.speed
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                scheduled = time.perf_counter()
+
+            message = record.message()
+            if message.kind in TELEMETRY_KINDS:
+                frames = telemetry_frames(message)
+                for frame in frames:
+                    self._expect(("frame", frame.SerializeToString()), scheduled)
+                self.frames_sent += len(frames)
+            elif message.kind == host_pb2.MOTOR_COMMAND and record.recipient == MOTOR_ID:
+                self._expect(("command", record.payload), scheduled)
+                self.commands_sent += 1
+
+            outbound = self.outbound.get(record.sender) or self._open_stream(record.sender)
+            outbound.put((scheduled, message))
+            self.messages_sent += 1
+
+        for outbound in self.outbound.values():
+            outbound.put(_STOP)
+        elapsed = time.perf_counter() - replay_start
+        time.sleep(drain)
+        encodings = self._encoding_results(elapsed)
+        self.finish.set()
+        for channel in self.channels:
+            channel.close()
+        for thread in self.threads:
+            thread.join(timeout=2)
+        for sink in self.encoding_sinks:
+            sink.proxy.close()
+
+        recorded = 0.0 if first_timestamp is None else record.timestamp - first_timestamp
+        results = {
+            "recorded_seconds": round(recorded, 3),
+            "replay_seconds": round(elapsed, 3),
+            "achieved_speed": round(recorded / elapsed, 2) if elapsed else None,
+            "messages_sent": self.messages_sent,
+            "send_lag_ms": latency_summary(self.send_lags, self.messages_sent, len(self.send_lags),
+                                           elapsed).get("latency_ms"),
+            "telemetry_frames": latency_summary(self.telemetry_latencies, self.frames_sent,
+                                                len(self.telemetry_latencies), elapsed),
+            "motor_commands": latency_summary(self.command_latencies, self.commands_sent,
+                                              len(self.command_latencies), elapsed),
+        }
+        results["telemetry_frames"]["dropped"] = self.frames_sent - len(self.telemetry_latencies)
+        results["motor_commands"]["dropped"] = self.commands_sent - len(self.command_latencies)
+        if encodings:
+            results["encodings"] = encodings
+        return results
+
+    def _encoding_results(self, elapsed):
+        """Bytes each encoding sink received during the replay, against the first sink's
+        (plain, in ENCODINGS order), and whether it ended with the same telemetry values"""
+        results = {}
+        baseline = None
+        for sink in self.encoding_sinks:
+            received = sink.proxy.bytes_down - sink.bytes_at_start
+            if baseline is None:
+                baseline = sink
+                baseline_bytes = received
+            results[sink.name] = {
+                "bytes": received,
+                "bytes_per_s": round(received / elapsed) if elapsed else None,
+                "saving_pct": round(100 * (1 - received / baseline_bytes), 1) if baseline_bytes else None,
+                "messages": sink.messages,
+                "frames": sink.frames,
+                "values_match": sink.values == baseline.values,
+                "missed_deltas": sink.decoder.missed,
+            }
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded run through a running HostServer")
+    parser.add_argument("run", help="run directory written by HostServer.py --record")
+    parser.add_argument("--address", default=SERVER_ADDRESS, help="server to replay into")
+    timing = parser.add_mutually_exclusive_group()
+    timing.add_argument("--speed", type=float, default=1.0, help="replay N times faster than recorded")
+    timing.add_argument("--fast", action="store_true", help="send as fast as the server accepts")
+    parser.add_argument("--start", type=float, help="seconds into the run to start at")
+    parser.add_argument("--end", type=float, help="seconds into the run to stop at")
+    parser.add_argument("--no-motor-sink", action="store_true",
+                        help="don't connect a motor_control sink (e.g. the real motor client is running)")
+    parser.add_argument("--compare-encodings", action="store_true",
+                        help="measure the bytes/s a remote dashboard receives with each of: " + ", ".join(ENCODINGS))
+    parser.add_argument("--encoding-topic", action="append", default=[],
+                        help="with --compare-encodings, what those dashboards subscribe to, e.g. 'all@10' "
+                             "(repeatable, default all telemetry)")
+    parser.add_argument("--out", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    log = FlightLog(args.run)
+    types = stream_types(log, args.start, args.end)
+    print(f"[Replay] {args.run}: " + ", ".join(f"{sender} ({stream_type})" for sender, stream_type in types.items()))
+    replay = Replay(log, args.address, 0 if args.fast else args.speed, args.start, args.end,
+                    motor_sink=not args.no_motor_sink, encodings=ENCODINGS if args.compare_encodings else (), encoding_topics=args.encoding_topic)
+    replay.connect(types)
+    time.sleep(0.5)   # let the sinks register before the first message
+    results = replay.run()
+
+    telemetry, commands = results["telemetry_frames"], results["motor_commands"]
+    print(f"[Replay] {results['messages_sent']} messages: {results['recorded_seconds']}s of recording "
+          f"in {results['replay_seconds']}s ({results['achieved_speed']}x)")
+    if results["send_lag_ms"]:
+        print(f"[Replay] Send lag: p50={results['send_lag_ms']['p50']}ms p99={results['send_lag_ms']['p99']}ms "
+              f"max={results['send_lag_ms']['max']}ms")
+    for name, path in (("Telemetry frames", telemetry), ("Motor commands", commands)):
+        line = f"[Replay] {name}: {path['received']}/{path['sent']} delivered, {path['dropped']} dropped"
+        if "latency_ms" in path:
+            line += f", latency p50={path['latency_ms']['p50']}ms p99={path['latency_ms']['p99']}ms"
+        print(line)
+    for name, encoding in results.get("encodings", {}).items():
+        print(f"[Replay] Dashboard stream, {name}: {encoding['bytes_per_s'] / 1000:.1f} kB/s "
+              f"({encoding['saving_pct']}% saved), {encoding['messages']} messages, "
+              f"{encoding['frames']} frames, final values {'match' if encoding['values_match'] else 'DIFFER'}")
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(results, out, indent=2)
+            out.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Shared-memory ring of CAN frames between the telemetry client and the server on the same Pi.
+
+With `--shm-ring` on both sides, the server creates a multiprocessing.shared_memory segment
+holding a ring of fixed-size frame records, and the telemetry client's CanIngest writes the
+frames it reads into it instead of serializing them onto the gRPC stream. No protobuf
+and no socket sit between the bus and the router. gRPC still carries everything else
+(liveness alerts, terminal input) and the traffic to dashboards.
+
+One writer, any number of readers. The writer never waits: it overwrites the oldest record,
+and a reader that falls a full ring behind skips ahead and counts the frames it lost. Each
+reader keeps its own position, so every reader sees every frame.
+
+Layout: a 64-byte header (magic, capacity, record size, write sequence, owner PID) followed by
+`capacity` records of RECORD (timestamp, arbitration ID, length, 8 data bytes, sequence + 1),
+in the machine's native byte order. The write sequence is read and written through a
+memoryview cast to 'Q', i.e. one aligned 8-byte load or store, so a reader never sees it
+half-written. struct.pack_into can't be used for it: it zeroes its target before writing.
+The writer fills a record, its sequence last, before it advances the write sequence. A
+reader stops at a record whose sequence is not there yet and drops records the writer may
+have been overwriting while it read.
+
+The server polls the ring, backing off from poll_interval to max_poll_interval while it
+stays empty, so an idle server wakes only a few times a second. The header holds the PID of
+the server that created the ring, cleared when it closes it: a server only replaces a ring
+whose owner is gone, and a writer moves to the new ring (or its fallback) when it sees that.
+"""
+import logging
+import os
+import struct
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import host_pb2
+
+logger = logging.getLogger("can_ingest")
+
+SHM_RING_NAME = "waterloop_can"
+MAGIC = b"WLRING01"
+HEADER = struct.Struct("8sII")      # magic, capacity, record size
+WRITE_SEQ_OFFSET = 16               # frames written so far (uint64)
+OWNER = struct.Struct("I")          # PID of the server that created the ring
+OWNER_OFFSET = 24
+HEADER_SIZE = 64
+RECORD = struct.Struct("dIB3x8sQ")  # timestamp, arbitration ID, length, data, sequence + 1 (32 bytes)
+
+_created = set()   # segments this process created, which its resource tracker must keep tracking
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass   # alive, but another user's
+    return True
+
+
+def _attach(name):
+    """Open an existing segment without letting this process's resource tracker unlink it at exit"""
+    try:
+        return shared_memory.SharedMemory(name, track=False)   # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name)
+        if shm._name not in _created:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class ShmRing:
+    """A mapped ring segment; use create() in the owner and attach() everywhere else"""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        magic, self.capacity, record_size = HEADER.unpack_from(self.buf)
+        if magic != MAGIC or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f"shared memory {shm.name!r} is not a CAN frame ring")
+        self.mask = self.capacity - 1
+        self.seq_view = self.buf[WRITE_SEQ_OFFSET:WRITE_SEQ_OFFSET + 8].cast("Q")
+
+    @classmethod
+    def create(cls, name=SHM_RING_NAME, capacity=65536):
+        """A new ring of `capacity` records (a power of two), replacing a stale one of the same
+        name. Raises FileExistsError if the segment belongs to a running server (or isn't a ring)."""
+        if capacity & (capacity - 1):
+            raise ValueError("capacity must be a power of two")
+        size = HEADER_SIZE + capacity * RECORD.size
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            existing = _attach(name)
+            try:
+                magic = bytes(existing.buf[:len(MAGIC)]) if existing.size >= HEADER_SIZE else None
+                owner, = OWNER.unpack_from(existing.buf, OWNER_OFFSET) if magic == MAGIC else (None,)
+            finally:
+                existing.close()
+            if magic != MAGIC:
+                raise FileExistsError(f"shared memory {name!r} exists and is not a CAN frame ring") from None
+            if owner and _process_alive(owner):
+                raise FileExistsError(f"shared memory ring {name!r} is in use by process {owner}") from None
+            # Left behind by a server that did not shut down cleanly
+            stale = _attach(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        HEADER.pack_into(shm.buf, 0, MAGIC, capacity, RECORD.size)   # the new segment is zero-filled
+        OWNER.pack_into(shm.buf, OWNER_OFFSET, os.getpid())
+        _created.add(shm._name)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name=SHM_RING_NAME):
+        return cls(_attach(name), owner=False)
+
+    def write_seq(self):
+        return self.seq_view[0]
+
+    def in_use(self):
+        """Whether the server that created the ring still has it open"""
+        owner, = OWNER.unpack_from(self.buf, OWNER_OFFSET)
+        return owner != 0 and _process_alive(owner)
+
+    def close(self):
+        """Unmap the segment (and remove it, in the owner)"""
+        if getattr(self, "seq_view", None) is not None:
+            self.seq_view.release()
+            self.seq_view = None
+            if self.owner:
+                OWNER.pack_into(self.buf, OWNER_OFFSET, 0)   # tells writers still attached that it's gone
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _created.discard(self.shm._name)
+
+
+class ShmRingWriter:
+    """The ring's single writer; write() has CanIngest's raw sink signature.
+
+    About once a second (going by the frame timestamps) it checks that the server still has
+    the ring open. If a restarted server has replaced it, the writer moves to the new ring;
+    while there is none, frames go to `fallback` (same signature), or are dropped."""
+
+    def __init__(self, ring, fallback=None, check_interval=1.0):
+        self.ring = ring
+        self.name = ring.shm.name
+        self.fallback = fallback
+        self.check_interval = check_interval
+        self.next_check = 0.0
+        self.seq = ring.write_seq()   # a restarted writer continues where the last one stopped
+
+    def write(self, arbitration_id, data, timestamp):
+        if timestamp >= self.next_check:
+            self.next_check = timestamp + self.check_interval
+            self._check()
+        ring = self.ring
+        if ring is None:
+            return self.fallback(arbitration_id, data, timestamp) if self.fallback else False
+        seq = self.seq
+        RECORD.pack_into(ring.buf, HEADER_SIZE + (seq & ring.mask) * RECORD.size,
+                         timestamp, arbitration_id, len(data), data, seq + 1)
+        self.seq = seq + 1
+        ring.seq_view[0] = seq + 1
+
+    def _check(self):
+        if self.ring is not None and self.ring.in_use():
+            return
+        try:
+            ring = ShmRing.attach(self.name)
+        except (FileNotFoundError, ValueError):
+            ring = None
+        if ring is not None and not ring.in_use():
+            ring.close()   # left behind by a server that is no longer running
+            ring = None
+        if ring is None:
+            if self.ring is not None:
+                self.ring.close()
+                self.ring = None
+                logger.warning(f"[Telemetry] The server's shared memory ring {self.name} is gone, "
+                               + ("streaming over gRPC instead" if self.fallback else "dropping frames"))
+            return
+        if self.ring is not None:
+            self.ring.close()
+        self.ring = ring
+        self.seq = ring.write_seq()
+        logger.warning(f"[Telemetry] Attached to the server's new shared memory ring {self.name}")
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+class ShmRingReader:
+    """One reader's position in the ring, starting at the newest frame"""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.pos = ring.write_seq()
+        self.read_count = 0
+        self.lost = 0       # frames overwritten before this reader got to them
+
+    def read(self, max_records=None):
+        """[(arbitration_id, data, timestamp)] of the frames written since the last call"""
+        ring = self.ring
+        head = ring.write_seq()
+        if head - self.pos > ring.capacity:
+            self.lost += head - self.pos - ring.capacity
+            self.pos = head - ring.capacity
+        end = head if max_records is None else min(head, self.pos + max_records)
+        # Copy the records out in at most two contiguous spans (the second after wrapping around)
+        records = []
+        start, count = self.pos & ring.mask, end - self.pos
+        first = min(count, ring.capacity - start)
+        for index, n in ((start, first), (0, count - first)):
+            if n:
+                records.extend(RECORD.iter_unpack(
+                    ring.buf[HEADER_SIZE + index * RECORD.size:HEADER_SIZE + (index + n) * RECORD.size]))
+        # Records the writer reached again while they were being copied may be torn
+        first_safe = ring.write_seq() - ring.capacity + 1
+        frames = []
+        for pos, (timestamp, arbitration_id, length, data, seq) in enumerate(records, self.pos):
+            if pos < first_safe:
+                self.lost += 1
+            elif seq == pos + 1:
+                frames.append((arbitration_id, data[:length], timestamp))
+            else:
+                end = pos   # not visible yet: read it next time
+                break
+        self.read_count += len(frames)
+        self.pos = end
+        return frames
+
+
+class RingIngest:
+    """Routes the frames in a ring as TELEMETRY_BATCH messages, from a thread of the server.
+    Same start()/close() interface as ingest_pool.IngestWorker."""
+
+    def __init__(self, router, name=SHM_RING_NAME, capacity=65536, sender="telemetry", recipient="dashboard",
+                 batch_size=64, poll_interval=0.001, max_poll_interval=0.05):
+        self.router = router
+        self.ring = ShmRing.create(name, capacity)
+        self.reader = ShmRingReader(self.ring)
+        self.sender = sender
+        self.recipient = recipient
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval          # seconds between looks at a ring that just went empty
+        self.max_poll_interval = max_poll_interval  # ... doubling up to this while it stays empty
+        self.frames = 0
+        self._stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._read_loop, daemon=True)
+        self.thread.start()
+        logger.info(f"[Server] Reading telemetry from shared memory ring {self.ring.shm.name} "
+                    f"({self.ring.capacity} frames)")
+
+    def _read_loop(self):
+        wait = self.poll_interval
+        while not self._stopped.is_set():
+            records = self.reader.read(self.batch_size)
+            if not records:
+                self._stopped.wait(wait)
+                wait = min(wait * 2, self.max_poll_interval)
+                continue
+            wait = self.poll_interval
+            self.frames += len(records)
+            message = host_pb2.HostMessage(sender=self.sender, recipient=self.recipient, kind=host_pb2.TELEMETRY_BATCH)
+            add = message.frames.add   # builds each CanFrame in place rather than copying it in
+            for arbitration_id, data, timestamp in records:
+                add(arbitration_id=arbitration_id, data=data, timestamp=timestamp)
+            self.router.route_message(message)
+
+    def close(self):
+        self._stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+        if self.reader.lost:
+            logger.warning(f"[Server] {self.reader.lost} frames were overwritten in the shared memory ring "
+                           f"before they were routed")
+        self.ring.close()
@@ -0,0 +1,37 @@
+"""Tests for the delta-encoded telemetry stream (run with `python -m pytest`)"""
+import host_pb2
+from can_protocol import DeltaDecoder, DeltaEncoder, make_frame
+
+
+def batch(*frames):
+    return host_pb2.HostMessage(sender="telemetry", recipient="dashboard", kind=host_pb2.TELEMETRY_BATCH,
+                                frames=[make_frame(arbitration_id, bytes(data), timestamp)
+                                        for arbitration_id, data, timestamp in frames])
+
+
+def round_trip(*batches):
+    encoder, decoder = DeltaEncoder(keyframe_interval=60), DeltaDecoder()
+    received = []
+    for message in batches:
+        encoded = encoder.encode(message)
+        if encoded is not None:
+            received.extend((frame.arbitration_id, bytes(frame.data)) for frame in decoder.decode(encoded))
+    return received
+
+
+def test_standard_ids_round_trip():
+    assert round_trip(batch((0x200, [1, 2, 3, 4], 1.0), (0x7FF, [5], 1.0)),
+                      batch((0x200, [1, 2, 9, 4], 1.01))) == [(0x200, b"\1\2\3\4"), (0x7FF, b"\5"),
+                                                              (0x200, b"\1\2\x09\4")]
+
+
+def test_id_above_11_bits_round_trips():
+    assert round_trip(batch((0x200, [1], 1.0)),
+                      batch((0x801, [7, 8], 1.01), (0x200, [2], 1.01)),
+                      batch((0x200, [3], 1.02))) == [(0x200, b"\1"), (0x801, b"\7\x08"), (0x200, b"\2"),
+                                                     (0x200, b"\3")]
+
+
+def test_extended_id_round_trips():
+    assert round_trip(batch((0x18FF50E5, [1, 2, 3], 1.0)),
+                      batch((0x18FF50E5, [1, 2, 4], 1.01))) == [(0x18FF50E5, b"\1\2\3"), (0x18FF50E5, b"\1\2\4")]
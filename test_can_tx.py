@@ -0,0 +1,62 @@
+"""Tests for the motor client's CAN transmit stage (run with `python -m pytest`)"""
+import threading
+
+from can_protocol import MC_START, MC_STOP, MC_THROTTLE, MOTOR_COMMAND_ID
+from can_tx import CanTransmitter
+
+OTHER_ID = 0x100
+
+
+class FakeTask:
+    def __init__(self, frame, period):
+        self.frame = frame
+        self.period = period
+        self.stopped = False
+
+    def modify_data(self, frame):
+        self.frame = frame
+
+    def stop(self):
+        self.stopped = True
+
+
+class FakeBus:
+    """Records sent frames; a send on OTHER_ID blocks the TX thread until `release` is set"""
+
+    def __init__(self):
+        self.sent = []
+        self.tasks = []
+        self.blocked = threading.Event()
+        self.release = threading.Event()
+
+    def send(self, frame):
+        if frame.arbitration_id == OTHER_ID:
+            self.blocked.set()
+            self.release.wait(5)
+        self.sent.append((frame.arbitration_id, bytes(frame.data)))
+
+    def send_periodic(self, frame, period):
+        task = FakeTask(frame, period)
+        self.tasks.append(task)
+        return task
+
+
+def test_stop_discards_queued_motor_frames_and_keep_alive():
+    bus = FakeBus()
+    tx = CanTransmitter(bus, can_ids=(MOTOR_COMMAND_ID,))
+    tx.start()
+    try:
+        tx.set_periodic("throttle", MOTOR_COMMAND_ID, [MC_THROTTLE, 10], 0.1)
+        tx.enqueue(OTHER_ID, [1])
+        assert bus.blocked.wait(5)   # the keep-alive is running and the TX thread is stuck in a send
+        tx.enqueue(MOTOR_COMMAND_ID, [MC_START, 50])
+        tx.enqueue(MOTOR_COMMAND_ID, [MC_THROTTLE, 40])
+        tx.set_periodic("throttle", MOTOR_COMMAND_ID, [MC_THROTTLE, 40], 0.1)
+        tx.enqueue(MOTOR_COMMAND_ID, [MC_STOP])
+        bus.release.set()
+    finally:
+        tx.close()
+    assert [data for can_id, data in bus.sent if can_id == MOTOR_COMMAND_ID] == [bytes([MC_STOP])]
+    assert len(bus.tasks) == 1 and bus.tasks[0].stopped
+    stats = tx.stats()
+    assert stats["periodic"] == [] and stats["discarded"] == 3
@@ -0,0 +1,52 @@
+"""Tests for the flight recorder (run with `python -m pytest`)"""
+import errno
+
+import host_pb2
+from flight_recorder import SEGMENT_HEADER, FlightLog, FlightRecorder
+
+
+def record_run(directory, count=100, step=0.1):
+    recorder = FlightRecorder(str(directory), max_segment_bytes=2048, index_interval=1.0)
+    for i in range(count):
+        recorder.record(host_pb2.HostMessage(sender="telemetry", recipient="dashboard", command=str(i)),
+                        timestamp=1000.0 + i * step)
+    recorder.close()
+    return recorder
+
+
+def test_run_reads_back_in_full(tmp_path):
+    recorder = record_run(tmp_path)
+    log = FlightLog(str(tmp_path))
+    assert recorder.recorded == 100 and len(log.segments) > 1
+    assert [record.message().command for record in log.records()] == [str(i) for i in range(100)]
+
+
+def test_time_range_seeks_through_index(tmp_path):
+    record_run(tmp_path)
+    log = FlightLog(str(tmp_path))
+    offsets = []
+    read_segment = log._read_segment
+
+    def spy(path, offset=None):
+        offsets.append((path, offset))
+        return read_segment(path, offset)
+    log._read_segment = spy
+    records = list(log.records(start=5.05, end=6.95))
+    assert [record.message().command for record in records] == [str(i) for i in range(51, 70)]
+    # Started from an indexed record part way through a later segment, not from the top of the run
+    assert offsets[0][0] != log.segments[0]
+    assert offsets[0][1] is not None and offsets[0][1] > SEGMENT_HEADER.size
+
+
+def test_write_error_stops_recording(tmp_path):
+    recorder = FlightRecorder(str(tmp_path))
+
+    def disk_full(timestamp):
+        raise OSError(errno.ENOSPC, "No space left on device")
+    recorder._open_segment = disk_full
+    recorder.record(host_pb2.HostMessage(sender="telemetry", command="lost"))
+    recorder.thread.join(timeout=5)
+    assert recorder.failed and not recorder.thread.is_alive()
+    recorder.record(host_pb2.HostMessage(sender="telemetry", command="not queued"))
+    assert recorder.queue.empty()
+    recorder.close()
@@ -0,0 +1,114 @@
+"""Tests for the server's client queues and telemetry conflation (run with `python -m pytest`)"""
+import host_pb2
+from can_protocol import BMS_ID, IMU_ID, MC_START, MC_STOP, MC_THROTTLE, MOTOR_COMMAND_ID, make_frame
+from HostServer import CONTROL_TRAFFIC, ClientQueue, MessageRouter, TelemetryConflator
+
+
+def motor_command(*data):
+    return host_pb2.HostMessage(sender="dashboard", recipient="motor_control", kind=host_pb2.MOTOR_COMMAND,
+                                frame=make_frame(MOTOR_COMMAND_ID, bytes(data)))
+
+
+def drain(client_queue):
+    messages = []
+    while True:
+        message = client_queue.get(timeout=0)
+        if message is None:
+            return messages
+        messages.append(message)
+
+
+def test_start_then_stop_ends_stopped():
+    router = MessageRouter()
+    router.register_client("motor_control", "motor_control")
+    router.route_message(motor_command(MC_START, 50))
+    router.route_message(motor_command(MC_STOP))
+    received = []
+    while True:
+        message = router.get_message("motor_control", timeout=0)
+        if message is None:
+            break
+        received.append(message.frame.data[0])
+    assert received[-1] == MC_STOP
+    assert MC_START not in received
+
+
+def test_stop_discards_only_earlier_motor_commands():
+    client_queue = ClientQueue()
+    client_queue.put(motor_command(MC_THROTTLE, 40))
+    client_queue.put(motor_command(MC_STOP))
+    client_queue.put(motor_command(MC_START, 20))
+    assert [message.frame.data[0] for message in drain(client_queue)] == [MC_STOP, MC_START]
+    assert client_queue.stats()["dropped"][CONTROL_TRAFFIC] == 1
+
+
+def test_stop_goes_ahead_of_telemetry():
+    client_queue = ClientQueue()
+    client_queue.put(host_pb2.HostMessage(kind=host_pb2.TELEMETRY, frame=make_frame(0x1E, bytes(7))))
+    client_queue.put(motor_command(MC_STOP))
+    assert [message.kind for message in drain(client_queue)] == [host_pb2.MOTOR_COMMAND, host_pb2.TELEMETRY]
+
+
+def test_replaced_frame_keeps_its_enqueue_time(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("HostServer.time.monotonic", lambda: clock[0])
+    client_queue = ClientQueue()
+    client_queue.put(host_pb2.HostMessage(kind=host_pb2.TELEMETRY, frame=make_frame(BMS_ID, bytes([1] * 7))))
+    clock[0] = 100.4
+    client_queue.put(host_pb2.HostMessage(kind=host_pb2.TELEMETRY, frame=make_frame(BMS_ID, bytes([2] * 7))))
+    clock[0] = 100.5
+    message, = drain(client_queue)
+    assert message.frame.data[0] == 2
+    _, count, total = client_queue.stats()["latency"]
+    assert count == 1 and abs(total - 0.5) < 1e-9
+
+
+def telemetry_batch(*frames):
+    return host_pb2.HostMessage(sender="telemetry", kind=host_pb2.TELEMETRY_BATCH,
+                                frames=[make_frame(can_id, bytes(data), timestamp) for can_id, data, timestamp in frames])
+
+
+def sent_frames(messages):
+    frames = []
+    for message in messages:
+        if message.kind == host_pb2.TELEMETRY:
+            frames.append((message.frame.arbitration_id, message.frame.data[0]))
+        elif message.kind == host_pb2.TELEMETRY_BATCH:
+            frames.extend((frame.arbitration_id, frame.data[0]) for frame in message.frames)
+    return frames
+
+
+def test_conflator_sends_one_update_per_id_per_interval():
+    conflator = TelemetryConflator({BMS_ID: (1.0, False), IMU_ID: (1.0, False)})
+    batch = telemetry_batch(*[(BMS_ID, [value] * 7, 0.0) for value in range(5)],
+                            *[(IMU_ID, [value] * 8, 0.0) for value in range(3)])
+    assert sent_frames(conflator.add(batch, now=0.0)) == [(BMS_ID, 4), (IMU_ID, 2)]
+    assert conflator.conflated == 6
+    assert conflator.add(telemetry_batch((BMS_ID, [9] * 7, 0.5)), now=0.5) == []
+
+
+def test_conflator_sends_held_frame_when_interval_ends():
+    conflator = TelemetryConflator({BMS_ID: (1.0, False)})
+    conflator.add(telemetry_batch((BMS_ID, [1] * 7, 0.0)), now=0.0)
+    conflator.add(telemetry_batch((BMS_ID, [2] * 7, 0.3)), now=0.3)
+    conflator.add(telemetry_batch((BMS_ID, [3] * 7, 0.6)), now=0.6)
+    messages, wait = conflator.release(0.9)
+    assert messages == [] and abs(wait - 0.1) < 1e-9
+    messages, wait = conflator.release(1.0)
+    assert sent_frames(messages) == [(BMS_ID, 3)]
+    assert wait is None
+
+
+def test_conflator_aggregates_signals_over_window():
+    conflator = TelemetryConflator({BMS_ID: (1.0, True)})
+    first, = conflator.add(telemetry_batch((BMS_ID, [10] * 7, 0.0), (BMS_ID, [11] * 7, 0.0)), now=0.0)
+    assert [aggregate.count for aggregate in first.aggregates] == [2]
+    assert conflator.add(telemetry_batch((BMS_ID, [20] * 7, 0.2), (BMS_ID, [60] * 7, 0.4)), now=0.4) == []
+    (message,), _ = conflator.release(1.0)
+    assert message.kind == host_pb2.TELEMETRY_AGGREGATE
+    aggregate, = message.aggregates
+    assert aggregate.count == 2
+    assert aggregate.window_start == 0.2
+    assert aggregate.latest.data[0] == 60
+    stats = {signal.name: (signal.min, signal.max, signal.mean) for signal in aggregate.signals}
+    assert stats["MUX1_TEMP"] == (20, 60, 40)
@@ -0,0 +1,86 @@
+"""Tests for the CAN liveness monitor, on an injected clock (run with `python -m pytest`)"""
+import can
+import pytest
+
+from can_protocol import MOTOR_COMMAND_ID
+from liveness import JITTER_MARGIN, LEARN_FRAMES, LivenessMonitor
+
+NODE = 0x200
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ProbeLog:
+    """Stands in for the bus: only collects the probes sent"""
+
+    def __init__(self):
+        self.probes = []
+
+    def send(self, msg):
+        self.probes.append(msg.arbitration_id)
+
+
+def monitor(**options):
+    clock, changes = Clock(), []
+    options.setdefault("node_ids", (NODE,))
+    return LivenessMonitor(ProbeLog(), changes.append, clock=clock, **options), clock, changes
+
+
+def frames(liveness, clock, node_id, intervals):
+    for interval in intervals:
+        clock.now += interval
+        liveness.on_message_received(can.Message(arbitration_id=node_id, data=b"\0"))
+
+
+def test_probe_down_and_back_up():
+    liveness, clock, changes = monitor(timeout=0.05, probe_interval=1.0)
+    frames(liveness, clock, NODE, [0.1] + [0.08, 0.12] * 20)
+    node = liveness.nodes[NODE]
+    suspect_after = liveness.suspect_after(node)
+    assert suspect_after == pytest.approx(node.mean_interval + JITTER_MARGIN * node.jitter)
+    assert suspect_after > node.mean_interval + 0.05
+    last_seen = clock.now
+
+    assert liveness.check(last_seen + suspect_after - 0.001) == [] and liveness.bus.probes == []
+    probed_at = last_seen + suspect_after + 0.001
+    assert liveness.check(probed_at) == [] and liveness.bus.probes == [NODE]
+    assert liveness.check(probed_at + 0.049) == []
+    down, = liveness.check(probed_at + 0.051)
+    assert down.node_id == NODE and not down.alive
+
+    # Still down: probed again only once per probe_interval
+    for now in (probed_at + 0.2, probed_at + 0.5, probed_at + 0.99):
+        assert liveness.check(now) == []
+    assert liveness.bus.probes == [NODE]
+    liveness.check(probed_at + 1.0)
+    assert liveness.bus.probes == [NODE, NODE]
+
+    clock.now = probed_at + 1.2
+    frames(liveness, clock, NODE, [0])
+    assert [(status.node_id, status.alive) for status in changes] == [(NODE, False), (NODE, True)]
+
+
+def test_watch_all_adopts_only_steady_ids():
+    liveness, clock, _ = monitor(node_ids=(), timeout=0.05, watch_all=True)
+    frames(liveness, clock, 0x600, [0.1] * (LEARN_FRAMES - 1))
+    assert liveness.check(clock.now + 10) == []
+
+    liveness, clock, _ = monitor(node_ids=(), timeout=0.05, watch_all=True)
+    frames(liveness, clock, 0x600, [0.1] * LEARN_FRAMES)
+    frames(liveness, clock, MOTOR_COMMAND_ID, [0.1] * 20)
+    down, = liveness.check(clock.now + 10)
+    assert down.node_id == 0x600 and not down.alive
+    assert MOTOR_COMMAND_ID not in liveness.nodes
+    assert liveness.bus.probes == []   # passively watched IDs are never probed
+
+
+def test_other_ids_ignored_by_default():
+    liveness, clock, _ = monitor(timeout=0.05)
+    frames(liveness, clock, 0x600, [0.1] * 20)
+    assert 0x600 not in liveness.nodes
@@ -0,0 +1,37 @@
+"""Tests for the shared memory frame ring (run with `python -m pytest`)"""
+import os
+
+import pytest
+
+from shm_ring import ShmRing, ShmRingReader, ShmRingWriter
+
+RING = f"test_ring_{os.getpid()}"
+
+
+def test_open_ring_is_not_replaced():
+    ring = ShmRing.create(RING, 64)
+    try:
+        with pytest.raises(FileExistsError):
+            ShmRing.create(RING, 64)
+    finally:
+        ring.close()
+
+
+def test_writer_follows_restarted_server():
+    server = ShmRing.create(RING, 64)
+    fallback = []
+    writer = ShmRingWriter(ShmRing.attach(RING), fallback=lambda *frame: fallback.append(frame))
+    try:
+        writer.write(1, b"a", 100.0)
+        assert ShmRingReader(server).read() == [] and server.write_seq() == 1
+        server.close()
+        writer.write(2, b"b", 101.0)
+        assert fallback == [(2, b"b", 101.0)]
+        server = ShmRing.create(RING, 64)
+        reader = ShmRingReader(server)
+        writer.write(3, b"c", 102.0)
+        assert reader.read() == [(3, b"c", 102.0)]
+        assert len(fallback) == 1
+    finally:
+        writer.close()
+        server.close()